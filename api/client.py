@@ -2,10 +2,16 @@
 Клиент для работы с NanoBanana API
 Обновлено согласно официальной документации
 """
+import os
 import requests
-import time
+from concurrent.futures import Future
 from typing import Optional, List
 from .models import GenerationRequest, EditRequest, CombineRequest, APIResponse
+from .handles import TaskHandle
+from .polling import poll_scheduler, make_poll_key, PollKey
+from .rate_limiter import get_rate_limiter, parse_retry_after, KIND_CREATE, KIND_POLL
+from .task_poller import PollDeferred, task_poller
+from utils.http_session import get_session
 
 
 class NanoBananaAPIClient:
@@ -21,18 +27,91 @@ class NanoBananaAPIClient:
     # Фиктивный callback URL (требуется API, но не используется для десктопного приложения)
     DUMMY_CALLBACK = "https://example.com/callback"
     
-    def __init__(self, api_key: str):
+    # Сколько раз повторять создание задачи после ответа 429
+    MAX_THROTTLE_RETRIES = 3
+    
+    def __init__(self, api_key: str, rate_limiter=None, api_root: str = None):
         """
         Инициализация клиента
         
         Args:
             api_key: API ключ от NanoBanana
+            rate_limiter: Лимитер запросов (по умолчанию общий для ключа, см. get_rate_limiter)
+            api_root: Корень API (по умолчанию NANOBANANA_API_URL или боевой адрес)
         """
+        api_root = api_root or os.getenv("NANOBANANA_API_URL")
+        if api_root:
+            self._use_api_root(api_root)
         self.api_key = api_key
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        # Общая для всех клиентов сессия с пулом keep-alive соединений к API
+        self.session = get_session(self.BASE_URL)
+        # Общая статистика времени выполнения задач для адаптивного опроса
+        self.poll_scheduler = poll_scheduler
+        # Общий опросчик статуса задач (один поток на процесс)
+        self.task_poller = task_poller
+        # Лимит частоты запросов для ключа (создание задач и опрос отдельно)
+        self.rate_limiter = rate_limiter or get_rate_limiter(api_key)
+    
+    def _use_api_root(self, api_root: str):
+        """
+        Направить клиент на другой адрес API (например, локальный симулятор)
+        
+        Args:
+            api_root: Корень API вида http://127.0.0.1:8090/api/v1
+        """
+        api_root = api_root.rstrip("/")
+        self.BASE_URL = f"{api_root}/nanobanana"
+        self.GENERATE_URL = f"{self.BASE_URL}/generate"
+        self.GENERATE_PRO_URL = f"{self.BASE_URL}/generate-pro"
+        self.TASK_INFO_URL = f"{self.BASE_URL}/record-info"
+        self.CREDIT_URL = f"{api_root}/common/credit"
+    
+    def _throttled(self, response, kind: str) -> bool:
+        """
+        Проверить ответ на ограничение частоты (HTTP 429 или code 429 в теле)
+        
+        При ограничении bucket блокируется на время из Retry-After.
+        
+        Returns:
+            True если API ответил 429
+        """
+        throttled = response.status_code == 429
+        if not throttled and response.status_code == 200:
+            try:
+                throttled = response.json().get("code") == 429
+            except (ValueError, AttributeError):
+                pass
+        if throttled:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            print(f"API ограничил частоту запросов ({kind}), пауза {retry_after} сек")
+            self.rate_limiter.throttle(kind, retry_after)
+        return throttled
+    
+    def _post_task(self, url: str, data: dict):
+        """
+        Отправить запрос создания задачи с учетом лимита частоты
+        
+        После ответа 429 запрос повторяется (задача в этом случае не
+        создана), но не более MAX_THROTTLE_RETRIES раз.
+        
+        Returns:
+            requests.Response последней попытки
+        """
+        for _ in range(self.MAX_THROTTLE_RETRIES + 1):
+            self.rate_limiter.acquire(KIND_CREATE)
+            response = self.session.post(
+                url,
+                headers=self.headers,
+                json=data,
+                timeout=30
+            )
+            if not self._throttled(response, KIND_CREATE):
+                break
+        return response
     
     def _create_task(self, url: str, data: dict) -> Optional[str]:
         """
@@ -46,12 +125,7 @@ class NanoBananaAPIClient:
             taskId или None при ошибке
         """
         try:
-            response = requests.post(
-                url,
-                headers=self.headers,
-                json=data,
-                timeout=30
-            )
+            response = self._post_task(url, data)
             
             if response.status_code == 200:
                 result = response.json()
@@ -78,72 +152,126 @@ class NanoBananaAPIClient:
             print(f"Ошибка создания задачи: {e}")
             return None
     
-    def _get_task_status(self, task_id: str, max_wait: int = 300) -> dict:
+    def _check_task(self, task_id: str) -> Optional[dict]:
         """
-        Получить статус задачи с polling
+        Однократно запросить статус задачи
+        
+        Args:
+            task_id: ID задачи
+            
+        Returns:
+            Словарь с результатом задачи или None, если задача еще выполняется
+        
+        Raises:
+            PollDeferred: Лимит опросов ключа исчерпан (TaskPoller перенесет
+                          опрос, не занимая поток пула ожиданием)
+        """
+        wait = self.rate_limiter.try_acquire(KIND_POLL)
+        if wait > 0:
+            raise PollDeferred(wait)
+        try:
+            response = self.session.get(
+                self.TASK_INFO_URL,
+                headers=self.headers,
+                params={"taskId": task_id},
+                timeout=10
+            )
+            
+            # При 429 задача остается на опросе, следующий запрос - после Retry-After
+            if self._throttled(response, KIND_POLL):
+                return None
+            
+            if response.status_code == 200:
+                result = response.json()
+                if result.get("code") == 200 and "data" in result:
+                    data = result["data"]
+                    success_flag = data.get("successFlag")
+                    
+                    # 0: GENERATING - задача обрабатывается
+                    # 1: SUCCESS - успешно завершена
+                    # 2: CREATE_TASK_FAILED - ошибка создания задачи
+                    # 3: GENERATE_FAILED - ошибка генерации
+                    
+                    if success_flag == 1:
+                        # Успешно завершено
+                        response_data = data.get("response", {})
+                        image_url = response_data.get("resultImageUrl")
+                        return {
+                            "success": True,
+                            "image_url": image_url,
+                            "task_id": task_id
+                        }
+                    elif success_flag in [2, 3]:
+                        # Ошибка
+                        error_msg = data.get("errorMessage", "Неизвестная ошибка генерации")
+                        return {
+                            "success": False,
+                            "error": error_msg,
+                            "task_id": task_id
+                        }
+                    # Иначе продолжаем ждать (success_flag == 0)
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка при опросе статуса: {e}")
+        except Exception as e:
+            print(f"Неожиданная ошибка: {e}")
+        return None
+    
+    def _get_task_status(self, task_id: str, max_wait: int = 300, poll_key: PollKey = None) -> dict:
+        """
+        Дождаться завершения задачи
         
         Args:
             task_id: ID задачи
             max_wait: Максимальное время ожидания в секундах
+            poll_key: Ключ статистики опроса (см. make_poll_key)
             
         Returns:
             Словарь с результатом задачи
         """
-        start_time = time.time()
-        poll_interval = 3  # Опрашиваем каждые 3 секунды
+        return self._watch_task(task_id, max_wait, poll_key).result()
+    
+    def _watch_task(self, task_id: str, max_wait: int = 300, poll_key: PollKey = None) -> Future:
+        """
+        Поставить задачу на опрос статуса
         
-        while time.time() - start_time < max_wait:
-            try:
-                response = requests.get(
-                    self.TASK_INFO_URL,
-                    headers=self.headers,
-                    params={"taskId": task_id},
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("code") == 200 and "data" in result:
-                        data = result["data"]
-                        success_flag = data.get("successFlag")
-                        
-                        # 0: GENERATING - задача обрабатывается
-                        # 1: SUCCESS - успешно завершена
-                        # 2: CREATE_TASK_FAILED - ошибка создания задачи
-                        # 3: GENERATE_FAILED - ошибка генерации
-                        
-                        if success_flag == 1:
-                            # Успешно завершено
-                            response_data = data.get("response", {})
-                            image_url = response_data.get("resultImageUrl")
-                            return {
-                                "success": True,
-                                "image_url": image_url,
-                                "task_id": task_id
-                            }
-                        elif success_flag in [2, 3]:
-                            # Ошибка
-                            error_msg = data.get("errorMessage", "Неизвестная ошибка генерации")
-                            return {
-                                "success": False,
-                                "error": error_msg,
-                                "task_id": task_id
-                            }
-                        # Иначе продолжаем ждать (success_flag == 0)
-                
-                time.sleep(poll_interval)
-            except requests.exceptions.RequestException as e:
-                print(f"Ошибка при опросе статуса: {e}")
-                time.sleep(poll_interval)
-            except Exception as e:
-                print(f"Неожиданная ошибка: {e}")
-                time.sleep(poll_interval)
-        
-        return {
-            "success": False,
-            "error": "Превышено время ожидания генерации",
-            "task_id": task_id
-        }
+        Задача регистрируется в общем TaskPoller, который опрашивает все
+        незавершенные задачи процесса по графику PollScheduler, и передает
+        результат через Future.
+        
+        Args:
+            task_id: ID задачи
+            max_wait: Максимальное время ожидания в секундах
+            poll_key: Ключ статистики опроса (см. make_poll_key)
+            
+        Returns:
+            Future со словарем результата задачи
+        """
+        return self.task_poller.register(
+            task_id,
+            lambda: self._check_task(task_id),
+            poll_key=poll_key,
+            max_wait=max_wait
+        )
+    
+    def _submit_task(self, url: str, data: dict, poll_key: PollKey,
+                     create_error: str, default_error: str) -> TaskHandle:
+        """
+        Создать задачу и поставить ее на опрос
+        
+        Args:
+            url: URL эндпоинта
+            data: Данные для отправки
+            poll_key: Ключ статистики опроса
+            create_error: Сообщение, если задачу не удалось создать
+            default_error: Сообщение об ошибке выполнения по умолчанию
+            
+        Returns:
+            TaskHandle задачи
+        """
+        task_id = self._create_task(url, data)
+        if not task_id:
+            return TaskHandle.failed(create_error)
+        return TaskHandle(task_id, self._watch_task(task_id, poll_key=poll_key), default_error)
     
     def generate_image(self, request: GenerationRequest, reference_urls: List[str] = None) -> APIResponse:
         """
@@ -156,20 +284,34 @@ class NanoBananaAPIClient:
         Returns:
             APIResponse с результатом
         """
+        return self.submit_generate(request, reference_urls).result()
+    
+    def submit_generate(self, request: GenerationRequest, reference_urls: List[str] = None) -> TaskHandle:
+        """
+        Создать задачу генерации, не дожидаясь результата
+        
+        Args:
+            request: Параметры генерации
+            reference_urls: Список публичных URL референсных изображений (если уже загружены)
+            
+        Returns:
+            TaskHandle, результат которого - APIResponse
+        """
         # Используем обычный эндпоинт для Flash, Pro для Pro модели
         if request.model == "pro":
-            return self._generate_pro(request, reference_urls)
+            return self._submit_pro(request, reference_urls)
         else:
             # Референсы поддерживаются только в Pro API
             if reference_urls:
-                return APIResponse(
-                    success=False,
-                    error_message="Референсные изображения поддерживаются только в Pro модели"
-                )
-            return self._generate_standard(request)
+                return TaskHandle.failed("Референсные изображения поддерживаются только в Pro модели")
+            return self._submit_standard(request)
     
     def _generate_standard(self, request: GenerationRequest) -> APIResponse:
         """Генерация через обычный эндпоинт"""
+        return self._submit_standard(request).result()
+    
+    def _submit_standard(self, request: GenerationRequest) -> TaskHandle:
+        """Создание задачи генерации через обычный эндпоинт"""
         # Используем указанный aspect ratio или по умолчанию "1:1"
         aspect_ratio = request.aspect_ratio or "1:1"
         
@@ -184,30 +326,22 @@ class NanoBananaAPIClient:
         # Добавляем опциональные параметры
         # В стандартном API нет негативного промпта, пропускаем
         
-        # Создаем задачу
-        task_id = self._create_task(self.GENERATE_URL, data)
-        if not task_id:
-            return APIResponse(
-                success=False,
-                error_message="Не удалось создать задачу генерации"
-            )
-        
-        # Ожидаем завершения
-        result = self._get_task_status(task_id)
-        
-        if result.get("success"):
-            return APIResponse(
-                success=True,
-                image_url=result.get("image_url")
-            )
-        else:
-            return APIResponse(
-                success=False,
-                error_message=result.get("error", "Ошибка генерации")
-            )
+        # Создаем задачу и ставим ее на опрос
+        poll_key = make_poll_key("generate", request.model, None, aspect_ratio)
+        return self._submit_task(
+            self.GENERATE_URL,
+            data,
+            poll_key,
+            "Не удалось создать задачу генерации",
+            "Ошибка генерации"
+        )
     
     def _generate_pro(self, request: GenerationRequest, reference_urls: List[str] = None) -> APIResponse:
         """Генерация через Pro эндпоинт"""
+        return self._submit_pro(request, reference_urls).result()
+    
+    def _submit_pro(self, request: GenerationRequest, reference_urls: List[str] = None) -> TaskHandle:
+        """Создание задачи генерации через Pro эндпоинт"""
         # Преобразуем разрешение
         resolution_map = {
             "1024": "1K",
@@ -229,33 +363,18 @@ class NanoBananaAPIClient:
         # Добавляем референсные изображения если есть
         if reference_urls:
             if len(reference_urls) > 8:
-                return APIResponse(
-                    success=False,
-                    error_message="Максимум 8 референсных изображений"
-                )
+                return TaskHandle.failed("Максимум 8 референсных изображений")
             data["imageUrls"] = reference_urls
         
-        # Создаем задачу
-        task_id = self._create_task(self.GENERATE_PRO_URL, data)
-        if not task_id:
-            return APIResponse(
-                success=False,
-                error_message="Не удалось создать задачу генерации"
-            )
-        
-        # Ожидаем завершения
-        result = self._get_task_status(task_id)
-        
-        if result.get("success"):
-            return APIResponse(
-                success=True,
-                image_url=result.get("image_url")
-            )
-        else:
-            return APIResponse(
-                success=False,
-                error_message=result.get("error", "Ошибка генерации")
-            )
+        # Создаем задачу и ставим ее на опрос
+        poll_key = make_poll_key("generate-pro", "pro", resolution, aspect_ratio)
+        return self._submit_task(
+            self.GENERATE_PRO_URL,
+            data,
+            poll_key,
+            "Не удалось создать задачу генерации",
+            "Ошибка генерации"
+        )
     
     def edit_image(self, request: EditRequest, image_url: str = None) -> APIResponse:
         """
@@ -268,12 +387,22 @@ class NanoBananaAPIClient:
         Returns:
             APIResponse с результатом
         """
+        return self.submit_edit(request, image_url).result()
+    
+    def submit_edit(self, request: EditRequest, image_url: str = None) -> TaskHandle:
+        """
+        Создать задачу редактирования, не дожидаясь результата
+        
+        Args:
+            request: Параметры редактирования
+            image_url: Публичный URL изображения (если уже загружено)
+            
+        Returns:
+            TaskHandle, результат которого - APIResponse
+        """
         # Если URL не предоставлен, нужно загрузить изображение
         if not image_url:
-            return APIResponse(
-                success=False,
-                error_message="Требуется публичный URL изображения. Загрузите изображение на публичный хостинг."
-            )
+            return TaskHandle.failed("Требуется публичный URL изображения. Загрузите изображение на публичный хостинг.")
         
         # Используем указанный aspect ratio или по умолчанию "1:1"
         aspect_ratio = request.aspect_ratio or "1:1"
@@ -287,27 +416,15 @@ class NanoBananaAPIClient:
             "image_size": aspect_ratio
         }
         
-        # Создаем задачу
-        task_id = self._create_task(self.GENERATE_URL, data)
-        if not task_id:
-            return APIResponse(
-                success=False,
-                error_message="Не удалось создать задачу редактирования"
-            )
-        
-        # Ожидаем завершения
-        result = self._get_task_status(task_id)
-        
-        if result.get("success"):
-            return APIResponse(
-                success=True,
-                image_url=result.get("image_url")
-            )
-        else:
-            return APIResponse(
-                success=False,
-                error_message=result.get("error", "Ошибка редактирования")
-            )
+        # Создаем задачу и ставим ее на опрос
+        poll_key = make_poll_key("edit", request.model, None, aspect_ratio)
+        return self._submit_task(
+            self.GENERATE_URL,
+            data,
+            poll_key,
+            "Не удалось создать задачу редактирования",
+            "Ошибка редактирования"
+        )
     
     def combine_images(self, request: CombineRequest, image_urls: List[str] = None) -> APIResponse:
         """
@@ -320,24 +437,28 @@ class NanoBananaAPIClient:
         Returns:
             APIResponse с результатом
         """
+        return self.submit_combine(request, image_urls).result()
+    
+    def submit_combine(self, request: CombineRequest, image_urls: List[str] = None) -> TaskHandle:
+        """
+        Создать задачу комбинирования, не дожидаясь результата
+        
+        Args:
+            request: Параметры комбинирования
+            image_urls: Список публичных URL изображений (если уже загружены)
+            
+        Returns:
+            TaskHandle, результат которого - APIResponse
+        """
         if len(request.image_paths) > 8:
-            return APIResponse(
-                success=False,
-                error_message="Максимум 8 изображений для комбинирования"
-            )
+            return TaskHandle.failed("Максимум 8 изображений для комбинирования")
         
         # Если URL не предоставлены, нужно загрузить изображения
         if not image_urls:
-            return APIResponse(
-                success=False,
-                error_message="Требуются публичные URL изображений. Загрузите изображения на публичный хостинг."
-            )
+            return TaskHandle.failed("Требуются публичные URL изображений. Загрузите изображения на публичный хостинг.")
         
         if len(image_urls) != len(request.image_paths):
-            return APIResponse(
-                success=False,
-                error_message="Количество URL не соответствует количеству изображений"
-            )
+            return TaskHandle.failed("Количество URL не соответствует количеству изображений")
         
         # Преобразуем разрешение
         resolution_map = {
@@ -358,27 +479,35 @@ class NanoBananaAPIClient:
             "aspectRatio": aspect_ratio
         }
         
-        # Создаем задачу
-        task_id = self._create_task(self.GENERATE_PRO_URL, data)
-        if not task_id:
-            return APIResponse(
-                success=False,
-                error_message="Не удалось создать задачу комбинирования"
-            )
+        # Создаем задачу и ставим ее на опрос
+        poll_key = make_poll_key("combine", "pro", resolution, aspect_ratio)
+        return self._submit_task(
+            self.GENERATE_PRO_URL,
+            data,
+            poll_key,
+            "Не удалось создать задачу комбинирования",
+            "Ошибка комбинирования"
+        )
+    
+    def get_poll_stats(self) -> dict:
+        """
+        Статистика адаптивного опроса
         
-        # Ожидаем завершения
-        result = self._get_task_status(task_id)
+        Returns:
+            Словарь с количеством задач, перцентилями времени выполнения
+            и средним числом опросов для каждого ключа
+        """
+        return self.poll_scheduler.get_stats()
+    
+    def get_rate_limit_stats(self) -> dict:
+        """
+        Состояние лимита частоты запросов
         
-        if result.get("success"):
-            return APIResponse(
-                success=True,
-                image_url=result.get("image_url")
-            )
-        else:
-            return APIResponse(
-                success=False,
-                error_message=result.get("error", "Ошибка комбинирования")
-            )
+        Returns:
+            Словарь {'create': {...}, 'poll': {...}} с глубиной очереди,
+            текущим и средним ожиданием и числом ответов 429
+        """
+        return self.rate_limiter.get_stats()
     
     def check_balance(self) -> dict:
         """
@@ -388,7 +517,7 @@ class NanoBananaAPIClient:
             Словарь с информацией о балансе
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 self.CREDIT_URL,
                 headers=self.headers,
                 timeout=10
@@ -48,4 +48,5 @@ class APIResponse:
     image_base64: Optional[str] = None
     error_message: Optional[str] = None
     credits_used: Optional[float] = None
+    task_id: Optional[str] = None  # ID задачи в NanoBanana API
 
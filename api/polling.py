@@ -0,0 +1,149 @@
+"""
+Адаптивный график опроса статуса задач
+
+Время выполнения задачи сильно зависит от эндпоинта, модели, разрешения
+и соотношения сторон: Flash готов за секунды, Pro 4K - за минуту.
+PollScheduler запоминает время завершения прошлых задач для каждого
+такого ключа и планирует опросы вокруг ожидаемого момента готовности:
+первый опрос - незадолго до самых быстрых прошлых задач, затем частые
+опросы в окне p10..p90 и экспоненциальный backoff после него.
+"""
+import random
+import threading
+from collections import deque
+from typing import Optional, Tuple, Dict
+
+
+# Ключ статистики: (эндпоинт, модель, разрешение, соотношение сторон)
+PollKey = Tuple[str, str, Optional[str], Optional[str]]
+
+# Ожидаемое время выполнения (сек) пока нет собственной статистики
+DEFAULT_EXPECTED = {
+    "flash": 12.0,
+    "pro": 30.0,
+}
+DEFAULT_EXPECTED_4K = 60.0
+
+MIN_SAMPLES = 3  # Сколько завершенных задач нужно, чтобы доверять статистике
+HISTORY_SIZE = 50  # Сколько последних задач хранить на ключ
+
+MIN_INTERVAL = 1.0  # Минимальная пауза между опросами
+MAX_INTERVAL = 10.0  # Максимальная пауза между опросами
+BACKOFF_FACTOR = 1.5  # Рост паузы после p90
+JITTER = 0.1  # Случайное отклонение паузы (+-10%)
+EARLY_START = 0.8  # Первый опрос на 20% раньше p10
+
+
+def make_poll_key(endpoint: str, model: str, resolution: str = None,
+                  aspect_ratio: str = None) -> PollKey:
+    """Собрать ключ статистики опроса"""
+    return (endpoint, model or "flash", resolution, aspect_ratio)
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class PollScheduler:
+    """Статистика времени выполнения задач и расчет пауз между опросами"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}  # {PollKey: deque[float]}
+        self._polls = {}  # {PollKey: deque[int]}
+
+    def _expected(self, key: PollKey) -> Tuple[float, float, float]:
+        """Ожидаемые (p10, p50, p90) времени выполнения для ключа"""
+        with self._lock:
+            durations = sorted(self._durations.get(key, ()))
+
+        if len(durations) >= MIN_SAMPLES:
+            return (
+                _percentile(durations, 0.1),
+                _percentile(durations, 0.5),
+                _percentile(durations, 0.9)
+            )
+
+        _, model, resolution, _ = key
+        if model == "pro" and resolution in ("4096", "4K"):
+            p50 = DEFAULT_EXPECTED_4K
+        else:
+            p50 = DEFAULT_EXPECTED.get(model, DEFAULT_EXPECTED["pro"])
+        return p50 * 0.5, p50, p50 * 2
+
+    def next_delay(self, key: PollKey, elapsed: float, last_delay: float = None) -> float:
+        """
+        Рассчитать паузу до следующего опроса
+
+        Args:
+            key: Ключ статистики
+            elapsed: Сколько секунд прошло с создания задачи
+            last_delay: Предыдущая пауза (для backoff после p90)
+
+        Returns:
+            Пауза в секундах
+        """
+        p10, p50, p90 = self._expected(key)
+        # Частота опросов внутри окна ожидаемого завершения
+        window_interval = min(MAX_INTERVAL, max(MIN_INTERVAL, (p90 - p10) / 6))
+
+        # Окно начинается чуть раньше p10, чтобы статистика могла
+        # сдвигаться и в сторону более быстрых задач
+        window_start = p10 * EARLY_START
+        if elapsed < window_start:
+            # Задача почти наверняка еще не готова - ждем до начала окна
+            delay = window_start - elapsed
+        elif elapsed < p90:
+            delay = window_interval
+        else:
+            # Задача дольше обычного - экспоненциальный backoff
+            delay = max(window_interval, (last_delay or window_interval) * BACKOFF_FACTOR)
+
+        delay *= 1 + random.uniform(-JITTER, JITTER)
+        return min(MAX_INTERVAL, max(MIN_INTERVAL, delay))
+
+    def record(self, key: PollKey, duration: float, polls: int):
+        """
+        Запомнить завершенную задачу
+
+        Args:
+            key: Ключ статистики
+            duration: Оценка времени от создания задачи до готовности
+                      результата (середина между последними двумя опросами)
+            polls: Количество запросов record-info
+        """
+        with self._lock:
+            self._durations.setdefault(key, deque(maxlen=HISTORY_SIZE)).append(duration)
+            self._polls.setdefault(key, deque(maxlen=HISTORY_SIZE)).append(polls)
+
+    def get_stats(self) -> Dict[str, dict]:
+        """
+        Получить накопленную статистику
+
+        Returns:
+            Словарь {"endpoint|model|resolution|aspect": {...}} с количеством
+            задач, перцентилями времени выполнения и средним числом опросов
+        """
+        with self._lock:
+            snapshot = {key: (sorted(self._durations[key]), list(self._polls[key]))
+                        for key in self._durations}
+
+        stats = {}
+        for key, (durations, polls) in snapshot.items():
+            name = "|".join(str(part) for part in key)
+            stats[name] = {
+                "count": len(durations),
+                "p10": round(_percentile(durations, 0.1), 2),
+                "p50": round(_percentile(durations, 0.5), 2),
+                "p90": round(_percentile(durations, 0.9), 2),
+                "avg_polls": round(sum(polls) / len(polls), 2) if polls else 0
+            }
+        return stats
+
+
+# Общий планировщик для всех клиентов процесса
+poll_scheduler = PollScheduler()
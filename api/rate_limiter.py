@@ -0,0 +1,255 @@
+"""
+Ограничение частоты запросов к NanoBanana API для одного API ключа
+
+Для каждого ключа держатся два token bucket: на создание задач
+(generate / generate-pro) и на опрос статуса (record-info), чтобы
+пакетная генерация не упиралась в лимиты провайдера. Ответ 429 с
+Retry-After блокирует соответствующий bucket на указанное время.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Optional, Dict
+
+
+# Лимиты по умолчанию: запросов в секунду и размер всплеска
+DEFAULT_CREATE_RATE = 2.0
+DEFAULT_CREATE_BURST = 5
+DEFAULT_POLL_RATE = 10.0
+DEFAULT_POLL_BURST = 20
+
+# Пауза при 429 без заголовка Retry-After
+DEFAULT_RETRY_AFTER = 5.0
+
+KIND_CREATE = "create"
+KIND_POLL = "poll"
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """
+    Разобрать заголовок Retry-After
+    
+    Args:
+        value: Значение заголовка (секунды)
+    
+    Returns:
+        Пауза в секундах
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class TokenBucket:
+    """Token bucket с резервированием: вызывающий сам ждет выданную паузу"""
+    
+    def __init__(self, rate: float, capacity: int):
+        """
+        Args:
+            rate: Пополнение, токенов в секунду
+            capacity: Максимум накопленных токенов (размер всплеска)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        # Статистика
+        self.waiting = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.deferred = 0  # Отказов try_acquire (запрос перенесен вызывающим)
+        self.total_wait = 0.0
+        self.last_wait = 0.0
+    
+    def reserve(self) -> float:
+        """
+        Зарезервировать токен
+        
+        Returns:
+            Сколько секунд нужно подождать перед запросом
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            
+            wait = 0.0
+            if self._tokens < 0:
+                wait = -self._tokens / self.rate
+            wait = max(wait, self._blocked_until - now)
+            
+            self.acquired += 1
+            self.total_wait += wait
+            self.last_wait = wait
+            return wait
+    
+    def try_acquire(self) -> float:
+        """
+        Взять токен, только если он доступен сейчас
+        
+        Не резервирует токен заранее: вызывающий, получивший паузу,
+        переносит запрос и не держит поток в ожидании.
+        
+        Returns:
+            0, если токен взят, иначе через сколько секунд повторить попытку
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            
+            wait = max((1 - self._tokens) / self.rate, self._blocked_until - now)
+            if wait > 0:
+                self.deferred += 1
+                return wait
+            
+            self._tokens -= 1
+            self.acquired += 1
+            self.last_wait = 0.0
+            return 0.0
+    
+    def block(self, seconds: float):
+        """Заблокировать bucket (ответ 429 с Retry-After)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self.throttled += 1
+    
+    def acquire(self):
+        """Дождаться токена в текущем потоке"""
+        wait = self.reserve()
+        if wait > 0:
+            with self._lock:
+                self.waiting += 1
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+    
+    async def acquire_async(self):
+        """Дождаться токена в корутине"""
+        wait = self.reserve()
+        if wait > 0:
+            with self._lock:
+                self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+    
+    def get_stats(self) -> dict:
+        """Состояние bucket для мониторинга"""
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            return {
+                "rate": self.rate,
+                "capacity": self.capacity,
+                "tokens": round(tokens, 2),
+                "queue_depth": self.waiting,
+                "current_wait": round(max(0.0, -tokens / self.rate, self._blocked_until - now), 2),
+                "last_wait": round(self.last_wait, 2),
+                "avg_wait": round(self.total_wait / self.acquired, 3) if self.acquired else 0,
+                "requests": self.acquired,
+                "throttled": self.throttled,
+                "deferred": self.deferred
+            }
+
+
+class RateLimiter:
+    """Лимиты запросов одного API ключа: создание задач и опрос отдельно"""
+    
+    def __init__(self, create_rate: float = DEFAULT_CREATE_RATE,
+                 create_burst: int = DEFAULT_CREATE_BURST,
+                 poll_rate: float = DEFAULT_POLL_RATE,
+                 poll_burst: int = DEFAULT_POLL_BURST):
+        self.buckets = {
+            KIND_CREATE: TokenBucket(create_rate, create_burst),
+            KIND_POLL: TokenBucket(poll_rate, poll_burst),
+        }
+    
+    def acquire(self, kind: str):
+        """Дождаться разрешения на запрос вида kind ('create' или 'poll')"""
+        self.buckets[kind].acquire()
+    
+    def try_acquire(self, kind: str) -> float:
+        """Разрешение на запрос вида kind без ожидания: 0 или пауза до следующей попытки"""
+        return self.buckets[kind].try_acquire()
+    
+    async def acquire_async(self, kind: str):
+        """Асинхронно дождаться разрешения на запрос вида kind"""
+        await self.buckets[kind].acquire_async()
+    
+    def throttle(self, kind: str, retry_after: float):
+        """Учесть ответ 429: не отправлять запросы вида kind retry_after секунд"""
+        self.buckets[kind].block(retry_after)
+    
+    def get_stats(self) -> Dict[str, dict]:
+        """Статистика по видам запросов"""
+        return {kind: bucket.get_stats() for kind, bucket in self.buckets.items()}
+
+
+_limiters = {}  # {api_key: RateLimiter}
+_limiters_lock = threading.Lock()
+
+# Параметры для новых лимитеров (можно изменить через configure_rate_limits)
+_limits_config = {
+    "create_rate": DEFAULT_CREATE_RATE,
+    "create_burst": DEFAULT_CREATE_BURST,
+    "poll_rate": DEFAULT_POLL_RATE,
+    "poll_burst": DEFAULT_POLL_BURST,
+}
+
+
+def configure_rate_limits(**limits):
+    """
+    Задать лимиты для ключей, лимитер которых еще не создан
+    
+    Args:
+        **limits: create_rate, create_burst, poll_rate, poll_burst
+    """
+    with _limiters_lock:
+        for name, value in limits.items():
+            if name in _limits_config and value is not None:
+                _limits_config[name] = value
+
+
+def get_rate_limiter(api_key: str) -> RateLimiter:
+    """
+    Получить общий лимитер для API ключа
+    
+    Все клиенты с одним ключом делят один лимит, так как провайдер
+    ограничивает запросы по ключу.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(api_key)
+        if limiter is None:
+            limiter = RateLimiter(**_limits_config)
+            _limiters[api_key] = limiter
+        return limiter
+
+
+def get_all_stats() -> Dict[str, dict]:
+    """
+    Статистика всех лимитеров процесса
+    
+    Ключи не раскрываются даже частично: вместо них - начало sha256 ключа
+    (владелец может посчитать его сам и найти свой лимитер).
+    
+    Returns:
+        Словарь {key_id: статистика}
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {key_id(api_key): limiter.get_stats() for api_key, limiter in limiters.items()}
+
+
+def key_id(api_key: str) -> str:
+    """Непрозрачный идентификатор API ключа для статистики"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
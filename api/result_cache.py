@@ -0,0 +1,194 @@
+"""
+Кэш результатов генерации по содержимому запроса
+
+Ключ кэша - sha256 от канонического JSON полей запроса (GenerationRequest,
+EditRequest, CombineRequest) и sha256 содержимого входных изображений,
+поэтому тот же промпт с теми же параметрами и файлами возвращает уже
+сохраненное изображение без обращения к API. Индекс хранится в таблице
+result_cache базы истории, сами изображения - там же, где и остальные
+результаты.
+"""
+import hashlib
+import json
+import shutil
+import threading
+from dataclasses import asdict
+from pathlib import Path
+from typing import Optional, Dict
+
+from utils.upload_cache import file_digest
+
+
+# Ограничения кэша по умолчанию
+DEFAULT_TTL = 7 * 24 * 3600  # секунд
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Поля запросов с путями к входным изображениям
+IMAGE_FIELDS = ("image_path",)
+IMAGE_LIST_FIELDS = ("image_paths", "reference_images")
+
+
+def request_fingerprint(gen_type: str, request, **extra) -> str:
+    """
+    Отпечаток запроса для кэша
+
+    Args:
+        gen_type: Тип генерации ('generate', 'edit', 'combine')
+        request: Dataclass запроса
+        **extra: Параметры постобработки, влияющие на сохраненный файл
+                 (например, crop_to_aspect)
+
+    Returns:
+        sha256 в hex
+    """
+    fields = asdict(request)
+    for name in IMAGE_FIELDS:
+        if fields.get(name):
+            fields[name] = file_digest(fields[name])
+    for name in IMAGE_LIST_FIELDS:
+        if fields.get(name):
+            fields[name] = [file_digest(path) for path in fields[name]]
+    if isinstance(fields.get("prompt"), str):
+        fields["prompt"] = fields["prompt"].strip()
+    fields.update(extra)
+    fields["type"] = gen_type
+
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Кэш результатов поверх таблицы result_cache DatabaseManager"""
+
+    def __init__(self, db_manager, base_dir: str = None, ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            db_manager: DatabaseManager с таблицей result_cache
+            base_dir: Папка, относительно которой заданы пути изображений
+                      (None - пути абсолютные)
+            ttl: Время жизни записи в секундах
+            max_entries: Максимальное количество записей
+            max_bytes: Максимальный суммарный размер изображений в кэше
+        """
+        self.db_manager = db_manager
+        self.base_dir = Path(base_dir) if base_dir else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _resolve(self, image_path: str) -> Path:
+        """Полный путь к изображению"""
+        path = Path(image_path)
+        if self.base_dir and not path.is_absolute():
+            path = self.base_dir / path
+        return path
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def key(self, gen_type: str, request, **extra) -> Optional[str]:
+        """
+        Ключ кэша для запроса (см. request_fingerprint)
+
+        Returns:
+            Ключ или None, если входные изображения не удалось прочитать
+        """
+        try:
+            return request_fingerprint(gen_type, request, **extra)
+        except OSError as e:
+            print(f"Не удалось вычислить ключ кэша: {e}")
+            return None
+
+    def get(self, key: Optional[str]) -> Optional[Dict]:
+        """
+        Найти сохраненный результат
+
+        Args:
+            key: Ключ кэша
+
+        Returns:
+            Словарь с image_path и generation_id или None
+        """
+        if not key:
+            return None
+        entry = self.db_manager.get_cached_result(key, max_age=self.ttl)
+        if entry and not self._resolve(entry["image_path"]).exists():
+            # Изображение удалено из истории
+            self.db_manager.delete_cached_result(key)
+            entry = None
+        self._count(entry is not None)
+        return entry
+
+    def restore(self, key: Optional[str], output_path: str) -> bool:
+        """
+        Скопировать сохраненный результат в новый файл
+
+        Нужен там, где каждая генерация получает собственный файл в истории
+        (удаление из галереи удаляет файл).
+
+        Returns:
+            True если результат найден и скопирован
+        """
+        entry = self.get(key)
+        if not entry:
+            return False
+        try:
+            shutil.copyfile(self._resolve(entry["image_path"]), output_path)
+            return True
+        except OSError as e:
+            print(f"Ошибка копирования результата из кэша: {e}")
+            return False
+
+    def put(self, key: Optional[str], gen_type: str, image_path: str, generation_id: int = None):
+        """
+        Сохранить результат и применить ограничения кэша
+
+        Args:
+            key: Ключ кэша
+            gen_type: Тип генерации
+            image_path: Путь к сохраненному изображению
+            generation_id: ID записи в истории генераций
+        """
+        if not key:
+            return
+        try:
+            size_bytes = self._resolve(image_path).stat().st_size
+        except OSError:
+            return
+        self.db_manager.add_cached_result(key, gen_type, image_path, generation_id, size_bytes)
+        self.db_manager.evict_cached_results(self.ttl, self.max_entries, self.max_bytes)
+
+    def get_stats(self) -> Dict:
+        """
+        Статистика кэша
+
+        Returns:
+            Словарь с попаданиями и промахами этого процесса, долей попаданий
+            и размером кэша
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        stats = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes
+        }
+        totals = self.db_manager.get_result_cache_totals()
+        stats.update({
+            "entries": totals["entries"],
+            "bytes": totals["bytes"],
+            "total_hits": totals["hits"]
+        })
+        return stats
@@ -0,0 +1,237 @@
+"""
+Общий фоновый опрос статуса задач NanoBanana API
+
+Вместо отдельного цикла опроса в каждом потоке все ожидающие задачи
+регистрируются в одном TaskPoller. Один управляющий поток выбирает задачи,
+которым пора на опрос (по графику PollScheduler), и выполняет запросы
+record-info в небольшом пуле с ограниченной параллельностью. Результат
+каждой задачи передается через concurrent.futures.Future, поэтому число
+потоков не растет вместе с числом задач в работе.
+"""
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from .polling import PollScheduler, PollKey, poll_scheduler, make_poll_key
+
+
+# Сколько запросов record-info может выполняться одновременно
+MAX_CONCURRENT_POLLS = 8
+
+
+class PollDeferred(Exception):
+    """
+    Опрос нужно перенести, не выполняя запрос (исчерпан лимит запросов ключа)
+
+    Функция check выбрасывает его вместо ожидания, чтобы один ключ не занял
+    ожиданием все потоки пула и не остановил опрос задач остальных ключей.
+    """
+
+    def __init__(self, delay: float):
+        super().__init__(f"Опрос отложен на {delay:.2f} с")
+        self.delay = delay
+
+
+class PendingTask:
+    """Задача, ожидающая завершения"""
+
+    def __init__(self, task_id: str, check: Callable[[], Optional[dict]],
+                 poll_key: PollKey, max_wait: float):
+        self.task_id = task_id
+        self.check = check
+        self.poll_key = poll_key
+        self.future = Future()
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + max_wait
+        self.next_poll_at = self.started_at
+        self.last_delay = None
+        self.last_poll_elapsed = None
+        self.polls = 0
+        self.in_flight = False
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+class TaskPoller:
+    """Единый опросчик для всех незавершенных задач процесса"""
+
+    def __init__(self, scheduler: PollScheduler = None,
+                 max_concurrency: int = MAX_CONCURRENT_POLLS):
+        """
+        Инициализация опросчика
+
+        Args:
+            scheduler: Планировщик пауз между опросами
+            max_concurrency: Максимум одновременных запросов статуса
+        """
+        self.scheduler = scheduler or poll_scheduler
+        self.max_concurrency = max_concurrency
+        self._pending = {}  # {task_id: PendingTask}
+        self._cond = threading.Condition()
+        self._executor = None
+        self._thread = None
+
+    def _ensure_started(self):
+        """Запустить управляющий поток при первой регистрации"""
+        if self._thread is None or not self._thread.is_alive():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="nanobanana-poll"
+            )
+            self._thread = threading.Thread(
+                target=self._loop,
+                name="nanobanana-poller",
+                daemon=True
+            )
+            self._thread.start()
+
+    def register(self, task_id: str, check: Callable[[], Optional[dict]],
+                 poll_key: PollKey = None, max_wait: float = 300) -> Future:
+        """
+        Зарегистрировать задачу для опроса
+
+        Args:
+            task_id: ID задачи
+            check: Функция одного запроса статуса. Возвращает словарь
+                   с результатом (ключ 'success') или None, если задача
+                   еще выполняется; PollDeferred - перенести опрос
+            poll_key: Ключ статистики опроса
+            max_wait: Максимальное время ожидания в секундах
+
+        Returns:
+            Future, который получит словарь с результатом задачи
+        """
+        task = PendingTask(task_id, check, poll_key or make_poll_key("unknown", None), max_wait)
+        task.last_delay = self.scheduler.next_delay(task.poll_key, 0)
+        task.next_poll_at = task.started_at + task.last_delay
+
+        with self._cond:
+            self._ensure_started()
+            self._pending[task_id] = task
+            self._cond.notify()
+        return task.future
+
+    def resolve(self, task_id: str, result: dict) -> bool:
+        """
+        Завершить задачу результатом, полученным не через опрос (callback)
+
+        Args:
+            task_id: ID задачи
+            result: Словарь с результатом задачи (ключ 'success')
+
+        Returns:
+            True если задача ожидала в этом процессе
+        """
+        with self._cond:
+            task = self._pending.get(task_id)
+        if task is None or not self._resolve(task, result):
+            return False
+
+        if result.get("success"):
+            # Момент завершения известен точно
+            self.scheduler.record(task.poll_key, task.elapsed, task.polls)
+        return True
+
+    def pending_count(self) -> int:
+        """Количество задач в ожидании"""
+        with self._cond:
+            return len(self._pending)
+
+    def _loop(self):
+        """Управляющий цикл: раздает опросы задачам, которым пора"""
+        while True:
+            with self._cond:
+                # Убираем отмененные вызывающей стороной задачи
+                for task_id in [t.task_id for t in self._pending.values() if t.future.cancelled()]:
+                    del self._pending[task_id]
+
+                now = time.monotonic()
+                due = [t for t in self._pending.values()
+                       if not t.in_flight and t.next_poll_at <= now]
+
+                if not due:
+                    waiting = [t.next_poll_at for t in self._pending.values() if not t.in_flight]
+                    timeout = max(0.0, min(waiting) - now) if waiting else None
+                    self._cond.wait(timeout)
+                    continue
+
+                for task in due:
+                    task.in_flight = True
+
+            for task in due:
+                self._executor.submit(self._poll, task)
+
+    def _poll(self, task: PendingTask):
+        """Один опрос статуса задачи в пуле"""
+        poll_elapsed = task.elapsed
+        try:
+            result = task.check()
+        except PollDeferred as deferred:
+            # Запрос не выполнен: опрос переносится, график PollScheduler не меняется
+            if not self._expire(task):
+                self._reschedule(task, deferred.delay)
+            return
+        except Exception as e:
+            print(f"Ошибка при опросе статуса: {e}")
+            result = None
+        task.polls += 1
+
+        if result is not None:
+            if self._resolve(task, result) and result.get("success"):
+                # Задача завершилась между двумя последними опросами
+                finished_at = poll_elapsed
+                if task.last_poll_elapsed is not None:
+                    finished_at = (task.last_poll_elapsed + poll_elapsed) / 2
+                self.scheduler.record(task.poll_key, finished_at, task.polls)
+            return
+
+        if self._expire(task):
+            return
+
+        task.last_poll_elapsed = poll_elapsed
+        task.last_delay = self.scheduler.next_delay(task.poll_key, task.elapsed, task.last_delay)
+        self._reschedule(task, task.last_delay)
+
+    def _expire(self, task: PendingTask) -> bool:
+        """Завершить задачу ошибкой, если время ожидания вышло"""
+        if time.monotonic() < task.deadline:
+            return False
+        self._resolve(task, {
+            "success": False,
+            "error": "Превышено время ожидания генерации",
+            "task_id": task.task_id
+        })
+        return True
+
+    def _reschedule(self, task: PendingTask, delay: float):
+        """Назначить следующий опрос задачи через delay секунд"""
+        with self._cond:
+            task.next_poll_at = min(time.monotonic() + delay, task.deadline)
+            task.in_flight = False
+            self._cond.notify()
+
+    def _resolve(self, task: PendingTask, result: dict) -> bool:
+        """
+        Завершить задачу и передать результат ожидающим
+
+        Returns:
+            False если задача уже была завершена другим путем
+        """
+        with self._cond:
+            if self._pending.get(task.task_id) is not task:
+                return False
+            del self._pending[task.task_id]
+            self._cond.notify()
+        try:
+            task.future.set_result(result)
+        except InvalidStateError:
+            # Future уже отменен вызывающей стороной
+            pass
+        return True
+
+
+# Общий опросчик для всех клиентов процесса
+task_poller = TaskPoller()
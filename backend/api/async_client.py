@@ -0,0 +1,391 @@
+"""
+Асинхронный клиент NanoBanana API на asyncio + aiohttp
+
+Тот же набор операций и то же преобразование запросов, что и у
+NanoBananaAPIClient (см. request_mapping), но создание задач, опрос
+статуса и скачивание результата выполняются корутинами. Один процесс
+может держать в работе тысячи генераций на одном event loop без
+отдельного потока на каждую задачу.
+"""
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Optional, List, Dict
+from uuid import uuid4
+
+import aiohttp
+
+from .models import GenerationRequest, EditRequest, CombineRequest, APIResponse
+from .polling import poll_scheduler, make_poll_key, PollKey
+from .rate_limiter import get_rate_limiter, KIND_CREATE, KIND_POLL
+from .request_mapping import NanoBananaRequestMapper, TaskSpec
+
+
+class AsyncNanoBananaAPIClient(NanoBananaRequestMapper):
+    """Асинхронный клиент для взаимодействия с NanoBanana API"""
+    
+    # Интервал страховочного опроса record-info, когда результаты приходят через callback
+    CALLBACK_FALLBACK_INTERVAL = 30
+    
+    # Размер блока при скачивании результата
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+    
+    # Сколько раз повторять создание задачи после ответа 429
+    MAX_THROTTLE_RETRIES = 3
+    
+    def __init__(self, api_key: str, callback_url: str = None,
+                 session: aiohttp.ClientSession = None, max_connections: int = 100,
+                 rate_limiter=None, api_root: str = None):
+        """
+        Инициализация клиента
+        
+        Args:
+            api_key: API ключ от NanoBanana
+            callback_url: Публичный URL приемника callback (результаты передаются
+                          в клиент через resolve_callback)
+            session: Готовая aiohttp сессия (если None, клиент создаст свою)
+            max_connections: Максимум одновременных соединений собственной сессии
+            rate_limiter: Лимитер запросов (по умолчанию общий для ключа, см. get_rate_limiter)
+            api_root: Корень API (по умолчанию NANOBANANA_API_URL или боевой адрес)
+        """
+        api_root = api_root or os.getenv("NANOBANANA_API_URL")
+        if api_root:
+            self._use_api_root(api_root)
+        self.api_key = api_key
+        self.callback_url = callback_url
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        self.max_connections = max_connections
+        self._session = session
+        self._owns_session = session is None
+        # Общая статистика времени выполнения задач для адаптивного опроса
+        self.poll_scheduler = poll_scheduler
+        # Ожидающие callback задачи {task_id: asyncio.Future}
+        self._waiters: Dict[str, asyncio.Future] = {}
+        # Лимит частоты запросов для ключа, общий с синхронным клиентом
+        self.rate_limiter = rate_limiter or get_rate_limiter(api_key)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Получить сессию (создается при первом обращении внутри event loop)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+            )
+            self._owns_session = True
+        return self._session
+    
+    async def close(self):
+        """Закрыть собственную сессию клиента"""
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+    
+    async def _create_task(self, url: str, data: dict) -> Optional[str]:
+        """
+        Создать задачу генерации
+        
+        Args:
+            url: URL эндпоинта
+            data: Данные для отправки
+        
+        Returns:
+            taskId или None при ошибке
+        """
+        try:
+            for _ in range(self.MAX_THROTTLE_RETRIES + 1):
+                await self.rate_limiter.acquire_async(KIND_CREATE)
+                async with self._get_session().post(
+                    url,
+                    headers=self.headers,
+                    json=data,
+                    timeout=aiohttp.ClientTimeout(total=30)
+                ) as response:
+                    result = None
+                    if response.status == 200:
+                        result = await response.json(content_type=None)
+                    if self._throttled(response, result, KIND_CREATE):
+                        # Задача не создана, повторяем после паузы
+                        continue
+                    if result is not None:
+                        return self._extract_task_id(result)
+                    return None
+            return None
+        except Exception as e:
+            print(f"Ошибка создания задачи: {e}")
+            return None
+    
+    async def _check_task(self, task_id: str) -> Optional[dict]:
+        """
+        Однократно запросить статус задачи
+        
+        Args:
+            task_id: ID задачи
+        
+        Returns:
+            Словарь с результатом задачи или None, если задача еще выполняется
+        """
+        try:
+            await self.rate_limiter.acquire_async(KIND_POLL)
+            async with self._get_session().get(
+                self.TASK_INFO_URL,
+                headers=self.headers,
+                params={"taskId": task_id},
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                if response.status == 200:
+                    result = await response.json(content_type=None)
+                    if not self._throttled(response, result, KIND_POLL):
+                        return self._parse_task_info(task_id, result)
+                else:
+                    self._throttled(response, None, KIND_POLL)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Ошибка при опросе статуса: {e}")
+        except Exception as e:
+            print(f"Неожиданная ошибка: {e}")
+        return None
+    
+    def _throttled(self, response: aiohttp.ClientResponse, result: Optional[dict], kind: str) -> bool:
+        """
+        Проверить ответ на ограничение частоты и при необходимости
+        заблокировать bucket на время из Retry-After
+        
+        Returns:
+            True если API ответил 429
+        """
+        delay = self._throttle_delay(response.status, result, response.headers.get("Retry-After"))
+        if delay is None:
+            return False
+        print(f"API ограничил частоту запросов ({kind}), пауза {delay} сек")
+        self.rate_limiter.throttle(kind, delay)
+        return True
+    
+    def get_rate_limit_stats(self) -> dict:
+        """Состояние лимита частоты запросов (см. RateLimiter.get_stats)"""
+        return self.rate_limiter.get_stats()
+    
+    def resolve_callback(self, payload: dict) -> bool:
+        """
+        Передать клиенту тело callback от NanoBanana API
+        
+        Вызывается из обработчика callback в том же event loop.
+        
+        Args:
+            payload: JSON тело callback
+        
+        Returns:
+            True если задача ожидала результата в этом клиенте
+        """
+        result = self.parse_callback(payload)
+        if result is None:
+            return False
+        waiter = self._waiters.get(result["task_id"])
+        if waiter is None or waiter.done():
+            return False
+        waiter.set_result(result)
+        return True
+    
+    async def _get_task_status(self, task_id: str, max_wait: int = 300, poll_key: PollKey = None) -> dict:
+        """
+        Дождаться завершения задачи
+        
+        Паузы между опросами рассчитываются PollScheduler по статистике
+        прошлых задач. Если настроен callback, задача завершается по его
+        приходу, а record-info опрашивается раз в CALLBACK_FALLBACK_INTERVAL.
+        
+        Args:
+            task_id: ID задачи
+            max_wait: Максимальное время ожидания в секундах
+            poll_key: Ключ статистики опроса (см. make_poll_key)
+        
+        Returns:
+            Словарь с результатом задачи
+        """
+        poll_key = poll_key or make_poll_key("unknown", None)
+        start_time = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[task_id] = waiter
+        
+        polls = 0
+        delay = None
+        last_poll_elapsed = None
+        
+        try:
+            while time.monotonic() - start_time < max_wait:
+                elapsed = time.monotonic() - start_time
+                if self.callback_url:
+                    delay = self.CALLBACK_FALLBACK_INTERVAL
+                else:
+                    delay = self.poll_scheduler.next_delay(poll_key, elapsed, delay)
+                delay = min(delay, max(0.0, max_wait - elapsed))
+                
+                try:
+                    # Ждем паузу либо результат из callback
+                    result = await asyncio.wait_for(asyncio.shield(waiter), timeout=delay)
+                    if result.get("success"):
+                        self.poll_scheduler.record(poll_key, time.monotonic() - start_time, polls)
+                    return result
+                except asyncio.TimeoutError:
+                    pass
+                
+                polls += 1
+                poll_elapsed = time.monotonic() - start_time
+                result = await self._check_task(task_id)
+                if result is not None:
+                    if result.get("success"):
+                        # Задача завершилась между двумя последними опросами
+                        finished_at = poll_elapsed
+                        if last_poll_elapsed is not None:
+                            finished_at = (last_poll_elapsed + poll_elapsed) / 2
+                        self.poll_scheduler.record(poll_key, finished_at, polls)
+                    return result
+                last_poll_elapsed = poll_elapsed
+        finally:
+            self._waiters.pop(task_id, None)
+        
+        return {
+            "success": False,
+            "error": "Превышено время ожидания генерации",
+            "task_id": task_id
+        }
+    
+    async def _run_spec(self, spec: TaskSpec) -> APIResponse:
+        """Создать задачу по подготовленному запросу и дождаться результата"""
+        if spec.error_message:
+            return APIResponse(success=False, error_message=spec.error_message)
+        
+        task_id = await self._create_task(spec.url, spec.data)
+        if not task_id:
+            return APIResponse(success=False, error_message=spec.create_error)
+        
+        result = await self._get_task_status(task_id, poll_key=spec.poll_key)
+        if result.get("success"):
+            return APIResponse(
+                success=True,
+                image_url=result.get("image_url"),
+                task_id=task_id
+            )
+        return APIResponse(
+            success=False,
+            error_message=result.get("error", spec.default_error),
+            task_id=task_id
+        )
+    
+    async def generate_image(self, request: GenerationRequest, reference_urls: List[str] = None) -> APIResponse:
+        """
+        Генерация изображения по текстовому описанию
+        
+        Args:
+            request: Параметры генерации
+            reference_urls: Список публичных URL референсных изображений (если уже загружены)
+        
+        Returns:
+            APIResponse с результатом
+        """
+        return await self._run_spec(self._prepare_generate(request, reference_urls))
+    
+    async def _generate_standard(self, request: GenerationRequest) -> APIResponse:
+        """Генерация через обычный эндпоинт"""
+        return await self._run_spec(self._prepare_standard(request))
+    
+    async def _generate_pro(self, request: GenerationRequest, reference_urls: List[str] = None) -> APIResponse:
+        """Генерация через Pro эндпоинт"""
+        return await self._run_spec(self._prepare_pro(request, reference_urls))
+    
+    async def edit_image(self, request: EditRequest, image_url: str = None) -> APIResponse:
+        """
+        Редактирование существующего изображения
+        
+        Args:
+            request: Параметры редактирования
+            image_url: Публичный URL изображения (если уже загружено)
+        
+        Returns:
+            APIResponse с результатом
+        """
+        return await self._run_spec(self._prepare_edit(request, image_url))
+    
+    async def combine_images(self, request: CombineRequest, image_urls: List[str] = None) -> APIResponse:
+        """
+        Комбинирование нескольких изображений через Pro API
+        
+        Args:
+            request: Параметры комбинирования
+            image_urls: Список публичных URL изображений (если уже загружены)
+        
+        Returns:
+            APIResponse с результатом
+        """
+        return await self._run_spec(self._prepare_combine(request, image_urls))
+    
+    async def check_balance(self) -> dict:
+        """
+        Проверка баланса кредитов
+        
+        Returns:
+            Словарь с информацией о балансе
+        """
+        try:
+            async with self._get_session().get(
+                self.CREDIT_URL,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                text = await response.text()
+                try:
+                    result = await response.json(content_type=None)
+                except ValueError:
+                    result = None
+                return self._parse_balance(response.status, result, text)
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+    
+    async def download_image(self, url: str, output_path: str) -> bool:
+        """
+        Скачать результат генерации в файл
+        
+        Данные пишутся блоками во временный файл, который затем атомарно
+        переименовывается в output_path. Операции с диском выполняются в
+        пуле потоков, чтобы запись файла не останавливала event loop.
+        
+        Args:
+            url: URL изображения
+            output_path: Путь для сохранения
+        
+        Returns:
+            True если успешно, False иначе
+        """
+        output_path = Path(output_path)
+        # Свое временное имя у каждой загрузки: параллельные загрузки в один
+        # output_path не пишут в общий файл, os.replace оставит целый результат
+        temp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.{uuid4().hex}.part")
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, lambda: output_path.parent.mkdir(parents=True, exist_ok=True))
+            async with self._get_session().get(url, timeout=aiohttp.ClientTimeout(total=60)) as response:
+                response.raise_for_status()
+                f = await loop.run_in_executor(None, open, temp_path, 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(self.DOWNLOAD_CHUNK_SIZE):
+                        await loop.run_in_executor(None, f.write, chunk)
+                finally:
+                    await loop.run_in_executor(None, f.close)
+            await loop.run_in_executor(None, os.replace, temp_path, output_path)
+            return True
+        except Exception as e:
+            print(f"Ошибка загрузки изображения: {e}")
+            try:
+                temp_path.unlink()
+            except OSError:
+                pass
+            return False
@@ -0,0 +1,147 @@
+"""
+Дескрипторы задач NanoBanana API для неблокирующей работы с клиентом
+
+submit_* методы NanoBananaAPIClient возвращают TaskHandle сразу после
+создания задачи. Результат (APIResponse) можно получить через result(),
+а для множества задач - через wait() и as_completed().
+"""
+import concurrent.futures
+from concurrent.futures import Future, InvalidStateError
+from typing import Iterable, Iterator, Optional, Tuple, Set
+
+from .models import APIResponse
+
+
+class TaskHandle:
+    """Задача NanoBanana API, результат которой будет получен позже"""
+
+    def __init__(self, task_id: Optional[str], status_future: Optional[Future] = None,
+                 error_message: str = "Ошибка генерации"):
+        """
+        Args:
+            task_id: ID задачи в API (None если задачу не удалось создать)
+            status_future: Future из TaskPoller со словарем результата задачи
+            error_message: Сообщение об ошибке по умолчанию
+        """
+        self.task_id = task_id
+        self.future = Future()
+        self._status_future = status_future
+        self._error_message = error_message
+        if status_future is not None:
+            status_future.add_done_callback(self._on_status)
+
+    @classmethod
+    def failed(cls, error_message: str) -> "TaskHandle":
+        """Дескриптор задачи, которую не удалось создать"""
+        handle = cls(None)
+        handle._set(APIResponse(success=False, error_message=error_message))
+        return handle
+
+    def _on_status(self, status_future: Future):
+        """Преобразовать результат опроса в APIResponse"""
+        if status_future.cancelled():
+            self.future.cancel()
+            return
+        result = status_future.result()
+        if result.get("success"):
+            response = APIResponse(
+                success=True,
+                image_url=result.get("image_url"),
+                task_id=self.task_id
+            )
+        else:
+            response = APIResponse(
+                success=False,
+                error_message=result.get("error", self._error_message),
+                task_id=self.task_id
+            )
+        self._set(response)
+
+    def _set(self, response: APIResponse):
+        try:
+            self.future.set_result(response)
+        except InvalidStateError:
+            # Дескриптор уже отменен
+            pass
+
+    def result(self, timeout: float = None) -> APIResponse:
+        """
+        Дождаться результата задачи
+
+        Args:
+            timeout: Максимальное время ожидания в секундах (None - без ограничения)
+
+        Returns:
+            APIResponse с результатом
+        """
+        return self.future.result(timeout)
+
+    def done(self) -> bool:
+        """Задача завершена (успешно, с ошибкой или отменена)"""
+        return self.future.done()
+
+    def cancel(self) -> bool:
+        """
+        Перестать ждать задачу
+
+        Задача в API при этом не отменяется (API не поддерживает отмену),
+        но снимается с опроса и не тратит запросы record-info.
+
+        Returns:
+            True если ожидание отменено
+        """
+        if self._status_future is not None:
+            self._status_future.cancel()
+        return self.future.cancel()
+
+    def cancelled(self) -> bool:
+        """Ожидание задачи было отменено"""
+        return self.future.cancelled()
+
+    def add_done_callback(self, fn):
+        """Вызвать fn(handle) по завершении задачи"""
+        self.future.add_done_callback(lambda _: fn(self))
+
+
+def wait(handles: Iterable[TaskHandle], timeout: float = None,
+         return_when: str = concurrent.futures.ALL_COMPLETED) -> Tuple[Set[TaskHandle], Set[TaskHandle]]:
+    """
+    Дождаться завершения задач
+
+    Args:
+        handles: Дескрипторы задач
+        timeout: Максимальное время ожидания в секундах
+        return_when: FIRST_COMPLETED или ALL_COMPLETED (из concurrent.futures)
+
+    Returns:
+        Кортеж (завершенные, незавершенные) дескрипторы
+    """
+    by_future = {handle.future: handle for handle in handles}
+    done, not_done = concurrent.futures.wait(by_future, timeout=timeout, return_when=return_when)
+    return {by_future[f] for f in done}, {by_future[f] for f in not_done}
+
+
+def as_completed(handles: Iterable[TaskHandle], timeout: float = None) -> Iterator[TaskHandle]:
+    """
+    Перебирать дескрипторы по мере завершения задач
+
+    Args:
+        handles: Дескрипторы задач
+        timeout: Максимальное общее время ожидания в секундах
+
+    Yields:
+        Завершенные дескрипторы
+    """
+    by_future = {handle.future: handle for handle in handles}
+    for future in concurrent.futures.as_completed(by_future, timeout=timeout):
+        yield by_future[future]
+
+
+def cancel_all(handles: Iterable[TaskHandle]) -> int:
+    """
+    Отменить ожидание всех незавершенных задач
+
+    Returns:
+        Количество отмененных дескрипторов
+    """
+    return sum(1 for handle in handles if handle.cancel())
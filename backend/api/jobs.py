@@ -0,0 +1,146 @@
+"""
+Фоновое выполнение задач генерации для Flask приложения
+
+Маршруты /generate, /edit и /combine ставят задачу в очередь и сразу
+возвращают 202 с job_id, а вся долгая работа (загрузка изображений,
+создание задачи в NanoBanana API, ожидание результата, сохранение файла)
+выполняется в пуле потоков. Статус задачи хранится в БД, поэтому его
+можно получить из любого воркера gunicorn.
+"""
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict
+
+from ..database.db_manager import DatabaseManager
+
+
+# Статусы фоновых задач
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+def _process_started(pid: int) -> str:
+    """
+    Время запуска процесса из /proc (Linux), иначе пустая строка
+
+    Вместе с pid отличает процесс от нового с тем же pid (в контейнере
+    после перезапуска воркеры часто получают прежние pid).
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Имя процесса в скобках может содержать пробелы - поля считаем после него
+            return f.read().rpartition(")")[2].split()[19]
+    except (OSError, IndexError):
+        return ""
+
+
+def _worker_id() -> str:
+    """Идентификатор текущего процесса в столбце jobs.worker ("хост:pid:запуск")"""
+    pid = os.getpid()
+    return f"{socket.gethostname()}:{pid}:{_process_started(pid)}"
+
+
+def _worker_alive(worker: Optional[str]) -> bool:
+    """Работает ли процесс, выполняющий задачу"""
+    if not worker:
+        return False  # Задача из версии без столбца worker - процесс давно перезапущен
+    host, pid, started = (worker.split(":") + ["", ""])[:3]
+    if host != socket.gethostname():
+        return True  # Процесс на другой машине проверить нельзя
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    if pid != os.getpid():
+        if os.name == "nt":
+            return False  # В Windows os.kill завершает процесс; сервер разработки - один процесс
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+    return _process_started(pid) == started
+
+
+class JobManager:
+    """Очередь фоновых задач на базе ThreadPoolExecutor"""
+
+    def __init__(self, db_manager: DatabaseManager, max_workers: int = None):
+        """
+        Инициализация менеджера задач
+
+        Args:
+            db_manager: Менеджер БД для хранения статусов задач
+            max_workers: Количество потоков (по умолчанию из JOB_WORKERS или 4)
+        """
+        if max_workers is None:
+            max_workers = int(os.getenv('JOB_WORKERS', 4))
+        self.db_manager = db_manager
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="nanobanana-job"
+        )
+
+        # Задачи воркеров, которые остановились (перезапуск сервера, падение),
+        # навсегда остались бы в статусе queued/running
+        orphaned = self.db_manager.fail_orphaned_jobs(
+            _worker_alive, 'Задача прервана перезапуском сервера'
+        )
+        if orphaned:
+            print(f"Незавершенных задач остановленных воркеров: {orphaned}")
+
+    def submit(self, job_type: str, func: Callable[..., dict], *args, **kwargs) -> str:
+        """
+        Поставить задачу в очередь
+
+        Args:
+            job_type: Тип задачи ('generate', 'edit', 'combine')
+            func: Функция, выполняющая задачу. Первым аргументом получает
+                  job_id, должна вернуть словарь с ключом 'success'
+                  и 'error' при неудаче
+            *args, **kwargs: Аргументы функции
+
+        Returns:
+            ID задачи
+        """
+        job_id = uuid.uuid4().hex
+        self.db_manager.add_job(job_id, job_type, worker=_worker_id())
+        self.executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id: str, func: Callable[..., dict], args: tuple, kwargs: dict):
+        """Выполнение задачи в потоке пула"""
+        self.db_manager.update_job(job_id, JOB_RUNNING)
+        try:
+            result = func(job_id, *args, **kwargs) or {}
+        except Exception as e:
+            print(f"Ошибка выполнения задачи {job_id}: {e}")
+            result = {'success': False, 'error': str(e)}
+
+        if result.get('success'):
+            self.db_manager.update_job(job_id, JOB_COMPLETED, result=result)
+        else:
+            self.db_manager.update_job(
+                job_id,
+                JOB_FAILED,
+                result=result,
+                error_message=result.get('error') or 'Неизвестная ошибка'
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Получить состояние задачи
+
+        Args:
+            job_id: ID задачи
+
+        Returns:
+            Словарь с данными задачи или None
+        """
+        return self.db_manager.get_job(job_id)
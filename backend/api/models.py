@@ -48,3 +48,4 @@ class APIResponse:
     image_base64: Optional[str] = None
     error_message: Optional[str] = None
     credits_used: Optional[float] = None
+    task_id: Optional[str] = None  # ID задачи в NanoBanana API
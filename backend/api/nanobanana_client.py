@@ -2,37 +2,104 @@
 Клиент для работы с NanoBanana API
 Адаптирован для веб-приложения
 """
+import os
 import requests
 import time
+from concurrent.futures import Future
 from typing import Optional, List
 from .models import GenerationRequest, EditRequest, CombineRequest, APIResponse
+from .handles import TaskHandle
+from .polling import poll_scheduler, PollKey
+from .rate_limiter import get_rate_limiter, KIND_CREATE, KIND_POLL
+from .request_mapping import NanoBananaRequestMapper, TaskSpec
+from .task_poller import PollDeferred, task_poller
+from ..utils.http_session import get_session
 
 
-class NanoBananaAPIClient:
+class NanoBananaAPIClient(NanoBananaRequestMapper):
     """Клиент для взаимодействия с NanoBanana API"""
     
-    # Базовые URL для API согласно документации
-    BASE_URL = "https://api.nanobananaapi.ai/api/v1/nanobanana"
-    GENERATE_URL = f"{BASE_URL}/generate"
-    GENERATE_PRO_URL = f"{BASE_URL}/generate-pro"
-    TASK_INFO_URL = f"{BASE_URL}/record-info"
-    CREDIT_URL = "https://api.nanobananaapi.ai/api/v1/common/credit"
+    # Интервал страховочного опроса record-info, когда результаты приходят через callback
+    CALLBACK_FALLBACK_INTERVAL = 30
     
-    # Фиктивный callback URL (требуется API, но не используется для веб-приложения)
-    DUMMY_CALLBACK = "https://example.com/callback"
+    # Сколько раз повторять создание задачи после ответа 429
+    MAX_THROTTLE_RETRIES = 3
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, callback_url: str = None, callback_store=None, rate_limiter=None,
+                 api_root: str = None):
         """
         Инициализация клиента
         
         Args:
             api_key: API ключ от NanoBanana
+            callback_url: Публичный URL приемника callback (если None - используется
+                          фиктивный URL и результаты получаются только опросом)
+            callback_store: Хранилище результатов, пришедших через callback в другой
+                            процесс (объект с методом pop_task_callback(task_id))
+            rate_limiter: Лимитер запросов (по умолчанию общий для ключа, см. get_rate_limiter)
+            api_root: Корень API (по умолчанию NANOBANANA_API_URL или боевой адрес)
         """
+        api_root = api_root or os.getenv("NANOBANANA_API_URL")
+        if api_root:
+            self._use_api_root(api_root)
         self.api_key = api_key
+        self.callback_url = callback_url
+        self.callback_store = callback_store
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        # Общая для всех клиентов сессия с пулом keep-alive соединений к API
+        self.session = get_session(self.BASE_URL)
+        # Общая статистика времени выполнения задач для адаптивного опроса
+        self.poll_scheduler = poll_scheduler
+        # Общий опросчик статуса задач (один поток на процесс)
+        self.task_poller = task_poller
+        # Лимит частоты запросов для ключа (создание задач и опрос отдельно)
+        self.rate_limiter = rate_limiter or get_rate_limiter(api_key)
+    
+    def _throttled(self, response: requests.Response, kind: str) -> bool:
+        """
+        Проверить ответ на ограничение частоты и при необходимости
+        заблокировать bucket на время из Retry-After
+        
+        Returns:
+            True если API ответил 429
+        """
+        result = None
+        if response.status_code == 200:
+            try:
+                result = response.json()
+            except ValueError:
+                pass
+        delay = self._throttle_delay(response.status_code, result, response.headers.get("Retry-After"))
+        if delay is None:
+            return False
+        print(f"API ограничил частоту запросов ({kind}), пауза {delay} сек")
+        self.rate_limiter.throttle(kind, delay)
+        return True
+    
+    def _post_task(self, url: str, data: dict) -> requests.Response:
+        """
+        Отправить запрос создания задачи с учетом лимита частоты
+        
+        После ответа 429 запрос повторяется (задача в этом случае не
+        создана), но не более MAX_THROTTLE_RETRIES раз.
+        
+        Returns:
+            Ответ последней попытки
+        """
+        for _ in range(self.MAX_THROTTLE_RETRIES + 1):
+            self.rate_limiter.acquire(KIND_CREATE)
+            response = self.session.post(
+                url,
+                headers=self.headers,
+                json=data,
+                timeout=30
+            )
+            if not self._throttled(response, KIND_CREATE):
+                break
+        return response
     
     def _create_task(self, url: str, data: dict) -> Optional[str]:
         """
@@ -41,109 +108,150 @@ class NanoBananaAPIClient:
         Args:
             url: URL эндпоинта
             data: Данные для отправки
-            
+        
         Returns:
             taskId или None при ошибке
         """
         try:
-            response = requests.post(
-                url,
-                headers=self.headers,
-                json=data,
-                timeout=30
-            )
+            response = self._post_task(url, data)
             
             if response.status_code == 200:
-                result = response.json()
-                if result.get("code") == 200 and "data" in result:
-                    task_id = result["data"].get("taskId")
-                    if task_id:
-                        return task_id
-                    else:
-                        # Для Pro API формат может быть другим
-                        task_id = result["data"].get("taskId") or result.get("data", {}).get("task_id")
-                        if task_id:
-                            return task_id
-                # Проверяем альтернативные форматы
-                if result.get("code") == 200:
-                    # Может быть напрямую в data
-                    if isinstance(result.get("data"), dict):
-                        task_id = result["data"].get("taskId") or result["data"].get("task_id")
-                        if task_id:
-                            return task_id
-                return None
+                return self._extract_task_id(response.json())
             else:
                 return None
         except Exception as e:
             print(f"Ошибка создания задачи: {e}")
             return None
     
-    def _get_task_status(self, task_id: str, max_wait: int = 300) -> dict:
+    def _check_task(self, task_id: str) -> Optional[dict]:
         """
-        Получить статус задачи с polling
+        Однократно запросить статус задачи
         
         Args:
             task_id: ID задачи
-            max_wait: Максимальное время ожидания в секундах
+        
+        Returns:
+            Словарь с результатом задачи или None, если задача еще выполняется
+        
+        Raises:
+            PollDeferred: Лимит опросов ключа исчерпан (TaskPoller перенесет
+                          опрос, не занимая поток пула ожиданием)
+        """
+        wait = self.rate_limiter.try_acquire(KIND_POLL)
+        if wait > 0:
+            raise PollDeferred(wait)
+        try:
+            response = self.session.get(
+                self.TASK_INFO_URL,
+                headers=self.headers,
+                params={"taskId": task_id},
+                timeout=10
+            )
             
+            # При 429 задача остается на опросе, следующий запрос - после Retry-After
+            if self._throttled(response, KIND_POLL):
+                return None
+            
+            if response.status_code == 200:
+                return self._parse_task_info(task_id, response.json())
+        except requests.exceptions.RequestException as e:
+            print(f"Ошибка при опросе статуса: {e}")
+        except Exception as e:
+            print(f"Неожиданная ошибка: {e}")
+        return None
+    
+    def _callback_check(self, task_id: str):
+        """
+        Функция проверки статуса для режима callback
+        
+        Сначала смотрит результат, сохраненный приемником callback в другом
+        процессе, и лишь раз в CALLBACK_FALLBACK_INTERVAL секунд делает
+        страховочный запрос record-info (на случай потерянного callback).
+        """
+        last_request = [time.monotonic()]
+        
+        def check() -> Optional[dict]:
+            if self.callback_store is not None:
+                result = self.callback_store.pop_task_callback(task_id)
+                if result:
+                    return result
+            if time.monotonic() - last_request[0] < self.CALLBACK_FALLBACK_INTERVAL:
+                return None
+            # Отложенный лимитом запрос (PollDeferred) не сдвигает отсчет интервала
+            result = self._check_task(task_id)
+            last_request[0] = time.monotonic()
+            return result
+        
+        return check
+    
+    def _get_task_status(self, task_id: str, max_wait: int = 300, poll_key: PollKey = None) -> dict:
+        """
+        Дождаться завершения задачи
+        
+        Args:
+            task_id: ID задачи
+            max_wait: Максимальное время ожидания в секундах
+            poll_key: Ключ статистики опроса (см. make_poll_key)
+        
         Returns:
             Словарь с результатом задачи
         """
-        start_time = time.time()
-        poll_interval = 3  # Опрашиваем каждые 3 секунды
+        return self._watch_task(task_id, max_wait, poll_key).result()
+    
+    def _watch_task(self, task_id: str, max_wait: int = 300, poll_key: PollKey = None) -> Future:
+        """
+        Поставить задачу на опрос статуса
         
-        while time.time() - start_time < max_wait:
-            try:
-                response = requests.get(
-                    self.TASK_INFO_URL,
-                    headers=self.headers,
-                    params={"taskId": task_id},
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("code") == 200 and "data" in result:
-                        data = result["data"]
-                        success_flag = data.get("successFlag")
-                        
-                        # 0: GENERATING - задача обрабатывается
-                        # 1: SUCCESS - успешно завершена
-                        # 2: CREATE_TASK_FAILED - ошибка создания задачи
-                        # 3: GENERATE_FAILED - ошибка генерации
-                        
-                        if success_flag == 1:
-                            # Успешно завершено
-                            response_data = data.get("response", {})
-                            image_url = response_data.get("resultImageUrl")
-                            return {
-                                "success": True,
-                                "image_url": image_url,
-                                "task_id": task_id
-                            }
-                        elif success_flag in [2, 3]:
-                            # Ошибка
-                            error_msg = data.get("errorMessage", "Неизвестная ошибка генерации")
-                            return {
-                                "success": False,
-                                "error": error_msg,
-                                "task_id": task_id
-                            }
-                        # Иначе продолжаем ждать (success_flag == 0)
-                
-                time.sleep(poll_interval)
-            except requests.exceptions.RequestException as e:
-                print(f"Ошибка при опросе статуса: {e}")
-                time.sleep(poll_interval)
-            except Exception as e:
-                print(f"Неожиданная ошибка: {e}")
-                time.sleep(poll_interval)
-        
-        return {
-            "success": False,
-            "error": "Превышено время ожидания генерации",
-            "task_id": task_id
-        }
+        Задача регистрируется в общем TaskPoller, который опрашивает все
+        незавершенные задачи процесса по графику PollScheduler, и передает
+        результат через Future. Если настроен callback, задача
+        завершается сразу по его приходу, а опрос API служит страховкой.
+        
+        Args:
+            task_id: ID задачи
+            max_wait: Максимальное время ожидания в секундах
+            poll_key: Ключ статистики опроса (см. make_poll_key)
+        
+        Returns:
+            Future со словарем результата задачи
+        """
+        if self.callback_url:
+            check = self._callback_check(task_id)
+        else:
+            check = lambda: self._check_task(task_id)
+        
+        return self.task_poller.register(
+            task_id,
+            check,
+            poll_key=poll_key,
+            max_wait=max_wait
+        )
+    
+    def _submit_task(self, url: str, data: dict, poll_key: PollKey,
+                     create_error: str, default_error: str) -> TaskHandle:
+        """
+        Создать задачу и поставить ее на опрос
+        
+        Args:
+            url: URL эндпоинта
+            data: Данные для отправки
+            poll_key: Ключ статистики опроса
+            create_error: Сообщение, если задачу не удалось создать
+            default_error: Сообщение об ошибке выполнения по умолчанию
+        
+        Returns:
+            TaskHandle задачи
+        """
+        task_id = self._create_task(url, data)
+        if not task_id:
+            return TaskHandle.failed(create_error)
+        return TaskHandle(task_id, self._watch_task(task_id, poll_key=poll_key), default_error)
+    
+    def _submit_spec(self, spec: TaskSpec) -> TaskHandle:
+        """Создать задачу по подготовленному запросу"""
+        if spec.error_message:
+            return TaskHandle.failed(spec.error_message)
+        return self._submit_task(spec.url, spec.data, spec.poll_key, spec.create_error, spec.default_error)
     
     def generate_image(self, request: GenerationRequest, reference_urls: List[str] = None) -> APIResponse:
         """
@@ -152,107 +260,32 @@ class NanoBananaAPIClient:
         Args:
             request: Параметры генерации
             reference_urls: Список публичных URL референсных изображений (если уже загружены)
-            
+        
         Returns:
             APIResponse с результатом
         """
-        # Используем обычный эндпоинт для Flash, Pro для Pro модели
-        if request.model == "pro":
-            return self._generate_pro(request, reference_urls)
-        else:
-            # Референсы поддерживаются только в Pro API
-            if reference_urls:
-                return APIResponse(
-                    success=False,
-                    error_message="Референсные изображения поддерживаются только в Pro модели"
-                )
-            return self._generate_standard(request)
+        return self.submit_generate(request, reference_urls).result()
     
-    def _generate_standard(self, request: GenerationRequest) -> APIResponse:
-        """Генерация через обычный эндпоинт"""
-        # Используем указанный aspect ratio или по умолчанию "1:1"
-        aspect_ratio = request.aspect_ratio or "1:1"
-        
-        data = {
-            "prompt": request.prompt,
-            "type": "TEXTTOIAMGE",
-            "numImages": min(request.num_images, 4),  # Максимум 4
-            "callBackUrl": self.DUMMY_CALLBACK,  # Обязательный параметр
-            "image_size": aspect_ratio
-        }
-        
-        # Создаем задачу
-        task_id = self._create_task(self.GENERATE_URL, data)
-        if not task_id:
-            return APIResponse(
-                success=False,
-                error_message="Не удалось создать задачу генерации"
-            )
+    def submit_generate(self, request: GenerationRequest, reference_urls: List[str] = None) -> TaskHandle:
+        """
+        Создать задачу генерации, не дожидаясь результата
         
-        # Ожидаем завершения
-        result = self._get_task_status(task_id)
+        Args:
+            request: Параметры генерации
+            reference_urls: Список публичных URL референсных изображений (если уже загружены)
         
-        if result.get("success"):
-            return APIResponse(
-                success=True,
-                image_url=result.get("image_url")
-            )
-        else:
-            return APIResponse(
-                success=False,
-                error_message=result.get("error", "Ошибка генерации")
-            )
+        Returns:
+            TaskHandle, результат которого - APIResponse
+        """
+        return self._submit_spec(self._prepare_generate(request, reference_urls))
+    
+    def _generate_standard(self, request: GenerationRequest) -> APIResponse:
+        """Генерация через обычный эндпоинт"""
+        return self._submit_spec(self._prepare_standard(request)).result()
     
     def _generate_pro(self, request: GenerationRequest, reference_urls: List[str] = None) -> APIResponse:
         """Генерация через Pro эндпоинт"""
-        # Преобразуем разрешение
-        resolution_map = {
-            "1024": "1K",
-            "2048": "2K",
-            "4096": "4K"
-        }
-        resolution = resolution_map.get(request.resolution, "2K")
-        
-        # Используем указанный aspect ratio или по умолчанию "1:1"
-        aspect_ratio = request.aspect_ratio or "1:1"
-        
-        data = {
-            "prompt": request.prompt,
-            "resolution": resolution,
-            "callBackUrl": self.DUMMY_CALLBACK,  # Обязательный параметр
-            "aspectRatio": aspect_ratio
-        }
-        
-        # Добавляем референсные изображения если есть
-        if reference_urls:
-            if len(reference_urls) > 8:
-                return APIResponse(
-                    success=False,
-                    error_message="Максимум 8 референсных изображений"
-                )
-            data["imageUrls"] = reference_urls
-        
-        # Создаем задачу
-        task_id = self._create_task(self.GENERATE_PRO_URL, data)
-        if not task_id:
-            return APIResponse(
-                success=False,
-                error_message="Не удалось создать задачу генерации"
-            )
-        
-        # Ожидаем завершения
-        result = self._get_task_status(task_id)
-        
-        if result.get("success"):
-            return APIResponse(
-                success=True,
-                image_url=result.get("image_url")
-            )
-        else:
-            return APIResponse(
-                success=False,
-                error_message=result.get("error", "Ошибка генерации")
-            )
+        return self._submit_spec(self._prepare_pro(request, reference_urls)).result()
     
     def edit_image(self, request: EditRequest, image_url: str = None) -> APIResponse:
         """
@@ -261,50 +294,24 @@ class NanoBananaAPIClient:
         Args:
             request: Параметры редактирования
             image_url: Публичный URL изображения (если уже загружено)
-            
+        
         Returns:
             APIResponse с результатом
         """
-        # Если URL не предоставлен, нужно загрузить изображение
-        if not image_url:
-            return APIResponse(
-                success=False,
-                error_message="Требуется публичный URL изображения. Загрузите изображение на публичный хостинг."
-            )
-        
-        # Используем указанный aspect ratio или по умолчанию "1:1"
-        aspect_ratio = request.aspect_ratio or "1:1"
-        
-        data = {
-            "prompt": request.prompt,
-            "type": "IMAGETOIAMGE",
-            "imageUrls": [image_url],
-            "numImages": 1,
-            "callBackUrl": self.DUMMY_CALLBACK,
-            "image_size": aspect_ratio
-        }
-        
-        # Создаем задачу
-        task_id = self._create_task(self.GENERATE_URL, data)
-        if not task_id:
-            return APIResponse(
-                success=False,
-                error_message="Не удалось создать задачу редактирования"
-            )
+        return self.submit_edit(request, image_url).result()
+    
+    def submit_edit(self, request: EditRequest, image_url: str = None) -> TaskHandle:
+        """
+        Создать задачу редактирования, не дожидаясь результата
         
-        # Ожидаем завершения
-        result = self._get_task_status(task_id)
+        Args:
+            request: Параметры редактирования
+            image_url: Публичный URL изображения (если уже загружено)
         
-        if result.get("success"):
-            return APIResponse(
-                success=True,
-                image_url=result.get("image_url")
-            )
-        else:
-            return APIResponse(
-                success=False,
-                error_message=result.get("error", "Ошибка редактирования")
-            )
+        Returns:
+            TaskHandle, результат которого - APIResponse
+        """
+        return self._submit_spec(self._prepare_edit(request, image_url))
     
     def combine_images(self, request: CombineRequest, image_urls: List[str] = None) -> APIResponse:
         """
@@ -313,69 +320,44 @@ class NanoBananaAPIClient:
         Args:
             request: Параметры комбинирования
             image_urls: Список публичных URL изображений (если уже загружены)
-            
+        
         Returns:
             APIResponse с результатом
         """
-        if len(request.image_paths) > 8:
-            return APIResponse(
-                success=False,
-                error_message="Максимум 8 изображений для комбинирования"
-            )
-        
-        # Если URL не предоставлены, нужно загрузить изображения
-        if not image_urls:
-            return APIResponse(
-                success=False,
-                error_message="Требуются публичные URL изображений. Загрузите изображения на публичный хостинг."
-            )
-        
-        if len(image_urls) != len(request.image_paths):
-            return APIResponse(
-                success=False,
-                error_message="Количество URL не соответствует количеству изображений"
-            )
-        
-        # Преобразуем разрешение
-        resolution_map = {
-            "1024": "1K",
-            "2048": "2K",
-            "4096": "4K"
-        }
-        resolution = resolution_map.get(request.resolution, "2K")
-        
-        # Используем указанный aspect ratio или по умолчанию "1:1"
-        aspect_ratio = request.aspect_ratio or "1:1"
+        return self.submit_combine(request, image_urls).result()
+    
+    def submit_combine(self, request: CombineRequest, image_urls: List[str] = None) -> TaskHandle:
+        """
+        Создать задачу комбинирования, не дожидаясь результата
         
-        data = {
-            "prompt": request.prompt,
-            "imageUrls": image_urls,
-            "resolution": resolution,
-            "callBackUrl": self.DUMMY_CALLBACK,
-            "aspectRatio": aspect_ratio
-        }
+        Args:
+            request: Параметры комбинирования
+            image_urls: Список публичных URL изображений (если уже загружены)
         
-        # Создаем задачу
-        task_id = self._create_task(self.GENERATE_PRO_URL, data)
-        if not task_id:
-            return APIResponse(
-                success=False,
-                error_message="Не удалось создать задачу комбинирования"
-            )
+        Returns:
+            TaskHandle, результат которого - APIResponse
+        """
+        return self._submit_spec(self._prepare_combine(request, image_urls))
+    
+    def get_poll_stats(self) -> dict:
+        """
+        Статистика адаптивного опроса
         
-        # Ожидаем завершения
-        result = self._get_task_status(task_id)
+        Returns:
+            Словарь с количеством задач, перцентилями времени выполнения
+            и средним числом опросов для каждого ключа
+        """
+        return self.poll_scheduler.get_stats()
+    
+    def get_rate_limit_stats(self) -> dict:
+        """
+        Состояние лимита частоты запросов
         
-        if result.get("success"):
-            return APIResponse(
-                success=True,
-                image_url=result.get("image_url")
-            )
-        else:
-            return APIResponse(
-                success=False,
-                error_message=result.get("error", "Ошибка комбинирования")
-            )
+        Returns:
+            Словарь {'create': {...}, 'poll': {...}} с глубиной очереди,
+            текущим и средним ожиданием и числом ответов 429
+        """
+        return self.rate_limiter.get_stats()
     
     def check_balance(self) -> dict:
         """
@@ -385,31 +367,17 @@ class NanoBananaAPIClient:
             Словарь с информацией о балансе
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 self.CREDIT_URL,
                 headers=self.headers,
                 timeout=10
             )
             
-            if response.status_code == 200:
+            try:
                 result = response.json()
-                if result.get("code") == 200:
-                    credits = result.get("data", 0)
-                    return {
-                        "success": True,
-                        "credits": credits,
-                        "message": f"Доступно кредитов: {credits}"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": result.get("msg", "Неизвестная ошибка")
-                    }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Ошибка {response.status_code}: {response.text}"
-                }
+            except ValueError:
+                result = None
+            return self._parse_balance(response.status_code, result, response.text)
         except Exception as e:
             return {
                 "success": False,
@@ -0,0 +1,323 @@
+"""
+Преобразование запросов в формат NanoBanana API и разбор ответов
+
+Общая часть синхронного NanoBananaAPIClient и асинхронного
+AsyncNanoBananaAPIClient: здесь нет сетевых вызовов, только построение
+тела запроса для каждого эндпоинта и разбор JSON ответов.
+"""
+from dataclasses import dataclass
+from typing import Optional, List
+
+from .models import GenerationRequest, EditRequest, CombineRequest
+from .polling import make_poll_key, PollKey
+from .rate_limiter import parse_retry_after
+
+
+# Преобразование разрешения в формат Pro API
+RESOLUTION_MAP = {
+    "1024": "1K",
+    "2048": "2K",
+    "4096": "4K"
+}
+
+
+@dataclass
+class TaskSpec:
+    """Подготовленный запрос на создание задачи"""
+    url: Optional[str] = None
+    data: Optional[dict] = None
+    poll_key: Optional[PollKey] = None
+    create_error: str = "Не удалось создать задачу генерации"
+    default_error: str = "Ошибка генерации"
+    error_message: Optional[str] = None  # Ошибка валидации, задачу создавать не нужно
+
+
+class NanoBananaRequestMapper:
+    """Построение запросов и разбор ответов NanoBanana API"""
+    
+    # Базовые URL для API согласно документации
+    BASE_URL = "https://api.nanobananaapi.ai/api/v1/nanobanana"
+    GENERATE_URL = f"{BASE_URL}/generate"
+    GENERATE_PRO_URL = f"{BASE_URL}/generate-pro"
+    TASK_INFO_URL = f"{BASE_URL}/record-info"
+    CREDIT_URL = "https://api.nanobananaapi.ai/api/v1/common/credit"
+    
+    # Фиктивный callback URL (используется, если публичный callback не настроен)
+    DUMMY_CALLBACK = "https://example.com/callback"
+    
+    callback_url = None
+    
+    def _use_api_root(self, api_root: str):
+        """
+        Направить клиент на другой адрес API (например, локальный симулятор)
+        
+        Args:
+            api_root: Корень API вида http://127.0.0.1:8090/api/v1
+        """
+        api_root = api_root.rstrip("/")
+        self.BASE_URL = f"{api_root}/nanobanana"
+        self.GENERATE_URL = f"{self.BASE_URL}/generate"
+        self.GENERATE_PRO_URL = f"{self.BASE_URL}/generate-pro"
+        self.TASK_INFO_URL = f"{self.BASE_URL}/record-info"
+        self.CREDIT_URL = f"{api_root}/common/credit"
+    
+    def _prepare_generate(self, request: GenerationRequest, reference_urls: List[str] = None) -> TaskSpec:
+        """Запрос генерации: обычный эндпоинт для Flash, Pro для Pro модели"""
+        if request.model == "pro":
+            return self._prepare_pro(request, reference_urls)
+        # Референсы поддерживаются только в Pro API
+        if reference_urls:
+            return TaskSpec(error_message="Референсные изображения поддерживаются только в Pro модели")
+        return self._prepare_standard(request)
+    
+    def _prepare_standard(self, request: GenerationRequest) -> TaskSpec:
+        """Запрос генерации через обычный эндпоинт"""
+        # Используем указанный aspect ratio или по умолчанию "1:1"
+        aspect_ratio = request.aspect_ratio or "1:1"
+        
+        data = {
+            "prompt": request.prompt,
+            "type": "TEXTTOIAMGE",
+            "numImages": min(request.num_images, 4),  # Максимум 4
+            "callBackUrl": self.callback_url or self.DUMMY_CALLBACK,  # Обязательный параметр
+            "image_size": aspect_ratio
+        }
+        
+        return TaskSpec(
+            url=self.GENERATE_URL,
+            data=data,
+            poll_key=make_poll_key("generate", request.model, None, aspect_ratio)
+        )
+    
+    def _prepare_pro(self, request: GenerationRequest, reference_urls: List[str] = None) -> TaskSpec:
+        """Запрос генерации через Pro эндпоинт"""
+        resolution = RESOLUTION_MAP.get(request.resolution, "2K")
+        
+        # Используем указанный aspect ratio или по умолчанию "1:1"
+        aspect_ratio = request.aspect_ratio or "1:1"
+        
+        data = {
+            "prompt": request.prompt,
+            "resolution": resolution,
+            "callBackUrl": self.callback_url or self.DUMMY_CALLBACK,  # Обязательный параметр
+            "aspectRatio": aspect_ratio
+        }
+        
+        # Добавляем референсные изображения если есть
+        if reference_urls:
+            if len(reference_urls) > 8:
+                return TaskSpec(error_message="Максимум 8 референсных изображений")
+            data["imageUrls"] = reference_urls
+        
+        return TaskSpec(
+            url=self.GENERATE_PRO_URL,
+            data=data,
+            poll_key=make_poll_key("generate-pro", "pro", resolution, aspect_ratio)
+        )
+    
+    def _prepare_edit(self, request: EditRequest, image_url: str = None) -> TaskSpec:
+        """Запрос редактирования изображения"""
+        # Если URL не предоставлен, нужно загрузить изображение
+        if not image_url:
+            return TaskSpec(error_message="Требуется публичный URL изображения. Загрузите изображение на публичный хостинг.")
+        
+        # Используем указанный aspect ratio или по умолчанию "1:1"
+        aspect_ratio = request.aspect_ratio or "1:1"
+        
+        data = {
+            "prompt": request.prompt,
+            "type": "IMAGETOIAMGE",
+            "imageUrls": [image_url],
+            "numImages": 1,
+            "callBackUrl": self.callback_url or self.DUMMY_CALLBACK,
+            "image_size": aspect_ratio
+        }
+        
+        return TaskSpec(
+            url=self.GENERATE_URL,
+            data=data,
+            poll_key=make_poll_key("edit", request.model, None, aspect_ratio),
+            create_error="Не удалось создать задачу редактирования",
+            default_error="Ошибка редактирования"
+        )
+    
+    def _prepare_combine(self, request: CombineRequest, image_urls: List[str] = None) -> TaskSpec:
+        """Запрос комбинирования изображений через Pro API"""
+        if len(request.image_paths) > 8:
+            return TaskSpec(error_message="Максимум 8 изображений для комбинирования")
+        
+        # Если URL не предоставлены, нужно загрузить изображения
+        if not image_urls:
+            return TaskSpec(error_message="Требуются публичные URL изображений. Загрузите изображения на публичный хостинг.")
+        
+        if len(image_urls) != len(request.image_paths):
+            return TaskSpec(error_message="Количество URL не соответствует количеству изображений")
+        
+        resolution = RESOLUTION_MAP.get(request.resolution, "2K")
+        
+        # Используем указанный aspect ratio или по умолчанию "1:1"
+        aspect_ratio = request.aspect_ratio or "1:1"
+        
+        data = {
+            "prompt": request.prompt,
+            "imageUrls": image_urls,
+            "resolution": resolution,
+            "callBackUrl": self.callback_url or self.DUMMY_CALLBACK,
+            "aspectRatio": aspect_ratio
+        }
+        
+        return TaskSpec(
+            url=self.GENERATE_PRO_URL,
+            data=data,
+            poll_key=make_poll_key("combine", "pro", resolution, aspect_ratio),
+            create_error="Не удалось создать задачу комбинирования",
+            default_error="Ошибка комбинирования"
+        )
+    
+    @staticmethod
+    def _extract_task_id(result: dict) -> Optional[str]:
+        """
+        Достать taskId из ответа на создание задачи
+        
+        Args:
+            result: JSON ответа эндпоинта generate / generate-pro
+        
+        Returns:
+            taskId или None
+        """
+        if result.get("code") != 200:
+            return None
+        data = result.get("data")
+        if not isinstance(data, dict):
+            return None
+        # Для Pro API формат может быть другим
+        return data.get("taskId") or data.get("task_id")
+    
+    @staticmethod
+    def _parse_task_info(task_id: str, result: dict) -> Optional[dict]:
+        """
+        Разобрать ответ record-info
+        
+        Args:
+            task_id: ID задачи
+            result: JSON ответа record-info
+        
+        Returns:
+            Словарь с результатом задачи или None, если задача еще выполняется
+        """
+        if result.get("code") != 200 or "data" not in result:
+            return None
+        data = result["data"]
+        success_flag = data.get("successFlag")
+        
+        # 0: GENERATING - задача обрабатывается
+        # 1: SUCCESS - успешно завершена
+        # 2: CREATE_TASK_FAILED - ошибка создания задачи
+        # 3: GENERATE_FAILED - ошибка генерации
+        
+        if success_flag == 1:
+            # Успешно завершено
+            response_data = data.get("response", {})
+            image_url = response_data.get("resultImageUrl")
+            return {
+                "success": True,
+                "image_url": image_url,
+                "task_id": task_id
+            }
+        elif success_flag in [2, 3]:
+            # Ошибка
+            error_msg = data.get("errorMessage", "Неизвестная ошибка генерации")
+            return {
+                "success": False,
+                "error": error_msg,
+                "task_id": task_id
+            }
+        # Иначе продолжаем ждать (success_flag == 0)
+        return None
+    
+    @staticmethod
+    def parse_callback(payload: dict) -> Optional[dict]:
+        """
+        Разобрать тело callback от NanoBanana API
+        
+        Args:
+            payload: JSON тело запроса
+        
+        Returns:
+            Словарь с результатом задачи (как у _check_task) или None,
+            если в теле нет taskId
+        """
+        if not isinstance(payload, dict):
+            return None
+        data = payload.get("data") or {}
+        if not isinstance(data, dict):
+            return None
+        task_id = data.get("taskId") or data.get("task_id")
+        if not task_id:
+            return None
+        
+        info = data.get("info") or data.get("response") or {}
+        image_url = (info.get("resultImageUrl") if isinstance(info, dict) else None) or data.get("resultImageUrl")
+        success_flag = data.get("successFlag")
+        
+        if payload.get("code") == 200 and success_flag in (None, 1) and image_url:
+            return {
+                "success": True,
+                "image_url": image_url,
+                "task_id": task_id
+            }
+        if success_flag == 0:
+            # Промежуточное уведомление, задача еще выполняется
+            return None
+        return {
+            "success": False,
+            "error": data.get("errorMessage") or payload.get("msg") or "Неизвестная ошибка генерации",
+            "task_id": task_id
+        }
+    
+    @staticmethod
+    def _throttle_delay(status_code: int, result: Optional[dict], retry_after: Optional[str]) -> Optional[float]:
+        """
+        Определить, ограничил ли API частоту запросов
+        
+        Args:
+            status_code: HTTP статус ответа
+            result: JSON ответа (None, если ответ не JSON)
+            retry_after: Значение заголовка Retry-After
+        
+        Returns:
+            Пауза в секундах, если API ответил 429 (HTTP или code в теле), иначе None
+        """
+        if status_code == 429 or (isinstance(result, dict) and result.get("code") == 429):
+            return parse_retry_after(retry_after)
+        return None
+    
+    @staticmethod
+    def _parse_balance(status_code: int, result: Optional[dict], text: str = "") -> dict:
+        """
+        Разобрать ответ эндпоинта баланса
+        
+        Args:
+            status_code: HTTP статус ответа
+            result: JSON ответа (None, если ответ не JSON)
+            text: Текст ответа для сообщения об ошибке
+        
+        Returns:
+            Словарь с информацией о балансе
+        """
+        if status_code != 200 or result is None:
+            return {
+                "success": False,
+                "error": f"Ошибка {status_code}: {text}"
+            }
+        if result.get("code") == 200:
+            credits = result.get("data", 0)
+            return {
+                "success": True,
+                "credits": credits,
+                "message": f"Доступно кредитов: {credits}"
+            }
+        return {
+            "success": False,
+            "error": result.get("msg", "Неизвестная ошибка")
+        }
@@ -1,17 +1,35 @@
 """
 API маршруты для Flask приложения
 """
-from flask import Blueprint, request, jsonify, send_from_directory, current_app
+from flask import Blueprint, request, jsonify, send_file, current_app
+from werkzeug.security import safe_join
 from pathlib import Path
 from datetime import datetime
+from dataclasses import replace
+from urllib.parse import quote
+import hmac
+import mimetypes
 import os
 import threading
 
 from .nanobanana_client import NanoBananaAPIClient
 from .models import GenerationRequest, EditRequest, CombineRequest
-from ..database.db_manager import DatabaseManager
-from ..utils.image_utils import url_to_image, base64_to_image
-from ..utils.image_uploader import upload_image
+from .jobs import JobManager, JOB_QUEUED, JOB_COMPLETED, JOB_FAILED
+from .polling import poll_scheduler
+from .rate_limiter import configure_rate_limits, get_all_stats as get_rate_limit_stats, key_id
+from .result_cache import ResultCache
+from .task_poller import task_poller
+from ..database.db_manager import DatabaseManager, GENERATION_DERIVATIVES
+from ..utils.image_utils import url_to_image, base64_to_image, get_pipeline_stats, remove_derivatives
+from ..utils.image_pool import DEFAULT_QUEUE_SIZE, configure_image_pool, get_image_pool
+from ..utils.image_uploader import upload_images, get_pre_uploader
+from ..utils.image_variants import ImageVariantCache, parse_variant_args
+from ..utils.output_format import OutputEncoding, configure_output_encoding, get_output_encoding
+from ..utils.upload_cache import get_upload_cache, file_digest
+from ..utils.upload_health import get_upload_health
+from ..utils.upload_prep import configure_upload_prep, get_upload_preparer
+from ..utils.signed_urls import (SIGNED_URL_TTL, derive_token, make_signed_url, verify_signature,
+                                 is_publicly_reachable)
 
 api_bp = Blueprint('api', __name__)
 
@@ -19,12 +37,148 @@ api_bp = Blueprint('api', __name__)
 # В продакшене лучше использовать Flask session или Redis
 api_clients = {}  # {api_key: NanoBananaAPIClient}
 db_manager = DatabaseManager()
+job_manager = JobManager(db_manager)
+
+# Лимиты частоты запросов к NanoBanana API на один ключ (в каждом процессе gunicorn)
+configure_rate_limits(
+    create_rate=float(os.getenv('API_CREATE_RATE', 0)) or None,
+    create_burst=int(os.getenv('API_CREATE_BURST', 0)) or None,
+    poll_rate=float(os.getenv('API_POLL_RATE', 0)) or None,
+    poll_burst=int(os.getenv('API_POLL_BURST', 0)) or None
+)
+
+UPLOADS_DIR = Path(__file__).parent.parent / "uploads"
+
+# Кэш результатов одинаковых запросов (включается через RESULT_CACHE=1)
+result_cache = None
+if os.getenv('RESULT_CACHE', '').lower() in ('1', 'true', 'yes'):
+    result_cache = ResultCache(
+        db_manager,
+        base_dir=UPLOADS_DIR,
+        ttl=float(os.getenv('RESULT_CACHE_TTL_HOURS', 168)) * 3600,
+        max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 1000)),
+        max_bytes=int(os.getenv('RESULT_CACHE_MAX_MB', 2048)) * 1024 * 1024
+    )
+
+# Уменьшение и пережатие входных изображений перед загрузкой (UPLOAD_OPTIMIZE=1)
+configure_upload_prep(
+    enabled=os.getenv('UPLOAD_OPTIMIZE', '').lower() in ('1', 'true', 'yes'),
+    max_bytes=int(float(os.getenv('UPLOAD_MAX_MB', 0)) * 1024 * 1024) or None
+)
+
+# Формат сохраняемых результатов (в запросе можно переопределить output_format,
+# output_quality и output_effort)
+configure_output_encoding(
+    format=os.getenv('OUTPUT_FORMAT', 'png'),
+    quality=os.getenv('OUTPUT_QUALITY') or None,
+    effort=os.getenv('OUTPUT_EFFORT') or None,
+    archive=os.getenv('OUTPUT_ARCHIVE', '').lower() in ('1', 'true', 'yes')
+)
+
+# Пул процессов для декодирования, обрезки, масштабирования и кодирования
+# изображений. У каждого воркера gunicorn свой пул: IMAGE_WORKERS примерно
+# равно числу ядер, деленному на число воркеров (0 - без пула)
+configure_image_pool(
+    workers=int(os.getenv('IMAGE_WORKERS')) if os.getenv('IMAGE_WORKERS') else None,
+    queue_size=int(os.getenv('IMAGE_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+)
+
+# Уменьшенные копии изображений для /api/images/<path>?width=...
+image_variants = ImageVariantCache(
+    max_bytes=int(float(os.getenv('IMAGE_VARIANT_CACHE_MB', 512)) * 1024 * 1024)
+)
+
+# Сгенерированные изображения после записи не меняются: браузеры и CDN
+# кэшируют их на год без повторных запросов
+IMMUTABLE_MAX_AGE = 365 * 86400
+
+# Отдача файлов фронт-прокси вместо воркера gunicorn:
+# SENDFILE_MODE=x-accel-redirect (nginx) или x-sendfile (Apache, lighttpd)
+SENDFILE_MODE = os.getenv('SENDFILE_MODE', '').lower()
+# internal location nginx, указывающий на папку backend (для X-Accel-Redirect)
+SENDFILE_PREFIX = os.getenv('SENDFILE_PREFIX', '/protected')
+BACKEND_DIR = Path(__file__).parent.parent
+
+# Передавать API подписанные ссылки на файлы бэкенда вместо загрузки на хостинг
+SELF_HOSTED_IMAGES = os.getenv('SELF_HOSTED_IMAGES', '').lower() in ('1', 'true', 'yes')
+SIGNED_URL_TTL_SECONDS = float(os.getenv('SIGNED_URL_TTL', SIGNED_URL_TTL))
+
+
+def get_callback_url() -> str:
+    """
+    Публичный URL приемника callback от NanoBanana API
+    
+    Задается через PUBLIC_BASE_URL (адрес бэкенда, доступный из интернета).
+    Если не задан, callback не используется и результаты получаются опросом.
+    """
+    public_base_url = os.getenv('PUBLIC_BASE_URL')
+    if not public_base_url:
+        return None
+    return f"{public_base_url.rstrip('/')}/api/callback?token={quote(_callback_secret())}"
+
+
+def _callback_secret() -> str:
+    """
+    Токен приемника callback
+    
+    CALLBACK_SECRET или, если он не задан, секрет, производный от ключа
+    подписи ссылок: без токена кто угодно мог бы подделать результат задачи.
+    """
+    return os.getenv('CALLBACK_SECRET') or derive_token('callback')
+
+
+def _public_roots() -> dict:
+    """Папки, файлы из которых раздаются по подписанным ссылкам: {префикс: папка}"""
+    roots = {
+        'user': UPLOADS_DIR / "user",
+        'generated': UPLOADS_DIR / "generated"
+    }
+    preparer = get_upload_preparer()
+    if preparer is not None:
+        roots['prep'] = preparer.cache_dir
+    return roots
+
+
+def _public_path(file_path: str) -> str:
+    """Путь файла для /api/public или None, если файл лежит вне раздаваемых папок"""
+    path = Path(file_path).resolve()
+    for prefix, root in _public_roots().items():
+        try:
+            return f"{prefix}/{path.relative_to(root.resolve()).as_posix()}"
+        except ValueError:
+            continue
+    return None
+
+
+def get_public_image_url(image_path: str, resolution: str = None) -> str:
+    """
+    Публичный URL входного изображения для NanoBanana API
+    
+    При SELF_HOSTED_IMAGES=1 и доступном из интернета PUBLIC_BASE_URL -
+    подписанная временная ссылка на сам бэкенд, без загрузки на хостинг.
+    Иначе изображение загружается на публичный хостинг (или берется URL
+    фоновой загрузки, начатой в /upload).
+    """
+    public_base_url = os.getenv('PUBLIC_BASE_URL')
+    if SELF_HOSTED_IMAGES and public_base_url and is_publicly_reachable(public_base_url):
+        file_path = image_path
+        preparer = get_upload_preparer()
+        if preparer is not None:
+            file_path = preparer.prepare(image_path, resolution)
+        public_path = _public_path(file_path)
+        if public_path:
+            return make_signed_url(public_base_url, public_path, SIGNED_URL_TTL_SECONDS)
+    return get_pre_uploader().get(image_path, resolution)
 
 
 def get_api_client(api_key: str) -> NanoBananaAPIClient:
     """Получить или создать API клиент для ключа"""
     if api_key not in api_clients:
-        api_clients[api_key] = NanoBananaAPIClient(api_key)
+        api_clients[api_key] = NanoBananaAPIClient(
+            api_key,
+            callback_url=get_callback_url(),
+            callback_store=db_manager
+        )
     return api_clients[api_key]
 
 
@@ -46,9 +200,308 @@ def check_balance():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _save_result(image_url: str, prefix: str, job_id: str, generated_folder: str,
+                 aspect_ratio: str = None, resolution: str = None,
+                 crop_to_aspect: bool = False, derivatives: dict = None,
+                 encoding: OutputEncoding = None) -> str:
+    """
+    Скачать результат генерации в папку generated
+    
+    Args:
+        derivatives: Если передан, в него добавляются миниатюра и превью
+                     с относительными путями ("generated/thumbs/...")
+        encoding: Формат результата (по умолчанию - OUTPUT_FORMAT)
+    
+    Returns:
+        Относительный путь к сохраненному изображению или None при ошибке
+    """
+    encoding = encoding or get_output_encoding()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{prefix}_{timestamp}_{job_id[:8]}{encoding.extension}"
+    save_path = Path(generated_folder) / filename
+    
+    success = url_to_image(
+        image_url,
+        str(save_path),
+        aspect_ratio=aspect_ratio,
+        resolution=resolution,
+        crop_to_aspect=crop_to_aspect,
+        derivatives=derivatives,
+        encoding=encoding
+    )
+    if not success:
+        return None
+    for info in (derivatives or {}).values():
+        info['path'] = f"generated/{Path(info['path']).relative_to(generated_folder).as_posix()}"
+    return f"generated/{filename}"
+
+
+def _add_image_urls(gen: dict) -> dict:
+    """
+    URL оригинала, миниатюры и превью для записи генерации
+    
+    У записей, созданных до появления миниатюр, вместо них отдается оригинал.
+    """
+    if gen.get('image_path'):
+        gen['image_url'] = f"/api/images/{gen['image_path']}"
+    for kind in GENERATION_DERIVATIVES:
+        path = gen.get(f'{kind}_path')
+        gen[f'{kind}_url'] = f"/api/images/{path}" if path else gen.get('image_url')
+    return gen
+
+
+def _cache_lookup(api_key: str, gen_type: str, cache_request, crop_to_aspect: bool, encoding: OutputEncoding):
+    """
+    Найти результат такого же запроса в кэше
+    
+    Кэш раздельный для каждого API ключа: иначе запрос с любым (даже
+    неверным) ключом получал бы результаты, оплаченные другим ключом.
+    
+    Args:
+        api_key: API ключ запроса (в ключ кэша входит только его хэш)
+        gen_type: Тип генерации ('generate', 'edit', 'combine')
+        cache_request: Запрос с полными путями к входным изображениям
+        crop_to_aspect: Обрезка результата (влияет на сохраненный файл)
+        encoding: Формат результата (влияет на сохраненный файл)
+    
+    Returns:
+        Кортеж (ключ кэша, результат задачи или None)
+    """
+    if result_cache is None:
+        return None, None
+    cache_key = result_cache.key(gen_type, cache_request, crop_to_aspect=bool(crop_to_aspect),
+                                 api_key_id=key_id(api_key), **encoding.cache_params())
+    entry = result_cache.get(cache_key)
+    if not entry:
+        return cache_key, None
+    return cache_key, {
+        'success': True,
+        'image_url': f"/api/images/{entry['image_path']}",
+        'image_path': entry['image_path'],
+        'id': entry['generation_id'],
+        'cached': True
+    }
+
+
+def _request_encoding(data: dict) -> OutputEncoding:
+    """
+    Формат результата с переопределениями из запроса
+    
+    Raises:
+        ValueError: Неверный формат, качество или сжатие
+    """
+    return get_output_encoding().with_overrides(
+        data.get('output_format'),
+        data.get('output_quality'),
+        data.get('output_effort')
+    )
+
+
+def _cache_store(cache_key: str, gen_type: str, relative_path: str, gen_id: int):
+    """Запомнить результат в кэше"""
+    if result_cache is not None:
+        result_cache.put(cache_key, gen_type, relative_path, gen_id)
+
+
+def _run_generate_job(job_id: str, api_key: str, gen_request: GenerationRequest,
+                      reference_paths: list, generated_folder: str,
+                      crop_to_aspect: bool, encoding: OutputEncoding) -> dict:
+    """Фоновая генерация изображения"""
+    cache_key, cached = _cache_lookup(
+        api_key,
+        "generate",
+        replace(gen_request, reference_images=reference_paths or None),
+        crop_to_aspect,
+        encoding
+    )
+    if cached:
+        return cached
+    
+    client = get_api_client(api_key)
+    
+    # Загружаем референсные изображения если есть (параллельно)
+    reference_urls = None
+    if reference_paths:
+        reference_urls = upload_images(
+            [str(ref_path) for ref_path in reference_paths],
+            resolution=gen_request.resolution,
+            uploader=get_public_image_url
+        )
+        failed = [Path(ref_path).name for ref_path, url in zip(reference_paths, reference_urls) if not url]
+        if failed:
+            return {
+                'success': False,
+                'error': f'Не удалось загрузить референсные изображения: {", ".join(failed)}',
+                'failed_images': failed
+            }
+    
+    # Генерируем изображение
+    response = client.generate_image(gen_request, reference_urls)
+    if not (response.success and response.image_url):
+        return {
+            'success': False,
+            'error': response.error_message or 'Неизвестная ошибка генерации'
+        }
+    
+    derivatives = {}
+    relative_path = _save_result(
+        response.image_url, "generated", job_id, generated_folder,
+        aspect_ratio=gen_request.aspect_ratio,
+        resolution=gen_request.resolution,
+        crop_to_aspect=crop_to_aspect,
+        derivatives=derivatives,
+        encoding=encoding
+    )
+    if not relative_path:
+        return {'success': False, 'error': 'Ошибка сохранения изображения'}
+    
+    gen_id = db_manager.add_generation(
+        gen_type="generate",
+        prompt=gen_request.prompt,
+        model=gen_request.model,
+        image_path=relative_path,
+        resolution=gen_request.resolution,
+        negative_prompt=gen_request.negative_prompt,
+        derivatives=derivatives
+    )
+    _cache_store(cache_key, "generate", relative_path, gen_id)
+    
+    return {
+        'success': True,
+        'image_url': f"/api/images/{relative_path}",
+        'image_path': relative_path,
+        'id': gen_id
+    }
+
+
+def _run_edit_job(job_id: str, api_key: str, edit_request: EditRequest,
+                  generated_folder: str, crop_to_aspect: bool, encoding: OutputEncoding) -> dict:
+    """Фоновое редактирование изображения"""
+    cache_key, cached = _cache_lookup(api_key, "edit", edit_request, crop_to_aspect, encoding)
+    if cached:
+        return cached
+    
+    # Загружаем изображение на публичный хостинг
+    public_url = get_public_image_url(edit_request.image_path, resolution=edit_request.resolution)
+    if not public_url:
+        return {
+            'success': False,
+            'error': 'Не удалось загрузить изображение на публичный хостинг'
+        }
+    
+    client = get_api_client(api_key)
+    response = client.edit_image(edit_request, public_url)
+    if not (response.success and response.image_url):
+        return {
+            'success': False,
+            'error': response.error_message or 'Неизвестная ошибка редактирования'
+        }
+    
+    derivatives = {}
+    relative_path = _save_result(
+        response.image_url, "edited", job_id, generated_folder,
+        aspect_ratio=edit_request.aspect_ratio,
+        resolution=edit_request.resolution,
+        crop_to_aspect=crop_to_aspect,
+        derivatives=derivatives,
+        encoding=encoding
+    )
+    if not relative_path:
+        return {'success': False, 'error': 'Ошибка сохранения изображения'}
+    
+    gen_id = db_manager.add_generation(
+        gen_type="edit",
+        prompt=edit_request.prompt,
+        model=edit_request.model,
+        image_path=relative_path,
+        resolution=edit_request.resolution,
+        negative_prompt=edit_request.negative_prompt,
+        derivatives=derivatives
+    )
+    _cache_store(cache_key, "edit", relative_path, gen_id)
+    
+    return {
+        'success': True,
+        'image_url': f"/api/images/{relative_path}",
+        'image_path': relative_path,
+        'id': gen_id
+    }
+
+
+def _run_combine_job(job_id: str, api_key: str, combine_request: CombineRequest,
+                     generated_folder: str, crop_to_aspect: bool, encoding: OutputEncoding) -> dict:
+    """Фоновое комбинирование изображений"""
+    cache_key, cached = _cache_lookup(api_key, "combine", combine_request, crop_to_aspect, encoding)
+    if cached:
+        return cached
+    
+    # Загружаем все изображения на публичный хостинг (параллельно)
+    public_urls = upload_images(
+        combine_request.image_paths,
+        resolution=combine_request.resolution,
+        uploader=get_public_image_url
+    )
+    failed = [Path(image_path).name
+              for image_path, url in zip(combine_request.image_paths, public_urls) if not url]
+    if failed:
+        return {
+            'success': False,
+            'error': f'Не удалось загрузить изображения на публичный хостинг: {", ".join(failed)}',
+            'failed_images': failed
+        }
+    
+    client = get_api_client(api_key)
+    response = client.combine_images(combine_request, public_urls)
+    if not (response.success and response.image_url):
+        return {
+            'success': False,
+            'error': response.error_message or 'Неизвестная ошибка комбинирования'
+        }
+    
+    derivatives = {}
+    relative_path = _save_result(
+        response.image_url, "combined", job_id, generated_folder,
+        aspect_ratio=combine_request.aspect_ratio,
+        resolution=combine_request.resolution,
+        crop_to_aspect=crop_to_aspect,
+        derivatives=derivatives,
+        encoding=encoding
+    )
+    if not relative_path:
+        return {'success': False, 'error': 'Ошибка сохранения изображения'}
+    
+    gen_id = db_manager.add_generation(
+        gen_type="combine",
+        prompt=combine_request.prompt,
+        model=combine_request.model,
+        image_path=relative_path,
+        resolution=combine_request.resolution,
+        negative_prompt=combine_request.negative_prompt,
+        derivatives=derivatives
+    )
+    _cache_store(cache_key, "combine", relative_path, gen_id)
+    
+    return {
+        'success': True,
+        'image_url': f"/api/images/{relative_path}",
+        'image_path': relative_path,
+        'id': gen_id
+    }
+
+
+def _job_accepted(job_id: str):
+    """Ответ 202 для поставленной в очередь задачи"""
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': JOB_QUEUED,
+        'status_url': f"/api/jobs/{job_id}"
+    }), 202
+
+
 @api_bp.route('/generate', methods=['POST'])
 def generate_image():
-    """Генерация изображения"""
+    """Генерация изображения (ставит задачу в очередь)"""
     try:
         data = request.json
         api_key = data.get('api_key')
@@ -70,68 +523,29 @@ def generate_image():
         if not gen_request.prompt:
             return jsonify({'success': False, 'error': 'Промпт не может быть пустым'}), 400
         
-        client = get_api_client(api_key)
+        try:
+            encoding = _request_encoding(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        # Загружаем референсные изображения если есть
-        reference_urls = None
-        if gen_request.reference_images:
-            reference_urls = []
-            for ref_path in gen_request.reference_images:
-                # Путь должен быть относительным от uploads/user/
-                full_path = Path(current_app.config['UPLOAD_FOLDER']) / Path(ref_path).name
-                if full_path.exists():
-                    url = upload_image(str(full_path))
-                    if url:
-                        reference_urls.append(url)
-                    else:
-                        return jsonify({
-                            'success': False,
-                            'error': f'Не удалось загрузить референсное изображение: {ref_path}'
-                        }), 400
-        
-        # Генерируем изображение
-        response = client.generate_image(gen_request, reference_urls)
-        
-        if response.success and response.image_url:
-            # Сохраняем изображение на сервер
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"generated_{timestamp}.png"
-            save_path = Path(current_app.config['GENERATED_FOLDER']) / filename
-            
-            crop_to_aspect = data.get('crop_to_aspect', False)
-            success = url_to_image(
-                response.image_url,
-                str(save_path),
-                aspect_ratio=gen_request.aspect_ratio,
-                resolution=gen_request.resolution,
-                crop_to_aspect=crop_to_aspect
-            )
-            
-            if success:
-                # Сохраняем в БД
-                relative_path = f"generated/{filename}"
-                gen_id = db_manager.add_generation(
-                    gen_type="generate",
-                    prompt=gen_request.prompt,
-                    model=gen_request.model,
-                    image_path=relative_path,
-                    resolution=gen_request.resolution,
-                    negative_prompt=gen_request.negative_prompt
-                )
-                
-                return jsonify({
-                    'success': True,
-                    'image_url': f"/api/images/{relative_path}",
-                    'image_path': relative_path,
-                    'id': gen_id
-                })
-            else:
-                return jsonify({'success': False, 'error': 'Ошибка сохранения изображения'}), 500
-        else:
-            return jsonify({
-                'success': False,
-                'error': response.error_message or 'Неизвестная ошибка генерации'
-            }), 500
+        # Референсные изображения: путь должен быть относительным от uploads/user/
+        reference_paths = []
+        for ref_path in gen_request.reference_images or []:
+            full_path = Path(current_app.config['UPLOAD_FOLDER']) / Path(ref_path).name
+            if full_path.exists():
+                reference_paths.append(str(full_path))
+        
+        job_id = job_manager.submit(
+            "generate",
+            _run_generate_job,
+            api_key,
+            gen_request,
+            reference_paths,
+            current_app.config['GENERATED_FOLDER'],
+            data.get('crop_to_aspect', False),
+            encoding
+        )
+        return _job_accepted(job_id)
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -139,7 +553,7 @@ def generate_image():
 
 @api_bp.route('/edit', methods=['POST'])
 def edit_image():
-    """Редактирование изображения"""
+    """Редактирование изображения (ставит задачу в очередь)"""
     try:
         data = request.json
         api_key = data.get('api_key')
@@ -157,14 +571,6 @@ def edit_image():
         if not full_image_path.exists():
             return jsonify({'success': False, 'error': 'Изображение не найдено'}), 404
         
-        # Загружаем изображение на публичный хостинг
-        public_url = upload_image(str(full_image_path))
-        if not public_url:
-            return jsonify({
-                'success': False,
-                'error': 'Не удалось загрузить изображение на публичный хостинг'
-            }), 500
-        
         # Создаем запрос
         edit_request = EditRequest(
             image_path=str(full_image_path),
@@ -178,49 +584,21 @@ def edit_image():
         if not edit_request.prompt:
             return jsonify({'success': False, 'error': 'Промпт не может быть пустым'}), 400
         
-        client = get_api_client(api_key)
-        response = client.edit_image(edit_request, public_url)
+        try:
+            encoding = _request_encoding(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        if response.success and response.image_url:
-            # Сохраняем изображение на сервер
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"edited_{timestamp}.png"
-            save_path = Path(current_app.config['GENERATED_FOLDER']) / filename
-            
-            crop_to_aspect = data.get('crop_to_aspect', False)
-            success = url_to_image(
-                response.image_url,
-                str(save_path),
-                aspect_ratio=edit_request.aspect_ratio,
-                resolution=edit_request.resolution,
-                crop_to_aspect=crop_to_aspect
-            )
-            
-            if success:
-                # Сохраняем в БД
-                relative_path = f"generated/{filename}"
-                gen_id = db_manager.add_generation(
-                    gen_type="edit",
-                    prompt=edit_request.prompt,
-                    model=edit_request.model,
-                    image_path=relative_path,
-                    resolution=edit_request.resolution,
-                    negative_prompt=edit_request.negative_prompt
-                )
-                
-                return jsonify({
-                    'success': True,
-                    'image_url': f"/api/images/{relative_path}",
-                    'image_path': relative_path,
-                    'id': gen_id
-                })
-            else:
-                return jsonify({'success': False, 'error': 'Ошибка сохранения изображения'}), 500
-        else:
-            return jsonify({
-                'success': False,
-                'error': response.error_message or 'Неизвестная ошибка редактирования'
-            }), 500
+        job_id = job_manager.submit(
+            "edit",
+            _run_edit_job,
+            api_key,
+            edit_request,
+            current_app.config['GENERATED_FOLDER'],
+            data.get('crop_to_aspect', False),
+            encoding
+        )
+        return _job_accepted(job_id)
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -228,7 +606,7 @@ def edit_image():
 
 @api_bp.route('/combine', methods=['POST'])
 def combine_images():
-    """Комбинирование изображений"""
+    """Комбинирование изображений (ставит задачу в очередь)"""
     try:
         data = request.json
         api_key = data.get('api_key')
@@ -242,8 +620,7 @@ def combine_images():
         if len(image_paths) > 8:
             return jsonify({'success': False, 'error': 'Максимум 8 изображений'}), 400
         
-        # Загружаем все изображения на публичный хостинг
-        public_urls = []
+        full_paths = []
         for image_path in image_paths:
             full_path = Path(current_app.config['UPLOAD_FOLDER']) / Path(image_path).name
             if not full_path.exists():
@@ -251,18 +628,11 @@ def combine_images():
                     'success': False,
                     'error': f'Изображение не найдено: {image_path}'
                 }), 404
-            
-            public_url = upload_image(str(full_path))
-            if not public_url:
-                return jsonify({
-                    'success': False,
-                    'error': f'Не удалось загрузить изображение на публичный хостинг: {image_path}'
-                }), 500
-            public_urls.append(public_url)
+            full_paths.append(str(full_path))
         
         # Создаем запрос
         combine_request = CombineRequest(
-            image_paths=[str(Path(current_app.config['UPLOAD_FOLDER']) / Path(p).name) for p in image_paths],
+            image_paths=full_paths,
             prompt=data.get('prompt', ''),
             model=data.get('model', 'pro'),
             resolution=data.get('resolution', '2048'),
@@ -273,54 +643,80 @@ def combine_images():
         if not combine_request.prompt:
             return jsonify({'success': False, 'error': 'Промпт не может быть пустым'}), 400
         
-        client = get_api_client(api_key)
-        response = client.combine_images(combine_request, public_urls)
+        try:
+            encoding = _request_encoding(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        if response.success and response.image_url:
-            # Сохраняем изображение на сервер
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"combined_{timestamp}.png"
-            save_path = Path(current_app.config['GENERATED_FOLDER']) / filename
-            
-            crop_to_aspect = data.get('crop_to_aspect', False)
-            success = url_to_image(
-                response.image_url,
-                str(save_path),
-                aspect_ratio=combine_request.aspect_ratio,
-                resolution=combine_request.resolution,
-                crop_to_aspect=crop_to_aspect
-            )
-            
-            if success:
-                # Сохраняем в БД
-                relative_path = f"generated/{filename}"
-                gen_id = db_manager.add_generation(
-                    gen_type="combine",
-                    prompt=combine_request.prompt,
-                    model=combine_request.model,
-                    image_path=relative_path,
-                    resolution=combine_request.resolution,
-                    negative_prompt=combine_request.negative_prompt
-                )
-                
-                return jsonify({
-                    'success': True,
-                    'image_url': f"/api/images/{relative_path}",
-                    'image_path': relative_path,
-                    'id': gen_id
-                })
-            else:
-                return jsonify({'success': False, 'error': 'Ошибка сохранения изображения'}), 500
-        else:
-            return jsonify({
-                'success': False,
-                'error': response.error_message or 'Неизвестная ошибка комбинирования'
-            }), 500
+        job_id = job_manager.submit(
+            "combine",
+            _run_combine_job,
+            api_key,
+            combine_request,
+            current_app.config['GENERATED_FOLDER'],
+            data.get('crop_to_aspect', False),
+            encoding
+        )
+        return _job_accepted(job_id)
             
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Получить статус фоновой задачи"""
+    try:
+        job = job_manager.get(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+        
+        response = {
+            'success': True,
+            'job_id': job['id'],
+            'type': job['type'],
+            'status': job['status'],
+            'created_at': job['created_at'],
+            'updated_at': job['updated_at']
+        }
+        if job['status'] == JOB_COMPLETED:
+            response['result'] = job.get('result')
+        elif job['status'] == JOB_FAILED:
+            response['error'] = job.get('error_message')
+            # Какие именно входные изображения не удалось загрузить
+            failed_images = (job.get('result') or {}).get('failed_images')
+            if failed_images:
+                response['failed_images'] = failed_images
+        
+        return jsonify(response)
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api_bp.route('/callback', methods=['POST'])
+def task_callback():
+    """Прием уведомления о завершении задачи от NanoBanana API"""
+    try:
+        if not hmac.compare_digest(request.args.get('token', ''), _callback_secret()):
+            return jsonify({'success': False, 'error': 'Неверный токен'}), 403
+        
+        result = NanoBananaAPIClient.parse_callback(request.get_json(silent=True))
+        if result is None:
+            # Промежуточное или нераспознанное уведомление
+            return jsonify({'success': True, 'ignored': True})
+        
+        # Будим ожидающий поток этого процесса, иначе сохраняем результат
+        # для воркера, который ждет задачу
+        if not task_poller.resolve(result['task_id'], result):
+            db_manager.add_task_callback(result['task_id'], result)
+        
+        return jsonify({'success': True})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @api_bp.route('/upload', methods=['POST'])
 def upload_file():
     """Загрузка файла на сервер"""
@@ -347,6 +743,12 @@ def upload_file():
         save_path = Path(current_app.config['UPLOAD_FOLDER']) / filename
         file.save(str(save_path))
         
+        # Загружаем на хостинг в фоне, пока пользователь заполняет форму
+        # (при SELF_HOSTED_IMAGES загрузка на хостинг не нужна). Разрешение
+        # формы нужно, чтобы задача взяла эту загрузку при UPLOAD_OPTIMIZE
+        if not SELF_HOSTED_IMAGES:
+            get_pre_uploader().start(str(save_path), request.form.get('resolution') or None)
+        
         return jsonify({
             'success': True,
             'filename': filename,
@@ -358,15 +760,77 @@ def upload_file():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _sendfile_header(file_path: Path):
+    """Заголовок для отдачи файла фронт-прокси или None, если отдает сам Flask"""
+    if SENDFILE_MODE == 'x-sendfile':
+        return 'X-Sendfile', str(file_path.resolve())
+    if SENDFILE_MODE == 'x-accel-redirect':
+        try:
+            relative = file_path.resolve().relative_to(BACKEND_DIR.resolve()).as_posix()
+        except ValueError:
+            return None  # Файл вне папки backend: location nginx на него не указывает
+        return 'X-Accel-Redirect', f"{SENDFILE_PREFIX.rstrip('/')}/{quote(relative)}"
+    return None
+
+
+def _send_image(file_path: Path, mimetype: str = None, immutable: bool = False):
+    """
+    Отдать файл изображения с поддержкой HTTP кэширования
+    
+    ETag - sha256 содержимого (запоминается по размеру и времени изменения
+    файла), поэтому запрос с If-None-Match или If-Modified-Since получает
+    304 без тела, а Range - 206 с частью файла. При SENDFILE_MODE байты
+    отдает фронт-прокси, воркер только проверяет условия запроса.
+    
+    Args:
+        file_path: Путь к файлу
+        mimetype: MIME-тип (по умолчанию по расширению)
+        immutable: Файл никогда не меняется (Cache-Control: immutable на год),
+                   иначе браузер проверяет его по ETag при каждом показе
+    """
+    mimetype = mimetype or mimetypes.guess_type(file_path.name)[0] or 'application/octet-stream'
+    etag = file_digest(str(file_path))
+    sendfile_header = _sendfile_header(file_path)
+    
+    if sendfile_header:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers[sendfile_header[0]] = sendfile_header[1]
+        response.set_etag(etag)
+        response.last_modified = file_path.stat().st_mtime
+        # Range обрабатывает прокси, здесь - только 304
+        response.make_conditional(request)
+    else:
+        response = send_file(str(file_path), mimetype=mimetype, conditional=True, etag=etag)
+    
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
 @api_bp.route('/images/<path:filename>', methods=['GET'])
 def get_image(filename):
-    """Получить изображение"""
+    """
+    Получить изображение
+    
+    Параметры width, height, format (webp, jpeg, png) и quality
+    возвращают уменьшенную копию (см. ImageVariantCache).
+    """
     try:
         # Безопасность: проверяем, что путь не выходит за пределы uploads
         safe_path = Path(filename)
         if '..' in str(safe_path) or safe_path.is_absolute():
             return jsonify({'error': 'Неверный путь'}), 400
         
+        try:
+            variant_args = parse_variant_args(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # Определяем папку на основе пути
         if filename.startswith('generated/'):
             directory = current_app.config['GENERATED_FOLDER']
@@ -393,10 +857,41 @@ def get_image(filename):
             else:
                 return jsonify({'error': 'Изображение не найдено'}), 404
         
-        if not file_path.exists():
+        if not safe_join(str(directory), file_name) or not file_path.is_file():
+            return jsonify({'error': 'Изображение не найдено'}), 404
+        
+        # Имена сгенерированных файлов уникальны, а сами файлы не перезаписываются
+        immutable = directory == current_app.config['GENERATED_FOLDER']
+        
+        if variant_args:
+            variant_path = image_variants.get(str(file_path), **variant_args)
+            return _send_image(
+                variant_path,
+                mimetype=image_variants.mimetype(variant_args['format']),
+                immutable=immutable
+            )
+        
+        return _send_image(file_path, immutable=immutable)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@api_bp.route('/public/<path:filename>', methods=['GET'])
+def get_public_image(filename):
+    """Изображение по подписанной ссылке (см. get_public_image_url)"""
+    try:
+        if not verify_signature(filename, request.args.get('expires'), request.args.get('sig')):
+            return jsonify({'error': 'Ссылка недействительна или истекла'}), 403
+        
+        prefix, _, file_name = filename.partition('/')
+        directory = _public_roots().get(prefix)
+        # safe_join не выпускает путь за пределы папки
+        file_path = safe_join(str(directory), file_name) if directory is not None else None
+        if not file_path or not Path(file_path).is_file():
             return jsonify({'error': 'Изображение не найдено'}), 404
         
-        return send_from_directory(str(directory), file_name)
+        return _send_image(Path(file_path))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -420,8 +915,7 @@ def get_gallery():
         
         # Преобразуем пути в URL
         for gen in generations:
-            if gen.get('image_path'):
-                gen['image_url'] = f"/api/images/{gen['image_path']}"
+            _add_image_urls(gen)
         
         return jsonify({
             'success': True,
@@ -440,8 +934,7 @@ def get_generation(gen_id):
         if not gen:
             return jsonify({'success': False, 'error': 'Генерация не найдена'}), 404
         
-        if gen.get('image_path'):
-            gen['image_url'] = f"/api/images/{gen['image_path']}"
+        _add_image_urls(gen)
         
         return jsonify({
             'success': True,
@@ -475,6 +968,8 @@ def delete_generation(gen_id):
                     file_path.unlink()
                 except Exception as e:
                     print(f"Ошибка удаления файла: {e}")
+            if file_path:
+                remove_derivatives(file_path)
         
         # Удаляем из БД
         deleted = db_manager.delete_generation(gen_id)
@@ -500,3 +995,105 @@ def get_statistics():
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api_bp.route('/polling/stats', methods=['GET'])
+def get_polling_stats():
+    """Статистика адаптивного опроса статуса задач"""
+    try:
+        return jsonify({
+            'success': True,
+            'stats': poll_scheduler.get_stats()
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api_bp.route('/rate-limits/stats', methods=['GET'])
+def get_rate_limits_stats():
+    """Состояние лимитов частоты запросов по API ключам (вместо ключей - хэш, см. key_id)"""
+    try:
+        return jsonify({
+            'success': True,
+            'stats': get_rate_limit_stats()
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Статистика кэша результатов"""
+    try:
+        return jsonify({
+            'success': True,
+            'enabled': result_cache is not None,
+            'stats': result_cache.get_stats() if result_cache else None
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api_bp.route('/upload-cache/stats', methods=['GET'])
+def get_upload_cache_stats():
+    """Статистика кэша ссылок на загруженные изображения"""
+    try:
+        preparer = get_upload_preparer()
+        return jsonify({
+            'success': True,
+            'stats': get_upload_cache().get_stats(),
+            'optimization': preparer.get_stats() if preparer else None
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api_bp.route('/upload-hosts/stats', methods=['GET'])
+def get_upload_hosts_stats():
+    """Доля успешных загрузок, время ответа и исключения хостингов (в этом процессе)"""
+    try:
+        return jsonify({
+            'success': True,
+            'stats': get_upload_health().get_stats()
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api_bp.route('/image-variants/stats', methods=['GET'])
+def get_image_variants_stats():
+    """Попадания и размер кэша уменьшенных копий изображений (в этом процессе)"""
+    try:
+        return jsonify({
+            'success': True,
+            'stats': image_variants.get_stats()
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api_bp.route('/image-pipeline/stats', methods=['GET'])
+def get_image_pipeline_stats():
+    """Время скачивания, декодирования, обрезки и кодирования результатов и пул процессов (в этом процессе)"""
+    try:
+        encoding = get_output_encoding()
+        return jsonify({
+            'success': True,
+            'stats': get_pipeline_stats(),
+            'pool': get_image_pool().get_stats(),
+            'output': {
+                'format': encoding.format,
+                'quality': encoding.quality,
+                'effort': encoding.effort,
+                'archive': encoding.archive
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -0,0 +1,3 @@
+"""
+Локальный симулятор NanoBanana API для нагрузочных тестов и бенчмарков
+"""
@@ -0,0 +1,184 @@
+"""
+Бенчмарк конвейера генерации на локальном симуляторе NanoBanana API
+
+Создает N задач через NanoBananaAPIClient (или AsyncNanoBananaAPIClient),
+дожидается результатов, при необходимости скачивает изображения и
+выводит пропускную способность, перцентили задержки, число запросов
+к API и расход ресурсов процесса.
+
+Запуск:
+    python -m backend.simulator.benchmark --tasks 200 --time-scale 0.05
+    python -m backend.simulator.benchmark --tasks 1000 --async --model pro
+"""
+import argparse
+import asyncio
+import json
+import resource
+import tempfile
+import threading
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import requests
+
+from ..api.async_client import AsyncNanoBananaAPIClient
+from ..api.handles import as_completed
+from ..api.models import GenerationRequest
+from ..api.nanobanana_client import NanoBananaAPIClient
+from ..api.rate_limiter import RateLimiter
+from ..utils.image_utils import url_to_image
+from .server import SimulatorConfig, start_simulator
+
+
+def percentile(values, p: float) -> float:
+    """Перцентиль p (0-100) по отсортированному списку"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def run_sync(client: NanoBananaAPIClient, base_request: GenerationRequest, tasks: int,
+             download_dir: str = None) -> list:
+    """Задачи через submit_generate; возвращает [(успех, задержка)]"""
+    results = []
+    started = {}
+    handles = {}
+    for i in range(tasks):
+        request = replace(base_request, prompt=f"{base_request.prompt} #{i}")
+        started_at = time.monotonic()
+        handle = client.submit_generate(request)
+        started[handle] = started_at
+        handles[handle] = i
+    for handle in as_completed(handles):
+        response = handle.result()
+        success = response.success
+        if success and download_dir:
+            success = url_to_image(response.image_url, str(Path(download_dir) / f"{handles[handle]}.png"))
+        results.append((success, time.monotonic() - started[handle]))
+    return results
+
+
+async def run_async(client: AsyncNanoBananaAPIClient, base_request: GenerationRequest, tasks: int,
+                    download_dir: str = None) -> list:
+    """Задачи через асинхронный клиент; возвращает [(успех, задержка)]"""
+    async def one(i: int):
+        started_at = time.monotonic()
+        response = await client.generate_image(replace(base_request, prompt=f"{base_request.prompt} #{i}"))
+        success = response.success
+        if success and download_dir:
+            success = await client.download_image(response.image_url, str(Path(download_dir) / f"{i}.png"))
+        return success, time.monotonic() - started_at
+
+    async with client:
+        return await asyncio.gather(*(one(i) for i in range(tasks)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк генерации на симуляторе NanoBanana API")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--model", choices=["flash", "pro"], default="flash")
+    parser.add_argument("--resolution", default="2048")
+    parser.add_argument("--aspect-ratio", default="1:1")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="AsyncNanoBananaAPIClient")
+    parser.add_argument("--download", action="store_true", help="Скачивать результаты")
+    parser.add_argument("--api-root", default=None, help="Внешний симулятор (иначе запускается встроенный)")
+    parser.add_argument("--time-scale", type=float, default=0.05)
+    parser.add_argument("--fail-rate", type=float, default=0.02)
+    parser.add_argument("--sim-rate-limit", type=float, default=0.0, help="Лимит симулятора, запросов/с")
+    parser.add_argument("--image-scale", type=float, default=0.25)
+    parser.add_argument("--create-rate", type=float, default=50.0, help="Лимит клиента на создание задач")
+    parser.add_argument("--poll-rate", type=float, default=200.0, help="Лимит клиента на опрос")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args()
+
+    api_root = args.api_root
+    if not api_root:
+        _, api_root = start_simulator(SimulatorConfig(
+            time_scale=args.time_scale,
+            generate_fail_rate=args.fail_rate,
+            rate_limit=args.sim_rate_limit,
+            credits=1e12,
+            image_scale=args.image_scale,
+            seed=args.seed
+        ))
+    stats_url = api_root.rsplit("/api/", 1)[0] + "/sim/stats"
+
+    limiter = RateLimiter(
+        create_rate=args.create_rate, create_burst=max(1, int(args.create_rate)),
+        poll_rate=args.poll_rate, poll_burst=max(1, int(args.poll_rate))
+    )
+    base_request = GenerationRequest(
+        prompt="benchmark",
+        model=args.model,
+        resolution=args.resolution,
+        aspect_ratio=args.aspect_ratio
+    )
+    download_dir = tempfile.mkdtemp(prefix="nb_bench_") if args.download else None
+
+    stats_before = requests.get(stats_url, timeout=10).json()
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    peak_threads = [threading.active_count()]
+    stop = threading.Event()
+
+    def sample_threads():
+        while not stop.wait(0.2):
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+    threading.Thread(target=sample_threads, daemon=True).start()
+
+    started_at = time.monotonic()
+    if args.use_async:
+        client = AsyncNanoBananaAPIClient("benchmark", rate_limiter=limiter, api_root=api_root)
+        results = asyncio.run(run_async(client, base_request, args.tasks, download_dir))
+    else:
+        client = NanoBananaAPIClient("benchmark", rate_limiter=limiter, api_root=api_root)
+        results = run_sync(client, base_request, args.tasks, download_dir)
+    wall = time.monotonic() - started_at
+    stop.set()
+
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    stats_after = requests.get(stats_url, timeout=10).json()
+    polls = (stats_after["requests"].get("record-info", 0) -
+             stats_before["requests"].get("record-info", 0))
+    latencies = sorted(latency for success, latency in results if success)
+    succeeded = len(latencies)
+
+    report = {
+        "client": "async" if args.use_async else "sync",
+        "tasks": args.tasks,
+        "succeeded": succeeded,
+        "failed": args.tasks - succeeded,
+        "wall_seconds": round(wall, 2),
+        "throughput_per_sec": round(succeeded / wall, 2) if wall else 0,
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p95": round(percentile(latencies, 95), 3),
+        "latency_p99": round(percentile(latencies, 99), 3),
+        "latency_max": round(latencies[-1], 3) if latencies else 0,
+        "polls": polls,
+        "polls_per_task": round(polls / args.tasks, 2) if args.tasks else 0,
+        "throttled": stats_after["throttled"] - stats_before["throttled"],
+        "cpu_seconds": round((usage_after.ru_utime - usage_before.ru_utime) +
+                             (usage_after.ru_stime - usage_before.ru_stime), 2),
+        "max_rss_mb": round(usage_after.ru_maxrss / 1024, 1),
+        "peak_threads": peak_threads[0]
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Клиент: {report['client']}, задач: {report['tasks']}, "
+          f"успешно: {report['succeeded']}, ошибок: {report['failed']}")
+    print(f"Время: {report['wall_seconds']} с, пропускная способность: {report['throughput_per_sec']} задач/с")
+    print(f"Задержка p50/p95/p99/max: {report['latency_p50']} / {report['latency_p95']} / "
+          f"{report['latency_p99']} / {report['latency_max']} с")
+    print(f"Опросов record-info: {report['polls']} ({report['polls_per_task']} на задачу), "
+          f"ответов 429: {report['throttled']}")
+    print(f"CPU: {report['cpu_seconds']} с, пик RSS: {report['max_rss_mb']} МБ, "
+          f"пик потоков: {report['peak_threads']}")
+
+
+if __name__ == "__main__":
+    main()
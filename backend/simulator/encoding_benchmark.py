@@ -0,0 +1,150 @@
+"""
+Бенчмарк форматов сохранения результатов (см. utils/output_format.py)
+
+Кодирует изображения во все сочетания формата, качества и сжатия и
+выводит время кодирования и декодирования и размер файла относительно
+PNG с настройками по умолчанию (так результаты сохранялись раньше).
+Помогает выбрать OUTPUT_FORMAT / OUTPUT_QUALITY / OUTPUT_EFFORT.
+
+Запуск:
+    python -m backend.simulator.encoding_benchmark
+    python -m backend.simulator.encoding_benchmark --images backend/uploads/generated/*.png
+    python -m backend.simulator.encoding_benchmark --sizes 4096 --formats webp,avif --efforts 0,6,9
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from ..utils.output_format import DEFAULT_EFFORT, MAX_EFFORT, OUTPUT_FORMATS, OutputEncoding
+
+
+def synthetic_image(size: int, seed: int = 1) -> Image.Image:
+    """
+    Изображение, похожее на типичный результат генерации
+
+    Плавные градиенты, размытые пятна, четкие фигуры и слабый шум: случайный
+    шум сжимается нетипично плохо, однотонная заливка - нетипично хорошо.
+    """
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient("L").resize((size, size))
+    image = Image.merge("RGB", (
+        gradient,
+        gradient.rotate(90),
+        Image.radial_gradient("L").resize((size, size))
+    ))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(size), rng.randrange(size)
+        radius = rng.randrange(size // 40, size // 6)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+    image = image.filter(ImageFilter.GaussianBlur(size / 200))
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y = rng.randrange(size), rng.randrange(size)
+        draw.rectangle((x, y, x + size // 12, y + size // 20), outline=(20, 20, 20), width=max(1, size // 512))
+    noise = Image.effect_noise((size, size), 12).convert("RGB")
+    return Image.blend(image, noise, 0.08)
+
+
+def measure(image: Image.Image, encoding: OutputEncoding, repeat: int) -> dict:
+    """Медианное время кодирования и декодирования и размер файла"""
+    encode_times = []
+    decode_times = []
+    data = b""
+    for _ in range(repeat):
+        buffer = BytesIO()
+        started_at = time.perf_counter()
+        encoding.save(image, buffer)
+        encode_times.append(time.perf_counter() - started_at)
+        data = buffer.getvalue()
+
+        started_at = time.perf_counter()
+        with Image.open(BytesIO(data)) as decoded:
+            decoded.load()
+        decode_times.append(time.perf_counter() - started_at)
+    return {
+        "encode_ms": statistics.median(encode_times) * 1000,
+        "decode_ms": statistics.median(decode_times) * 1000,
+        "bytes": len(data)
+    }
+
+
+def encodings(formats: list, qualities: list, efforts: list):
+    """Сочетания параметров (качество PNG не влияет на результат)"""
+    for fmt in formats:
+        for effort in efforts:
+            for quality in (qualities if fmt != "png" else [qualities[0]]):
+                yield OutputEncoding(format=fmt, quality=quality, effort=effort)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк форматов сохранения результатов")
+    parser.add_argument("--images", nargs="*", help="Изображения (иначе синтетические)")
+    parser.add_argument("--sizes", default="1024,2048", help="Стороны синтетических изображений")
+    parser.add_argument("--formats", default=",".join(OUTPUT_FORMATS),
+                        help=f"Форматы (доступны: {', '.join(OUTPUT_FORMATS)})")
+    parser.add_argument("--qualities", default="80,90")
+    parser.add_argument("--efforts", default=f"0,3,{DEFAULT_EFFORT},{MAX_EFFORT}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args()
+
+    if args.images:
+        images = {}
+        for path in args.images:
+            with Image.open(path) as image:
+                image.load()
+                images[path] = image
+    else:
+        images = {f"synthetic {size}px": synthetic_image(int(size), args.seed)
+                  for size in args.sizes.split(",")}
+
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",")]
+    qualities = [int(q) for q in args.qualities.split(",")]
+    efforts = [int(e) for e in args.efforts.split(",")]
+
+    baseline = OutputEncoding()
+    rows = []
+    for name, image in images.items():
+        base = measure(image, baseline, args.repeat)
+        for encoding in encodings(formats, qualities, efforts):
+            result = measure(image, encoding, args.repeat)
+            rows.append({
+                "image": name,
+                "size": f"{image.width}x{image.height}",
+                "format": encoding.format,
+                "quality": encoding.quality if encoding.format != "png" else None,
+                "effort": encoding.effort,
+                "lossless": encoding.lossless,
+                "encode_ms": round(result["encode_ms"], 1),
+                "decode_ms": round(result["decode_ms"], 1),
+                "kb": round(result["bytes"] / 1024, 1),
+                "size_vs_png": round(result["bytes"] / base["bytes"], 3),
+                "encode_vs_png": round(result["encode_ms"] / base["encode_ms"], 2)
+            })
+
+    if args.json:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+        return
+
+    current = None
+    for row in rows:
+        if row["image"] != current:
+            current = row["image"]
+            print(f"\n{current} ({row['size']}), базовый уровень - PNG с настройками по умолчанию")
+            print(f"{'формат':<8}{'кач.':>6}{'сжатие':>8}{'кодир., мс':>12}{'декод., мс':>12}"
+                  f"{'КБ':>10}{'размер':>9}{'время':>8}")
+        quality = row["quality"] if row["quality"] is not None else "-"
+        print(f"{row['format']:<8}{quality:>6}{row['effort']:>8}{row['encode_ms']:>12}{row['decode_ms']:>12}"
+              f"{row['kb']:>10}{row['size_vs_png']:>9}{row['encode_vs_png']:>8}")
+
+
+if __name__ == "__main__":
+    main()
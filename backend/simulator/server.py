@@ -0,0 +1,457 @@
+"""
+Локальный симулятор NanoBanana API
+
+Реализует те же эндпоинты, что использует клиент (generate, generate-pro,
+record-info, common/credit), и хостинг изображений результатов. Время
+выполнения задач, доля ошибок (successFlag 2/3), ограничение частоты
+запросов и доставка callback настраиваются, поэтому клиент, Flask
+бэкенд и воркеры GUI можно гонять без боевого сервиса и кредитов.
+
+Запуск:
+    python -m backend.simulator.server --port 8090 --time-scale 0.1
+
+Клиенты направляются на симулятор переменной окружения
+NANOBANANA_API_URL=http://127.0.0.1:8090/api/v1
+"""
+import argparse
+import heapq
+import io
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional, Dict
+from urllib.parse import urlparse
+
+import requests
+from flask import Flask, request, jsonify, Response
+from PIL import Image
+from werkzeug.serving import make_server
+
+
+@dataclass
+class LatencyProfile:
+    """Логнормальное распределение времени выполнения задачи"""
+    median: float  # Медиана, секунд
+    sigma: float = 0.35  # Разброс (sigma логнормального распределения)
+    minimum: float = 1.0  # Минимальное время, секунд
+
+    def sample(self, rng: random.Random) -> float:
+        return max(self.minimum, self.median * math.exp(rng.gauss(0, self.sigma)))
+
+
+def default_latency() -> Dict[str, LatencyProfile]:
+    """Профили времени выполнения по умолчанию (близки к боевому API)"""
+    return {
+        "generate": LatencyProfile(12),
+        "pro-1K": LatencyProfile(25),
+        "pro-2K": LatencyProfile(30),
+        "pro-4K": LatencyProfile(60, sigma=0.4),
+    }
+
+
+@dataclass
+class SimulatorConfig:
+    """Параметры симулятора"""
+    latency: Dict[str, LatencyProfile] = field(default_factory=default_latency)
+    time_scale: float = 1.0  # Множитель всех задержек (0.01 - в 100 раз быстрее)
+    request_latency: float = 0.0  # Задержка ответа на каждый запрос, секунд
+    create_fail_rate: float = 0.0  # Доля задач с successFlag 2
+    generate_fail_rate: float = 0.02  # Доля задач с successFlag 3
+    rate_limit: float = 0.0  # Запросов в секунду на ключ (0 - без ограничения)
+    rate_burst: int = 10
+    retry_after: int = 1  # Значение Retry-After в ответе 429
+    callbacks: bool = True  # Доставлять callback на callBackUrl
+    callback_retries: int = 2
+    credits: float = 1000.0
+    credits_per_task: float = 1.0
+    image_scale: float = 1.0  # Масштаб размера результата относительно заявленного разрешения
+    image_noise: bool = True  # Шум вместо заливки: размер PNG близок к реальному
+    seed: Optional[int] = None
+
+
+# Размер стороны результата для разрешения
+RESOLUTION_SIDE = {"1K": 1024, "2K": 2048, "4K": 4096}
+
+# Адреса-заглушки, на которые callback не отправляется
+DUMMY_CALLBACK_HOSTS = ("example.com",)
+
+API_PREFIX = "/api/v1"
+
+
+@dataclass
+class SimTask:
+    """Задача симулятора"""
+    task_id: str
+    api_key: str
+    endpoint: str
+    created_at: float
+    duration: float
+    outcome: int  # Итоговый successFlag: 1, 2 или 3
+    width: int
+    height: int
+    callback_url: Optional[str] = None
+
+
+class _Bucket:
+    """Token bucket без ожидания: запрос либо проходит, либо получает 429"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def _image_size(resolution: str, aspect_ratio: str, scale: float):
+    """Размер результата по разрешению и соотношению сторон"""
+    side = RESOLUTION_SIDE.get(resolution, 1024) * scale
+    try:
+        w, h = (float(x) for x in (aspect_ratio or "1:1").split(":"))
+    except ValueError:
+        w, h = 1.0, 1.0
+    if w >= h:
+        return max(1, int(side)), max(1, int(side * h / w))
+    return max(1, int(side * w / h)), max(1, int(side))
+
+
+class Simulator:
+    """Состояние симулятора: задачи, баланс, лимиты, доставка callback"""
+
+    def __init__(self, config: SimulatorConfig = None):
+        self.config = config or SimulatorConfig()
+        self.rng = random.Random(self.config.seed)
+        self.tasks: Dict[str, SimTask] = {}
+        self.credits = self.config.credits
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, _Bucket] = {}
+        self.images: Dict[tuple, bytes] = {}  # {(width, height): PNG}
+        self.images_lock = threading.Lock()
+        self.stats = {
+            "requests": {},
+            "throttled": 0,
+            "tasks_created": 0,
+            "tasks_succeeded": 0,
+            "tasks_failed": 0,
+            "callbacks_sent": 0,
+            "callbacks_failed": 0,
+            "image_bytes_served": 0
+        }
+        self._callbacks = []  # heap [(время доставки, task_id)]
+        self._callbacks_cond = threading.Condition()
+        self._session = requests.Session()
+        # Адрес симулятора для ссылок в callback (берется из последнего запроса)
+        self.host_url = "http://127.0.0.1/"
+        threading.Thread(target=self._deliver_callbacks, name="sim-callbacks", daemon=True).start()
+
+    def count(self, name: str, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def count_request(self, endpoint: str):
+        with self.lock:
+            requests_stats = self.stats["requests"]
+            requests_stats[endpoint] = requests_stats.get(endpoint, 0) + 1
+
+    def allow(self, api_key: str) -> bool:
+        """Проверить лимит частоты запросов ключа"""
+        if self.config.rate_limit <= 0:
+            return True
+        with self.lock:
+            bucket = self.buckets.get(api_key)
+            if bucket is None:
+                bucket = _Bucket(self.config.rate_limit, self.config.rate_burst)
+                self.buckets[api_key] = bucket
+            return bucket.allow()
+
+    def create_task(self, api_key: str, endpoint: str, profile: str, width: int, height: int,
+                    callback_url: str = None) -> Optional[SimTask]:
+        """
+        Создать задачу
+
+        Returns:
+            SimTask или None, если не хватает кредитов
+        """
+        config = self.config
+        with self.lock:
+            if self.credits < config.credits_per_task:
+                return None
+            self.credits -= config.credits_per_task
+            roll = self.rng.random()
+            latency = config.latency.get(profile) or config.latency["generate"]
+            duration = latency.sample(self.rng)
+        if roll < config.create_fail_rate:
+            outcome = 2
+            duration = min(duration, 1.0)
+        elif roll < config.create_fail_rate + config.generate_fail_rate:
+            outcome = 3
+        else:
+            outcome = 1
+
+        task = SimTask(
+            task_id=uuid.uuid4().hex,
+            api_key=api_key,
+            endpoint=endpoint,
+            created_at=time.monotonic(),
+            duration=duration * config.time_scale,
+            outcome=outcome,
+            width=width,
+            height=height,
+            callback_url=callback_url
+        )
+        with self.lock:
+            self.tasks[task.task_id] = task
+            self.stats["tasks_created"] += 1
+            self.stats["tasks_succeeded" if outcome == 1 else "tasks_failed"] += 1
+
+        if config.callbacks and callback_url and urlparse(callback_url).hostname not in DUMMY_CALLBACK_HOSTS:
+            with self._callbacks_cond:
+                heapq.heappush(self._callbacks, (task.created_at + task.duration, task.task_id))
+                self._callbacks_cond.notify()
+        return task
+
+    def task_state(self, task: SimTask) -> int:
+        """Текущий successFlag задачи"""
+        if time.monotonic() - task.created_at < task.duration:
+            return 0
+        return task.outcome
+
+    def image_url(self, task: SimTask, host_url: str) -> str:
+        return f"{host_url.rstrip('/')}/images/{task.task_id}.png"
+
+    def render_image(self, width: int, height: int) -> bytes:
+        """PNG результата (одинаковый для задач одного размера)"""
+        with self.images_lock:
+            data = self.images.get((width, height))
+            if data is None:
+                if self.config.image_noise:
+                    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+                else:
+                    image = Image.new("RGB", (width, height), (255, 200, 0))
+                buffer = io.BytesIO()
+                image.save(buffer, "PNG", compress_level=1)
+                data = buffer.getvalue()
+                self.images[(width, height)] = data
+            return data
+
+    def callback_payload(self, task: SimTask, host_url: str) -> dict:
+        """Тело callback в формате NanoBanana API"""
+        if task.outcome == 1:
+            return {
+                "code": 200,
+                "msg": "Image generated successfully.",
+                "data": {
+                    "taskId": task.task_id,
+                    "info": {"resultImageUrl": self.image_url(task, host_url)}
+                }
+            }
+        return {
+            "code": 400 if task.outcome == 2 else 501,
+            "msg": "Image generation failed",
+            "data": {
+                "taskId": task.task_id,
+                "successFlag": task.outcome,
+                "errorMessage": "Simulated generation failure"
+            }
+        }
+
+    def _deliver_callbacks(self):
+        """Поток доставки callback по готовности задач"""
+        while True:
+            with self._callbacks_cond:
+                while not self._callbacks:
+                    self._callbacks_cond.wait()
+                due, task_id = self._callbacks[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._callbacks_cond.wait(delay)
+                    continue
+                heapq.heappop(self._callbacks)
+            task = self.tasks.get(task_id)
+            if task is None:
+                continue
+            threading.Thread(target=self._post_callback, args=(task,), daemon=True).start()
+
+    def _post_callback(self, task: SimTask):
+        payload = self.callback_payload(task, self.host_url)
+        for attempt in range(self.config.callback_retries + 1):
+            try:
+                response = self._session.post(task.callback_url, json=payload, timeout=10)
+                if response.status_code < 500:
+                    self.count("callbacks_sent")
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(2 ** attempt * self.config.time_scale)
+        self.count("callbacks_failed")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            in_flight = sum(1 for task in self.tasks.values() if self.task_state(task) == 0)
+            stats = dict(self.stats, requests=dict(self.stats["requests"]))
+            stats.update({"in_flight": in_flight, "credits": self.credits})
+            return stats
+
+
+def create_simulator_app(config: SimulatorConfig = None) -> Flask:
+    """Создать Flask приложение симулятора"""
+    sim = Simulator(config)
+    app = Flask(__name__)
+    app.config["SIMULATOR"] = sim
+
+    def api_key_or_error():
+        auth = request.headers.get("Authorization", "")
+        if not auth.startswith("Bearer ") or not auth[7:].strip():
+            return None, (jsonify({"code": 401, "msg": "You do not have access permissions"}), 401)
+        api_key = auth[7:].strip()
+        sim.host_url = request.host_url
+        if sim.config.request_latency:
+            time.sleep(sim.config.request_latency)
+        if not sim.allow(api_key):
+            sim.count("throttled")
+            response = jsonify({"code": 429, "msg": "Rate limited"})
+            response.status_code = 429
+            response.headers["Retry-After"] = str(sim.config.retry_after)
+            return None, response
+        return api_key, None
+
+    def create(endpoint: str, profile: str, width: int, height: int, data: dict):
+        api_key, error = api_key_or_error()
+        if error:
+            return error
+        if not data.get("prompt"):
+            return jsonify({"code": 422, "msg": "prompt is required"})
+        if not data.get("callBackUrl"):
+            return jsonify({"code": 422, "msg": "callBackUrl is required"})
+        task = sim.create_task(api_key, endpoint, profile, width, height, data.get("callBackUrl"))
+        if task is None:
+            return jsonify({"code": 402, "msg": "Insufficient credits"})
+        return jsonify({"code": 200, "msg": "success", "data": {"taskId": task.task_id}})
+
+    @app.route(f"{API_PREFIX}/nanobanana/generate", methods=["POST"])
+    def generate():
+        sim.count_request("generate")
+        data = request.get_json(silent=True) or {}
+        width, height = _image_size("1K", data.get("image_size"), sim.config.image_scale)
+        return create("generate", "generate", width, height, data)
+
+    @app.route(f"{API_PREFIX}/nanobanana/generate-pro", methods=["POST"])
+    def generate_pro():
+        sim.count_request("generate-pro")
+        data = request.get_json(silent=True) or {}
+        resolution = data.get("resolution") or "2K"
+        width, height = _image_size(resolution, data.get("aspectRatio"), sim.config.image_scale)
+        return create("generate-pro", f"pro-{resolution}", width, height, data)
+
+    @app.route(f"{API_PREFIX}/nanobanana/record-info", methods=["GET"])
+    def record_info():
+        sim.count_request("record-info")
+        _, error = api_key_or_error()
+        if error:
+            return error
+        task = sim.tasks.get(request.args.get("taskId", ""))
+        if task is None:
+            return jsonify({"code": 422, "msg": "record is null"})
+        state = sim.task_state(task)
+        data = {"taskId": task.task_id, "successFlag": state, "response": None, "errorMessage": None}
+        if state == 1:
+            data["response"] = {"resultImageUrl": sim.image_url(task, request.host_url)}
+        elif state in (2, 3):
+            data["errorMessage"] = "Simulated generation failure"
+        return jsonify({"code": 200, "msg": "success", "data": data})
+
+    @app.route(f"{API_PREFIX}/common/credit", methods=["GET"])
+    def credit():
+        sim.count_request("credit")
+        _, error = api_key_or_error()
+        if error:
+            return error
+        return jsonify({"code": 200, "msg": "success", "data": sim.credits})
+
+    @app.route("/images/<task_id>.png", methods=["GET"])
+    def image(task_id):
+        sim.count_request("image")
+        task = sim.tasks.get(task_id)
+        if task is None or sim.task_state(task) != 1:
+            return jsonify({"code": 404, "msg": "not found"}), 404
+        data = sim.render_image(task.width, task.height)
+        sim.count("image_bytes_served", len(data))
+        return Response(data, mimetype="image/png")
+
+    @app.route("/sim/stats", methods=["GET"])
+    def stats():
+        return jsonify(sim.get_stats())
+
+    return app
+
+
+def start_simulator(config: SimulatorConfig = None, host: str = "127.0.0.1", port: int = 0,
+                    quiet: bool = True):
+    """
+    Запустить симулятор в фоновом потоке
+
+    Args:
+        config: Параметры симулятора
+        host: Адрес сервера
+        port: Порт (0 - любой свободный)
+        quiet: Не выводить журнал запросов werkzeug
+
+    Returns:
+        Кортеж (сервер werkzeug, корень API для NANOBANANA_API_URL)
+    """
+    if quiet:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    app = create_simulator_app(config)
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="simulator", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}{API_PREFIX}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный симулятор NanoBanana API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Множитель времени выполнения задач")
+    parser.add_argument("--request-latency", type=float, default=0.0, help="Задержка каждого ответа, секунд")
+    parser.add_argument("--create-fail-rate", type=float, default=0.0, help="Доля задач с successFlag 2")
+    parser.add_argument("--fail-rate", type=float, default=0.02, help="Доля задач с successFlag 3")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Запросов в секунду на ключ (0 - без лимита)")
+    parser.add_argument("--burst", type=int, default=10, help="Размер всплеска для лимита")
+    parser.add_argument("--no-callbacks", action="store_true", help="Не отправлять callback")
+    parser.add_argument("--credits", type=float, default=1000.0)
+    parser.add_argument("--image-scale", type=float, default=1.0, help="Масштаб размера результата")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = SimulatorConfig(
+        time_scale=args.time_scale,
+        request_latency=args.request_latency,
+        create_fail_rate=args.create_fail_rate,
+        generate_fail_rate=args.fail_rate,
+        rate_limit=args.rate_limit,
+        rate_burst=args.burst,
+        callbacks=not args.no_callbacks,
+        credits=args.credits,
+        image_scale=args.image_scale,
+        seed=args.seed
+    )
+    app = create_simulator_app(config)
+    print(f"Симулятор NanoBanana API: NANOBANANA_API_URL=http://{args.host}:{args.port}{API_PREFIX}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
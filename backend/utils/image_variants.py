@@ -0,0 +1,293 @@
+"""
+Уменьшенные копии изображений по запросу
+
+/api/images/<path>?width=...&height=...&format=...&quality=... отдает
+копию оригинала нужного размера и формата. Копия создается при первом
+запросе и хранится на диске; при превышении лимита размера удаляются
+давно не запрошенные копии (LRU по времени последнего обращения).
+"""
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+from uuid import uuid4
+
+from PIL import Image, ImageOps, features
+
+from .image_pool import get_image_pool
+
+
+# Форматы копий: {параметр format: (формат Pillow, расширение, mimetype)}
+VARIANT_FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "png": ("PNG", "png", "image/png"),
+}
+if features.check("webp"):
+    VARIANT_FORMATS["webp"] = ("WEBP", "webp", "image/webp")
+if "avif" in features.modules and features.check_module("avif"):
+    VARIANT_FORMATS["avif"] = ("AVIF", "avif", "image/avif")
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+# Формат по умолчанию, если в запросе указан только размер
+DEFAULT_FORMAT = "webp" if "webp" in VARIANT_FORMATS else "jpeg"
+DEFAULT_QUALITY = 80
+
+# Ограничение размера копии (защита от запросов огромных изображений)
+MAX_VARIANT_SIDE = 4096
+
+# Лимит размера папки копий
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# После превышения лимита папка очищается до этой доли от него
+EVICT_TO = 0.9
+
+
+def _parse_int(args, name: str, low: int, high: int) -> Optional[int]:
+    value = args.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"Параметр {name} должен быть целым числом")
+    if not low <= value <= high:
+        raise ValueError(f"Параметр {name} должен быть от {low} до {high}")
+    return value
+
+
+def parse_variant_args(args) -> Optional[Dict]:
+    """
+    Параметры копии из строки запроса
+    
+    Args:
+        args: request.args (width, height, format, quality)
+    
+    Returns:
+        Словарь {"width", "height", "format", "quality"} или None, если
+        нужен оригинал
+    
+    Raises:
+        ValueError: Неверное значение параметра
+    """
+    width = _parse_int(args, "width", 1, MAX_VARIANT_SIDE)
+    height = _parse_int(args, "height", 1, MAX_VARIANT_SIDE)
+    quality = _parse_int(args, "quality", 1, 100)
+    fmt = (args.get("format") or "").lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt and fmt not in VARIANT_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат. Доступные: {', '.join(VARIANT_FORMATS)}")
+    
+    if width is None and height is None and not fmt and quality is None:
+        return None
+    return {
+        "width": width,
+        "height": height,
+        "format": fmt or DEFAULT_FORMAT,
+        "quality": quality or DEFAULT_QUALITY
+    }
+
+
+def _render(source_path: str, output_path: str, width: int, height: int, format: str, quality: int):
+    """Уменьшить и закодировать изображение (выполняется в пуле процессов)"""
+    pil_format = VARIANT_FORMATS[format][0]
+    with Image.open(source_path) as img:
+        if img.format == "JPEG" and (width or height):
+            # Декодер JPEG сразу уменьшает изображение кратно 2
+            img.draft("RGB", (width or img.width, height or img.height))
+        img = ImageOps.exif_transpose(img)
+        
+        scale = min(width / img.width if width else 1, height / img.height if height else 1)
+        if scale < 1:
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        mode = "RGBA" if has_alpha and pil_format != "JPEG" else "RGB"
+        if img.mode != mode:
+            img = img.convert(mode)
+        
+        if pil_format == "PNG":
+            img.save(output_path, pil_format, optimize=True)
+        else:
+            img.save(output_path, pil_format, quality=quality)
+
+
+class ImageVariantCache:
+    """Копии изображений с другим размером и форматом в папке на диске"""
+    
+    def __init__(self, cache_dir: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            cache_dir: Папка копий (по умолчанию backend/data/image_variants)
+            max_bytes: Лимит суммарного размера копий
+        """
+        if cache_dir is None:
+            cache_dir = Path(__file__).parent.parent / "data" / "image_variants"
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        
+        self._lock = threading.Lock()
+        self._variant_locks = {}  # {ключ: [Lock, число ожидающих]}
+        self._evict_lock = threading.Lock()
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+        
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0  # Запросы, дождавшиеся копии, которую создавал другой поток или воркер
+        self.evicted = 0
+        self.render_seconds = 0.0
+    
+    def get(self, source_path: str, width: int = None, height: int = None,
+            format: str = DEFAULT_FORMAT, quality: int = DEFAULT_QUALITY) -> Path:
+        """
+        Путь к копии изображения (создается при первом запросе)
+        
+        Размер вписывается в width x height с сохранением пропорций;
+        изображение никогда не увеличивается.
+        
+        Args:
+            source_path: Путь к оригиналу
+            width, height: Максимальные ширина и высота (None - без ограничения)
+            format: Ключ VARIANT_FORMATS
+            quality: Качество для форматов с потерями
+        
+        Returns:
+            Путь к файлу копии
+        """
+        stat = os.stat(source_path)
+        key = hashlib.sha256(
+            f"{Path(source_path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}:"
+            f"{width}:{height}:{format}:{quality}".encode("utf-8")
+        ).hexdigest()[:32]
+        variant_path = self.cache_dir / f"{key}.{VARIANT_FORMATS[format][1]}"
+        
+        if self._touch(variant_path):
+            self._count("hits")
+            return variant_path
+        
+        # Одну копию создает один поток, остальные ждут его и берут готовый файл
+        with self._locked(key):
+            if self._touch(variant_path):
+                self._count("waits")
+                return variant_path
+            
+            started_at = time.monotonic()
+            # Блокировка действует только в этом процессе: ту же копию может создавать
+            # другой воркер gunicorn, поэтому у каждого свой временный файл
+            temp_path = variant_path.with_name(f"{variant_path.name}.{os.getpid()}.{uuid4().hex}.tmp")
+            try:
+                get_image_pool().run(_render, str(source_path), str(temp_path), width, height, format, quality)
+                size = temp_path.stat().st_size
+                # Атомарно: другой воркер gunicorn видит либо старое состояние, либо готовый файл
+                os.replace(temp_path, variant_path)
+            except Exception:
+                try:
+                    temp_path.unlink()
+                except OSError:
+                    pass
+                # Копию уже создал другой воркер - отдаем ее
+                if self._touch(variant_path):
+                    self._count("waits")
+                    return variant_path
+                raise
+            
+            with self._lock:
+                self.misses += 1
+                self.render_seconds += time.monotonic() - started_at
+                self._total_bytes += size
+        
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+        return variant_path
+    
+    def mimetype(self, format: str) -> str:
+        """MIME-тип копии в формате format"""
+        return VARIANT_FORMATS[format][2]
+    
+    @contextmanager
+    def _locked(self, key: str):
+        """Блокировка одной копии; запись удаляется, когда ее никто не ждет"""
+        with self._lock:
+            entry = self._variant_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._variant_locks[key]
+    
+    def _touch(self, path: Path) -> bool:
+        """Отметить обращение к копии (время изменения - ключ LRU); False если копии нет"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def _scan(self):
+        """Файлы копий: [(путь, размер, время последнего обращения)]"""
+        files = []
+        for path in self.cache_dir.iterdir():
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+        return files
+    
+    def _evict(self):
+        """Удалить давно не запрошенные копии, пока папка не станет меньше лимита"""
+        if not self._evict_lock.acquire(blocking=False):
+            return  # Уже очищает другой поток
+        try:
+            # Размер пересчитывается по диску: копии создают и другие воркеры
+            files = sorted(self._scan(), key=lambda item: item[2])
+            total = sum(size for _, size, _ in files)
+            evicted = 0
+            for path, size, _ in files:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                evicted += 1
+            with self._lock:
+                self._total_bytes = total
+                self.evicted += evicted
+        finally:
+            self._evict_lock.release()
+    
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+    
+    def get_stats(self) -> Dict:
+        """
+        Статистика копий
+        
+        Returns:
+            Словарь с попаданиями, созданными и удаленными копиями и размером папки
+        """
+        with self._lock:
+            requests = self.hits + self.waits + self.misses
+            return {
+                "hits": self.hits,
+                "waits": self.waits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.waits) / requests, 3) if requests else 0.0,
+                "evicted": self.evicted,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "avg_render_ms": round(self.render_seconds / self.misses * 1000, 1) if self.misses else 0,
+                "formats": list(VARIANT_FORMATS)
+            }
@@ -0,0 +1,141 @@
+"""
+Подписанные временные ссылки на изображения бэкенда
+
+Если бэкенд доступен из интернета (PUBLIC_BASE_URL), входные изображения
+не нужно загружать на сторонние хостинги: API получает ссылку на сам
+бэкенд. Ссылка содержит срок действия и HMAC подпись, поэтому по ней
+можно скачать только этот файл и только до истечения срока.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+from .http_session import get_session
+
+
+# Срок действия ссылки по умолчанию (API скачивает изображение не сразу)
+SIGNED_URL_TTL = 3600  # секунд
+
+# Как долго помнить результат проверки доступности бэкенда извне
+REACHABILITY_TTL = 300  # секунд
+REACHABILITY_TIMEOUT = 5
+
+_secret = None
+_secret_lock = threading.Lock()
+_reachability = {}  # {base_url: (доступен, monotonic время проверки)}
+_reachability_lock = threading.Lock()
+
+
+def _get_secret() -> bytes:
+    """
+    Ключ подписи
+
+    Берется из URL_SIGNING_SECRET, иначе генерируется один раз и хранится
+    в backend/data/url_signing.key, чтобы ссылки, выданные одним воркером
+    gunicorn, проверялись другим.
+    """
+    global _secret
+    with _secret_lock:
+        if _secret is not None:
+            return _secret
+        env_secret = os.getenv('URL_SIGNING_SECRET')
+        if env_secret:
+            _secret = env_secret.encode("utf-8")
+            return _secret
+
+        key_path = Path(__file__).parent.parent / "data" / "url_signing.key"
+        key_path.parent.mkdir(parents=True, exist_ok=True)
+        if not key_path.exists():
+            # Ключ пишется во временный файл и появляется под своим именем уже
+            # целиком. os.link (в отличие от os.replace) не перезаписывает ключ,
+            # если воркеры стартуют одновременно: все читают ключ первого
+            temp_path = key_path.with_name(f"{key_path.name}.{os.getpid()}.{secrets.token_hex(4)}.tmp")
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(secrets.token_hex(32))
+                os.link(temp_path, key_path)
+            except FileExistsError:
+                pass
+            finally:
+                temp_path.unlink()
+        key = key_path.read_text().strip()
+        if not key:
+            # Пустой ключ - подпись, которую может посчитать кто угодно
+            raise RuntimeError(f"Файл ключа подписи пуст: {key_path}. Удалите его или задайте URL_SIGNING_SECRET")
+        _secret = key.encode("utf-8")
+        return _secret
+
+
+def derive_token(purpose: str) -> str:
+    """
+    Секрет для другой цели, производный от ключа подписи
+
+    Одинаков во всех воркерах gunicorn и не позволяет подделать подписи ссылок.
+    """
+    return hmac.new(_get_secret(), f"purpose:{purpose}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def sign_path(path: str, expires: int) -> str:
+    """Подпись пути файла и срока действия ссылки"""
+    digest = hmac.new(_get_secret(), f"{path}:{expires}".encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def make_signed_url(base_url: str, path: str, ttl: float = SIGNED_URL_TTL) -> str:
+    """
+    Подписанная ссылка на файл
+
+    Args:
+        base_url: Публичный адрес бэкенда (PUBLIC_BASE_URL)
+        path: Путь файла для маршрута /api/public ("user/...", "generated/...", "prep/...")
+        ttl: Срок действия, секунд
+
+    Returns:
+        URL вида PUBLIC_BASE_URL/api/public/<path>?expires=...&sig=...
+    """
+    expires = int(time.time() + ttl)
+    return (f"{base_url.rstrip('/')}/api/public/{quote(path)}"
+            f"?expires={expires}&sig={sign_path(path, expires)}")
+
+
+def verify_signature(path: str, expires, signature: str) -> bool:
+    """Ссылка подписана этим бэкендом и еще действует"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time() or not signature:
+        return False
+    return hmac.compare_digest(sign_path(path, expires), signature)
+
+
+def is_publicly_reachable(base_url: str) -> bool:
+    """
+    Отвечает ли бэкенд по публичному адресу (GET /health)
+
+    Результат запоминается на REACHABILITY_TTL секунд, чтобы не проверять
+    адрес на каждом запросе.
+    """
+    now = time.monotonic()
+    with _reachability_lock:
+        cached = _reachability.get(base_url)
+    if cached and now - cached[1] < REACHABILITY_TTL:
+        return cached[0]
+
+    health_url = f"{base_url.rstrip('/')}/health"
+    try:
+        reachable = get_session(health_url).get(health_url, timeout=REACHABILITY_TIMEOUT).status_code == 200
+    except Exception:
+        reachable = False
+    if not reachable:
+        print(f"Бэкенд недоступен по адресу {base_url}, изображения загружаются на хостинг")
+    with _reachability_lock:
+        _reachability[base_url] = (reachable, now)
+    return reachable
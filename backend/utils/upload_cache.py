@@ -0,0 +1,270 @@
+"""
+Кэш публичных URL загруженных изображений
+
+Одно и то же изображение (например, исходник для нескольких промптов
+редактирования) загружается на хостинг один раз: URL запоминается по
+sha256 содержимого файла вместе со сроком жизни ссылки, который зависит
+от хостинга (tmpfiles.org хранит файлы час, 0x0.st - от 30 дней до года
+в зависимости от размера, file.io удаляет файл после первого скачивания).
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict
+from urllib.parse import urlparse
+
+from .http_session import get_session
+
+
+# Не используем ссылку, если до ее удаления осталось меньше (API скачивает
+# изображение не сразу после создания задачи)
+MIN_REMAINING = 15 * 60  # секунд
+
+# Доля срока жизни ссылки, после которой она считается устаревшей (запас
+# на неточность правил хостинга)
+LIFETIME_SAFETY = 0.9
+
+# Проверять доступность ссылки HEAD запросом перед повторным использованием
+VERIFY_TIMEOUT = 5
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Не больше стольких путей в памяти (давно не запрошенные вытесняются)
+MAX_DIGESTS = 4096
+_digests = OrderedDict()  # {путь: (размер, mtime, sha256)}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """
+    sha256 содержимого файла
+
+    Результат запоминается по пути, размеру и времени изменения, чтобы
+    не перечитывать один и тот же исходник для каждого промпта. Для пути
+    хранится одна запись (измененный файл ее заменяет), путей - не больше
+    MAX_DIGESTS.
+    """
+    stat = Path(path).stat()
+    key = str(path)
+    version = (stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        entry = _digests.get(key)
+        if entry and entry[:2] == version:
+            _digests.move_to_end(key)
+            return entry[2]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digests_lock:
+        _digests[key] = (*version, digest)
+        _digests.move_to_end(key)
+        while len(_digests) > MAX_DIGESTS:
+            _digests.popitem(last=False)
+    return digest
+
+
+def url_host(url: str) -> str:
+    """Хостинг, на который указывает URL ('0x0', 'tmpfiles', 'fileio', 'imgur' или имя хоста)"""
+    host = (urlparse(url).hostname or "").lower()
+    for name, domain in (("0x0", "0x0.st"), ("tmpfiles", "tmpfiles.org"),
+                         ("fileio", "file.io"), ("imgur", "imgur.com")):
+        if host == domain or host.endswith("." + domain):
+            return name
+    return host
+
+
+def host_lifetime(host: str, size_bytes: int) -> float:
+    """
+    Срок жизни ссылки на хостинге
+
+    Args:
+        host: Хостинг (см. url_host)
+        size_bytes: Размер файла
+
+    Returns:
+        Срок в секундах (0 - ссылку нельзя использовать повторно)
+    """
+    if host == "0x0":
+        # Правило 0x0.st: от 30 дней для файла 512 МБ до 365 дней для пустого
+        min_age, max_age, max_size = 30, 365, 512 * 1024 * 1024
+        ratio = min(size_bytes / max_size, 1.0)
+        return (min_age + (max_age - min_age) * (1 - ratio) ** 3) * 86400
+    if host == "tmpfiles":
+        return 60 * 60
+    if host == "imgur":
+        return 180 * 86400
+    # file.io удаляет файл после первого скачивания, остальные хостинги неизвестны
+    return 0
+
+
+class UploadCache:
+    """Постоянный кэш URL загрузок: sha256 файла -> публичный URL"""
+
+    def __init__(self, db_path: str = None, verify: bool = True):
+        """
+        Args:
+            db_path: Путь к файлу SQLite (по умолчанию backend/data/upload_cache.db)
+            verify: Проверять доступность ссылки перед повторным использованием
+        """
+        if db_path is None:
+            # Рядом с базой истории, общий для всех воркеров gunicorn
+            db_path = Path(__file__).parent.parent / "data" / "upload_cache.db"
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.verify = verify
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS upload_urls (
+                digest TEXT NOT NULL,  -- sha256 содержимого файла
+                host TEXT NOT NULL,
+                url TEXT NOT NULL,
+                size_bytes INTEGER DEFAULT 0,
+                uploaded_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                hits INTEGER DEFAULT 0,
+                PRIMARY KEY (digest, host)
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def _is_alive(self, url: str) -> bool:
+        """Ссылка еще отдает файл"""
+        try:
+            response = get_session(url).head(url, timeout=VERIFY_TIMEOUT, allow_redirects=True)
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    def get(self, digest: str, host: str = None) -> Optional[str]:
+        """
+        Найти действующую ссылку на файл
+
+        Args:
+            digest: sha256 файла
+            host: Только ссылки этого хостинга (None - любого)
+
+        Returns:
+            URL или None
+        """
+        now = time.time()
+        query = "SELECT * FROM upload_urls WHERE digest = ? AND expires_at > ?"
+        params = [digest, now + MIN_REMAINING]
+        if host:
+            query += " AND host = ?"
+            params.append(host)
+        query += " ORDER BY expires_at DESC"
+
+        conn = self._connect()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+
+        for row in rows:
+            if self.verify and not self._is_alive(row["url"]):
+                self.invalidate(digest, row["host"])
+                continue
+            conn = self._connect()
+            conn.execute("UPDATE upload_urls SET hits = hits + 1 WHERE digest = ? AND host = ?",
+                         (digest, row["host"]))
+            conn.commit()
+            conn.close()
+            with self._lock:
+                self.hits += 1
+                self.bytes_saved += row["size_bytes"] or 0
+            return row["url"]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, digest: str, url: str, size_bytes: int):
+        """
+        Запомнить ссылку на загруженный файл
+
+        Ссылки хостингов без повторного использования (file.io) не сохраняются.
+        """
+        host = url_host(url)
+        lifetime = host_lifetime(host, size_bytes) * LIFETIME_SAFETY
+        if lifetime <= MIN_REMAINING:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("""
+            INSERT OR REPLACE INTO upload_urls
+            (digest, host, url, size_bytes, uploaded_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (digest, host, url, size_bytes, now, now + lifetime))
+        # Заодно удаляем истекшие ссылки
+        conn.execute("DELETE FROM upload_urls WHERE expires_at < ?", (now,))
+        conn.commit()
+        conn.close()
+
+    def invalidate(self, digest: str, host: str = None):
+        """Удалить ссылки на файл (например, если хостинг удалил его раньше срока)"""
+        conn = self._connect()
+        if host:
+            conn.execute("DELETE FROM upload_urls WHERE digest = ? AND host = ?", (digest, host))
+        else:
+            conn.execute("DELETE FROM upload_urls WHERE digest = ?", (digest,))
+        conn.commit()
+        conn.close()
+
+    def get_stats(self) -> Dict:
+        """
+        Статистика кэша
+
+        Returns:
+            Словарь с попаданиями, промахами и сэкономленными байтами этого
+            процесса, а также общими данными по всем записям
+        """
+        with self._lock:
+            hits, misses, bytes_saved = self.hits, self.misses, self.bytes_saved
+        conn = self._connect()
+        row = conn.execute("""
+            SELECT COUNT(*), SUM(hits), SUM(hits * size_bytes) FROM upload_urls
+            WHERE expires_at > ?
+        """, (time.time(),)).fetchone()
+        by_host = {r[0]: r[1] for r in conn.execute(
+            "SELECT host, COUNT(*) FROM upload_urls WHERE expires_at > ? GROUP BY host", (time.time(),))}
+        conn.close()
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0,
+            "bytes_saved": bytes_saved,
+            "entries": row[0],
+            "entries_by_host": by_host,
+            "total_hits": row[1] or 0,
+            "total_bytes_saved": row[2] or 0
+        }
+
+
+_upload_cache = None
+_upload_cache_lock = threading.Lock()
+
+
+def get_upload_cache() -> UploadCache:
+    """Общий кэш загрузок процесса"""
+    global _upload_cache
+    with _upload_cache_lock:
+        if _upload_cache is None:
+            _upload_cache = UploadCache()
+        return _upload_cache
@@ -0,0 +1,174 @@
+"""
+Оценка состояния хостингов для загрузки изображений
+
+Для каждого хостинга хранится скользящее окно последних загрузок: доля
+успешных и время ответа. По ним хостинги упорядочиваются так, чтобы
+загрузка начиналась на самом быстром из работающих. После нескольких
+ошибок подряд хостинг исключается на время (circuit breaker), причем
+каждое повторное исключение удваивает паузу.
+
+Статистика своя в каждом процессе: она быстро набирается заново и не
+требует общего хранилища.
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+
+# Число последних загрузок, по которым считается статистика хостинга
+WINDOW_SIZE = 20
+
+# Ошибок подряд, после которых хостинг временно исключается
+FAILURE_THRESHOLD = 3
+
+# Пауза после исключения хостинга (удваивается при повторных исключениях)
+COOLDOWN = 60  # секунд
+MAX_COOLDOWN = 15 * 60  # секунд
+
+# Предполагаемое время загрузки на хостинг без статистики
+DEFAULT_LATENCY = 5.0  # секунд
+
+# Вес новой загрузки в сглаженном времени ответа
+LATENCY_ALPHA = 0.3
+
+
+class HostStats:
+    """Статистика одного хостинга"""
+    
+    def __init__(self, window_size: int = WINDOW_SIZE):
+        self.outcomes = deque(maxlen=window_size)  # True/False последних загрузок
+        self.latency = None  # сглаженное время успешной загрузки, секунд
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # monotonic время окончания исключения
+        self.cooldown = 0.0  # текущая пауза исключения
+        self.uploads = 0
+        self.failures = 0
+        self.trips = 0  # сколько раз хостинг исключался
+    
+    def success_rate(self) -> float:
+        """Доля успешных загрузок в окне (со сглаживанием для малой выборки)"""
+        return (sum(self.outcomes) + 1) / (len(self.outcomes) + 2)
+    
+    def expected_time(self) -> float:
+        """Ожидаемое время до получения URL с учетом повторов после ошибок"""
+        latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        return latency / self.success_rate()
+
+
+class UploadHealth:
+    """Статистика хостингов и выбор порядка загрузки"""
+    
+    def __init__(self, window_size: int = WINDOW_SIZE, failure_threshold: int = FAILURE_THRESHOLD,
+                 cooldown: float = COOLDOWN, max_cooldown: float = MAX_COOLDOWN):
+        """
+        Args:
+            window_size: Размер скользящего окна загрузок
+            failure_threshold: Ошибок подряд до исключения хостинга
+            cooldown: Начальная пауза исключения, секунд
+            max_cooldown: Максимальная пауза исключения, секунд
+        """
+        self.window_size = window_size
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._hosts = {}  # {хостинг: HostStats}
+        self._lock = threading.Lock()
+    
+    def _get(self, host: str) -> HostStats:
+        stats = self._hosts.get(host)
+        if stats is None:
+            stats = self._hosts[host] = HostStats(self.window_size)
+        return stats
+    
+    def record(self, host: str, success: bool, latency: float):
+        """
+        Учесть результат загрузки
+        
+        Args:
+            host: Хостинг
+            success: Получен ли URL
+            latency: Время загрузки, секунд
+        """
+        with self._lock:
+            stats = self._get(host)
+            stats.uploads += 1
+            stats.outcomes.append(bool(success))
+            if success:
+                if stats.latency is None:
+                    stats.latency = latency
+                else:
+                    stats.latency += LATENCY_ALPHA * (latency - stats.latency)
+                stats.consecutive_failures = 0
+                stats.cooldown = 0.0
+                stats.open_until = 0.0
+                return
+            
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.failure_threshold:
+                # Первая ошибка после паузы снова исключает хостинг, уже на дольше
+                stats.cooldown = min(stats.cooldown * 2 or self.base_cooldown, self.max_cooldown)
+                stats.open_until = time.monotonic() + stats.cooldown
+                stats.trips += 1
+    
+    def is_available(self, host: str) -> bool:
+        """Хостинг не исключен"""
+        with self._lock:
+            stats = self._hosts.get(host)
+            return stats is None or stats.open_until <= time.monotonic()
+    
+    def rank(self, hosts) -> List[str]:
+        """
+        Упорядочить хостинги для загрузки
+        
+        Работающие хостинги идут по возрастанию ожидаемого времени загрузки
+        (при равенстве - в исходном порядке), исключенные пропускаются.
+        Если исключены все, они возвращаются в порядке окончания паузы,
+        чтобы загрузка все равно была попробована.
+        
+        Args:
+            hosts: Хостинги в порядке предпочтения по умолчанию
+        
+        Returns:
+            Список хостингов
+        """
+        now = time.monotonic()
+        with self._lock:
+            stats = {host: self._get(host) for host in hosts}
+            available = [host for host in hosts if stats[host].open_until <= now]
+            if not available:
+                return sorted(hosts, key=lambda host: stats[host].open_until)
+            return sorted(available, key=lambda host: stats[host].expected_time())
+    
+    def get_stats(self) -> Dict:
+        """
+        Статистика по хостингам
+        
+        Returns:
+            Словарь {хостинг: доля успешных, время ответа, состояние исключения, счетчики}
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    "available": stats.open_until <= now,
+                    "success_rate": round(sum(stats.outcomes) / len(stats.outcomes), 3) if stats.outcomes else None,
+                    "latency": round(stats.latency, 3) if stats.latency is not None else None,
+                    "expected_time": round(stats.expected_time(), 3),
+                    "consecutive_failures": stats.consecutive_failures,
+                    "cooldown_remaining": round(max(0.0, stats.open_until - now), 1),
+                    "uploads": stats.uploads,
+                    "failures": stats.failures,
+                    "trips": stats.trips
+                }
+                for host, stats in self._hosts.items()
+            }
+
+
+_upload_health = UploadHealth()
+
+
+def get_upload_health() -> UploadHealth:
+    """Общая статистика хостингов процесса"""
+    return _upload_health
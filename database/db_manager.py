@@ -9,6 +9,17 @@ from typing import List, Optional, Dict
 from utils.path_utils import get_db_path, ensure_data_dir
 
 
+# Производные изображения генерации: миниатюра для сетки галереи и превью
+GENERATION_DERIVATIVES = ("thumbnail", "preview")
+
+# Столбцы, добавленные в generations после первой версии схемы
+GENERATION_EXTRA_COLUMNS = {
+    f"{kind}_{field}": column_type
+    for kind in GENERATION_DERIVATIVES
+    for field, column_type in (("path", "TEXT"), ("width", "INTEGER"), ("height", "INTEGER"))
+}
+
+
 class DatabaseManager:
     """Менеджер базы данных для хранения истории генераций"""
     
@@ -57,6 +68,9 @@ class DatabaseManager:
             )
         """)
         
+        # Миграция баз, созданных до появления миниатюр и превью
+        self._add_missing_columns(cursor, "generations", GENERATION_EXTRA_COLUMNS)
+        
         # Таблица для пакетных генераций
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS batch_generations (
@@ -71,6 +85,20 @@ class DatabaseManager:
             )
         """)
         
+        # Кэш результатов: отпечаток запроса -> сохраненное изображение
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                key TEXT PRIMARY KEY,  -- sha256 параметров запроса и входных изображений
+                type TEXT NOT NULL,  -- 'generate', 'edit', 'combine'
+                image_path TEXT NOT NULL,
+                generation_id INTEGER,  -- запись в generations
+                size_bytes INTEGER DEFAULT 0,
+                hits INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
         # Индексы для быстрого поиска
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_type ON generations(type)
@@ -85,10 +113,34 @@ class DatabaseManager:
         conn.commit()
         conn.close()
     
+    def _add_missing_columns(self, cursor, table: str, columns: Dict[str, str]):
+        """Добавить в таблицу недостающие столбцы (ALTER TABLE для старых баз)"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row["name"] for row in cursor.fetchall()}
+        for name, column_type in columns.items():
+            if name in existing:
+                continue
+            try:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+            except sqlite3.OperationalError as e:
+                # Столбец мог добавить другой процесс одновременно с нами
+                if "duplicate column" not in str(e):
+                    raise
+    
+    def _derivative_values(self, derivatives: Optional[Dict]) -> List:
+        """Значения столбцов производных изображений в порядке GENERATION_EXTRA_COLUMNS"""
+        derivatives = derivatives or {}
+        values = []
+        for kind in GENERATION_DERIVATIVES:
+            info = derivatives.get(kind) or {}
+            path = info.get("path")
+            values.extend([str(path) if path else None, info.get("width"), info.get("height")])
+        return values
+    
     def add_generation(self, gen_type: str, prompt: str, model: str, 
                       image_path: str, resolution: str = None,
                       negative_prompt: str = None, parameters: dict = None,
-                      credits_used: float = None) -> int:
+                      credits_used: float = None, derivatives: dict = None) -> int:
         """
         Добавить запись о генерации
         
@@ -101,6 +153,7 @@ class DatabaseManager:
             negative_prompt: Негативный промпт
             parameters: Дополнительные параметры
             credits_used: Использованные кредиты
+            derivatives: Миниатюра и превью, {"thumbnail"|"preview": {"path", "width", "height"}}
             
         Returns:
             ID созданной записи
@@ -109,19 +162,44 @@ class DatabaseManager:
         cursor = conn.cursor()
         
         parameters_json = json.dumps(parameters) if parameters else None
+        extra_columns = ", ".join(GENERATION_EXTRA_COLUMNS)
         
-        cursor.execute("""
+        cursor.execute(f"""
             INSERT INTO generations 
-            (type, prompt, negative_prompt, model, resolution, image_path, parameters, credits_used)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (gen_type, prompt, negative_prompt, model, resolution, 
-              str(image_path), parameters_json, credits_used))
+            (type, prompt, negative_prompt, model, resolution, image_path, parameters, credits_used,
+             {extra_columns})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?{", ?" * len(GENERATION_EXTRA_COLUMNS)})
+        """, [gen_type, prompt, negative_prompt, model, resolution, 
+              str(image_path), parameters_json, credits_used] + self._derivative_values(derivatives))
         
         gen_id = cursor.lastrowid
         conn.commit()
         conn.close()
         return gen_id
     
+    def set_generation_derivatives(self, gen_id: int, derivatives: dict) -> bool:
+        """
+        Сохранить миниатюру и превью для существующей генерации
+        
+        Args:
+            gen_id: ID генерации
+            derivatives: {"thumbnail"|"preview": {"path", "width", "height"}}
+            
+        Returns:
+            True если запись найдена и обновлена
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        assignments = ", ".join(f"{name} = ?" for name in GENERATION_EXTRA_COLUMNS)
+        cursor.execute(f"UPDATE generations SET {assignments} WHERE id = ?",
+                       self._derivative_values(derivatives) + [gen_id])
+        updated = cursor.rowcount > 0
+        
+        conn.commit()
+        conn.close()
+        return updated
+    
     def get_generations(self, limit: int = 100, offset: int = 0,
                        gen_type: Optional[str] = None,
                        search_query: Optional[str] = None) -> List[Dict]:
@@ -240,6 +318,126 @@ class DatabaseManager:
         conn.close()
         return deleted
     
+    def add_cached_result(self, key: str, gen_type: str, image_path: str,
+                          generation_id: int = None, size_bytes: int = 0):
+        """
+        Сохранить результат в кэше
+        
+        Args:
+            key: Отпечаток запроса
+            gen_type: Тип генерации ('generate', 'edit', 'combine')
+            image_path: Путь к сохраненному изображению
+            generation_id: ID записи в истории генераций
+            size_bytes: Размер файла изображения
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT OR REPLACE INTO result_cache
+            (key, type, image_path, generation_id, size_bytes, last_used_at)
+            VALUES (?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        """, (key, gen_type, str(image_path), generation_id, size_bytes))
+        conn.commit()
+        conn.close()
+    
+    def get_cached_result(self, key: str, max_age: float = None) -> Optional[Dict]:
+        """
+        Найти результат в кэше и отметить его использование
+        
+        Args:
+            key: Отпечаток запроса
+            max_age: Максимальный возраст записи в секундах (None - без ограничения)
+            
+        Returns:
+            Словарь с записью кэша или None
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        query = "SELECT * FROM result_cache WHERE key = ?"
+        params = [key]
+        if max_age is not None:
+            query += " AND created_at >= datetime('now', ?)"
+            params.append(f"-{int(max_age)} seconds")
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("""
+                UPDATE result_cache
+                SET hits = hits + 1, last_used_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+                WHERE key = ?
+            """, (key,))
+            conn.commit()
+        conn.close()
+        return dict(row) if row else None
+    
+    def delete_cached_result(self, key: str):
+        """Удалить запись кэша (например, если файл изображения удален)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+        conn.commit()
+        conn.close()
+    
+    def evict_cached_results(self, max_age: float = None, max_entries: int = None,
+                             max_bytes: int = None) -> int:
+        """
+        Удалить устаревшие записи кэша и давно не использованные сверх лимитов
+        
+        Сами изображения не удаляются - они остаются в истории генераций.
+        
+        Args:
+            max_age: Максимальный возраст записи в секундах
+            max_entries: Максимальное количество записей
+            max_bytes: Максимальный суммарный размер изображений в кэше
+            
+        Returns:
+            Количество удаленных записей
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        removed = 0
+        
+        if max_age is not None:
+            cursor.execute("DELETE FROM result_cache WHERE created_at < datetime('now', ?)",
+                           (f"-{int(max_age)} seconds",))
+            removed += cursor.rowcount
+        
+        if max_entries is not None or max_bytes is not None:
+            cursor.execute("SELECT key, size_bytes FROM result_cache ORDER BY last_used_at DESC")
+            count = 0
+            total_bytes = 0
+            stale = []
+            for row in cursor.fetchall():
+                count += 1
+                total_bytes += row["size_bytes"] or 0
+                if ((max_entries is not None and count > max_entries) or
+                        (max_bytes is not None and total_bytes > max_bytes)):
+                    stale.append((row["key"],))
+            cursor.executemany("DELETE FROM result_cache WHERE key = ?", stale)
+            removed += len(stale)
+        
+        conn.commit()
+        conn.close()
+        return removed
+    
+    def get_result_cache_totals(self) -> Dict:
+        """
+        Размер кэша результатов
+        
+        Returns:
+            Словарь с количеством записей, суммарным размером и числом попаданий
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*), SUM(size_bytes), SUM(hits) FROM result_cache")
+        count, total_bytes, hits = cursor.fetchone()
+        conn.close()
+        return {
+            "entries": count,
+            "bytes": total_bytes or 0,
+            "hits": hits or 0
+        }
+    
     def get_statistics(self) -> Dict:
         """
         Получить статистику по генерациям
@@ -24,7 +24,7 @@ function CombineTab({ apiKey }) {
     }
 
     try {
-      const uploadPromises = files.map(file => uploadFile(file))
+      const uploadPromises = files.map(file => uploadFile(file, resolution))
       const results = await Promise.all(uploadPromises)
       
       const newImages = results.map(r => ({
@@ -20,7 +20,7 @@ function EditingTab({ apiKey }) {
     if (files.length === 0) return
 
     try {
-      const uploadPromises = files.map(file => uploadFile(file))
+      const uploadPromises = files.map(file => uploadFile(file, resolution))
       const results = await Promise.all(uploadPromises)
       
       const newImages = results.map(r => ({
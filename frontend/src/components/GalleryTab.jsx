@@ -116,9 +116,13 @@ function GalleryTab() {
               <div className="gallery-item-image">
                 {gen.image_url ? (
                   <img
-                    src={getImageUrl(gen.image_path)}
+                    src={getImageUrl(gen.thumbnail_path || gen.image_path)}
+                    width={gen.thumbnail_width || undefined}
+                    height={gen.thumbnail_height || undefined}
+                    loading="lazy"
+                    decoding="async"
                     alt={gen.prompt?.substring(0, 50)}
-                    onClick={() => setSelectedImage(getImageUrl(gen.image_path))}
+                    onClick={() => setSelectedImage(getImageUrl(gen.preview_path || gen.image_path))}
                   />
                 ) : (
                   <div className="no-image">Нет изображения</div>
@@ -133,7 +137,7 @@ function GalleryTab() {
               </div>
               <div className="gallery-item-actions">
                 <button
-                  onClick={() => setSelectedImage(getImageUrl(gen.image_path))}
+                  onClick={() => setSelectedImage(getImageUrl(gen.preview_path || gen.image_path))}
                   className="btn btn-secondary btn-small"
                 >
                   Просмотр
@@ -25,7 +25,7 @@ function GenerationTab({ apiKey }) {
     }
 
     try {
-      const uploadPromises = files.map(file => uploadFile(file))
+      const uploadPromises = files.map(file => uploadFile(file, resolution))
       const results = await Promise.all(uploadPromises)
       
       const newImages = results.map(r => ({
@@ -20,45 +20,101 @@ export const checkBalance = async (apiKey) => {
   return response.data
 }
 
+const JOB_POLL_INTERVAL = 2000
+// Дольше задача выполняться не может (ожидание API, загрузки, очередь)
+const JOB_TIMEOUT = 20 * 60 * 1000
+// Столько ошибок запроса статуса подряд - сервер недоступен
+const JOB_MAX_POLL_ERRORS = 5
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms))
+
 /**
- * Генерация изображения
+ * Получить статус фоновой задачи
  */
-export const generateImage = async (apiKey, params) => {
-  const response = await api.post('/generate', {
+export const getJob = async (jobId) => {
+  const response = await api.get(`/jobs/${jobId}`)
+  return response.data
+}
+
+/**
+ * Дождаться завершения фоновой задачи и вернуть ее результат
+ *
+ * Ожидание прекращается через JOB_TIMEOUT или после JOB_MAX_POLL_ERRORS
+ * ошибок запроса статуса подряд
+ */
+export const waitForJob = async (jobId) => {
+  const deadline = Date.now() + JOB_TIMEOUT
+  let errors = 0
+  while (Date.now() < deadline) {
+    let job
+    try {
+      job = await getJob(jobId)
+      errors = 0
+    } catch (err) {
+      errors += 1
+      if (errors >= JOB_MAX_POLL_ERRORS) {
+        return { success: false, error: `Не удалось получить статус задачи: ${err.message}` }
+      }
+      await sleep(JOB_POLL_INTERVAL)
+      continue
+    }
+    if (job.status === 'completed') {
+      return job.result
+    }
+    if (job.status === 'failed') {
+      return { success: false, error: job.error || 'Неизвестная ошибка' }
+    }
+    await sleep(JOB_POLL_INTERVAL)
+  }
+  return { success: false, error: 'Задача выполняется слишком долго, результат появится в галерее, если она завершится' }
+}
+
+/**
+ * Поставить задачу в очередь и дождаться результата
+ */
+const submitJob = async (endpoint, apiKey, params) => {
+  const response = await api.post(endpoint, {
     api_key: apiKey,
     ...params
   })
-  return response.data
+  if (!response.data.job_id) {
+    return response.data
+  }
+  return waitForJob(response.data.job_id)
+}
+
+/**
+ * Генерация изображения
+ */
+export const generateImage = async (apiKey, params) => {
+  return submitJob('/generate', apiKey, params)
 }
 
 /**
  * Редактирование изображения
  */
 export const editImage = async (apiKey, params) => {
-  const response = await api.post('/edit', {
-    api_key: apiKey,
-    ...params
-  })
-  return response.data
+  return submitJob('/edit', apiKey, params)
 }
 
 /**
  * Комбинирование изображений
  */
 export const combineImages = async (apiKey, params) => {
-  const response = await api.post('/combine', {
-    api_key: apiKey,
-    ...params
-  })
-  return response.data
+  return submitJob('/combine', apiKey, params)
 }
 
 /**
  * Загрузка файла на сервер
+ * resolution - разрешение, выбранное в форме (сервер заранее готовит
+ * и загружает на хостинг копию этого размера)
  */
-export const uploadFile = async (file) => {
+export const uploadFile = async (file, resolution = null) => {
   const formData = new FormData()
   formData.append('file', file)
+  if (resolution) {
+    formData.append('resolution', resolution)
+  }
   
   const response = await api.post('/upload', formData, {
     headers: {
@@ -8,10 +8,13 @@ from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize
 from PyQt5.QtGui import QPixmap, QIcon
 from api.client import NanoBananaAPIClient
 from api.models import CombineRequest
-from utils.image_utils import url_to_image, base64_to_image
-from utils.image_uploader import upload_image
+from api.result_cache import ResultCache
+from utils.image_utils import url_to_image, base64_to_image, find_derivatives
+from utils.image_uploader import upload_images, get_pre_uploader
 from utils.config import Config
+from utils.output_format import get_output_encoding
 from database.db_manager import DatabaseManager
+from gui.pre_upload import PreUploadTracker
 from pathlib import Path
 from datetime import datetime
 
@@ -21,40 +24,76 @@ class CombineWorker(QThread):
     finished = pyqtSignal(bool, str, str)  # success, message, image_path
     progress = pyqtSignal(str)  # Сообщение о прогрессе
     
-    def __init__(self, client: NanoBananaAPIClient, request: CombineRequest):
+    def __init__(self, client: NanoBananaAPIClient, request: CombineRequest, crop_to_aspect=False,
+                 result_cache: ResultCache = None):
         super().__init__()
         self.client = client
         self.request = request
+        self.crop_to_aspect = crop_to_aspect
+        self.result_cache = result_cache
+        self.encoding = get_output_encoding()  # Формат результата на момент запуска
+    
+    def _restore_cached(self, cache_key: str, prefix: str) -> str:
+        """
+        Скопировать результат такого же запроса из кэша в новый файл
+        
+        Returns:
+            Путь к файлу или пустая строка, если в кэше ничего нет
+        """
+        if not cache_key:
+            return ""
+        config = Config()
+        images_dir = Path(config.ensure_images_dir())
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        image_path = images_dir / f"{prefix}_{timestamp}{self.encoding.extension}"
+        if self.result_cache.restore(cache_key, str(image_path)):
+            return str(image_path)
+        return ""
     
     def run(self):
         """Выполнение комбинирования"""
         try:
-            # Загружаем все изображения на публичные URL
-            image_urls = []
+            # Такой же запрос уже выполнялся - берем результат из кэша без загрузки и генерации
+            cache_key = None
+            if self.result_cache:
+                cache_key = self.result_cache.key("combine", self.request, crop_to_aspect=self.crop_to_aspect,
+                                                   **self.encoding.cache_params())
+            cached_path = self._restore_cached(cache_key, "combined")
+            if cached_path:
+                self.finished.emit(True, "Результат взят из кэша (такой запрос уже выполнялся)", cached_path)
+                return
+            
+            # Загружаем все изображения на публичные URL (параллельно)
             total = len(self.request.image_paths)
+            uploaded = [0]
             
-            for idx, img_path in enumerate(self.request.image_paths, 1):
-                self.progress.emit(f"Загрузка изображения {idx}/{total}...")
-                image_url = upload_image(img_path)
-                if image_url:
-                    image_urls.append(image_url)
-                else:
-                    error_msg = (
-                        f"Не удалось загрузить изображение {idx} на публичный URL.\n\n"
-                        "Возможные причины:\n"
-                        "• Проблемы с интернет-соединением\n"
-                        "• Временная недоступность сервисов загрузки\n"
-                        "• Файл слишком большой\n\n"
-                        "Попробуйте:\n"
-                        "• Проверить интернет-соединение\n"
-                        "• Уменьшить размер изображений\n"
-                        "• Попробовать позже"
-                    )
-                    self.finished.emit(False, error_msg, "")
-                    return
+            def on_uploaded(index, url):
+                uploaded[0] += 1
+                self.progress.emit(f"Загружено изображений: {uploaded[0]}/{total}...")
             
-            if len(image_urls) != total:
-                self.finished.emit(False, "Не все изображения удалось загрузить", "")
+            # Обычно изображения уже загружены в фоне при добавлении во вкладку
+            self.progress.emit(f"Загрузка изображений (0/{total})...")
+            image_urls = upload_images(
+                self.request.image_paths,
+                resolution=self.request.resolution,
+                uploader=get_pre_uploader().get,
+                on_done=on_uploaded
+            )
+            
+            failed = [str(idx) for idx, url in enumerate(image_urls, 1) if not url]
+            if failed:
+                error_msg = (
+                    f"Не удалось загрузить на публичный URL изображения: {', '.join(failed)}.\n\n"
+                    "Возможные причины:\n"
+                    "• Проблемы с интернет-соединением\n"
+                    "• Временная недоступность сервисов загрузки\n"
+                    "• Файл слишком большой\n\n"
+                    "Попробуйте:\n"
+                    "• Проверить интернет-соединение\n"
+                    "• Уменьшить размер изображений\n"
+                    "• Попробовать позже"
+                )
+                self.finished.emit(False, error_msg, "")
                 return
             
             self.progress.emit("Все изображения загружены. Отправка запроса на комбинирование...")
@@ -64,7 +103,7 @@ class CombineWorker(QThread):
                 config = Config()
                 images_dir = Path(config.ensure_images_dir())
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                image_path = images_dir / f"combined_{timestamp}.png"
+                image_path = images_dir / f"combined_{timestamp}{self.encoding.extension}"
                 
                 if response.image_url:
                     success = url_to_image(
@@ -72,7 +111,9 @@ class CombineWorker(QThread):
                         str(image_path),
                         aspect_ratio=self.request.aspect_ratio,
                         resolution=self.request.resolution,
-                        crop_to_aspect=self.crop_to_aspect
+                        crop_to_aspect=self.crop_to_aspect,
+                        derivatives={},  # Миниатюра и превью для галереи
+                        encoding=self.encoding
                     )
                 elif response.image_base64:
                     success = base64_to_image(
@@ -80,12 +121,16 @@ class CombineWorker(QThread):
                         str(image_path),
                         aspect_ratio=self.request.aspect_ratio,
                         resolution=self.request.resolution,
-                        crop_to_aspect=self.crop_to_aspect
+                        crop_to_aspect=self.crop_to_aspect,
+                        derivatives={},  # Миниатюра и превью для галереи
+                        encoding=self.encoding
                     )
                 else:
                     success = False
                 
                 if success:
+                    if cache_key:
+                        self.result_cache.put(cache_key, "combine", str(image_path))
                     self.finished.emit(True, "Изображения успешно объединены!", str(image_path))
                 else:
                     self.finished.emit(False, "Ошибка сохранения изображения", "")
@@ -102,6 +147,7 @@ class CombineTab(QWidget):
         super().__init__()
         self.api_client = api_client
         self.db_manager = db_manager
+        self.result_cache = None
         self.config = Config()
         self.image_paths = []
         self.worker = None
@@ -141,6 +187,8 @@ class CombineTab(QWidget):
         self.images_list.setIconSize(QSize(100, 100))  # Размер иконок
         self.images_list.setViewMode(QListWidget.IconMode)  # Режим иконок
         images_layout.addWidget(self.images_list)
+        # Изображения загружаются на хостинг сразу после добавления
+        self.pre_upload = PreUploadTracker(self.images_list)
         
         images_group.setLayout(images_layout)
         layout.addWidget(images_group)
@@ -248,6 +296,10 @@ class CombineTab(QWidget):
         """Установить менеджер БД"""
         self.db_manager = db_manager
     
+    def set_result_cache(self, result_cache: ResultCache):
+        """Установить кэш результатов (None - кэш выключен)"""
+        self.result_cache = result_cache
+    
     def add_image(self):
         """Добавить изображение"""
         if len(self.image_paths) >= 8:
@@ -279,10 +331,17 @@ class CombineTab(QWidget):
                     item = QListWidgetItem(Path(file_path).name)
                     item.setData(Qt.UserRole, file_path)
                     self.images_list.addItem(item)
+                # Загружаем на хостинг, пока пользователь пишет промпт
+                self.pre_upload.start(file_path, self.selected_resolution())
         
         self.update_image_count()
         self.combine_btn.setEnabled(len(self.image_paths) >= 2)
     
+    def selected_resolution(self) -> str:
+        """Выбранное разрешение"""
+        resolution_map = {"1024x1024 (1K)": "1024", "2048x2048 (2K)": "2048", "4096x4096 (4K)": "4096"}
+        return resolution_map[self.resolution_combo.currentText()]
+    
     def remove_selected_image(self):
         """Удалить выбранное изображение"""
         current_item = self.images_list.currentItem()
@@ -325,8 +384,7 @@ class CombineTab(QWidget):
             return
         
         # Получаем параметры
-        resolution_map = {"1024x1024 (1K)": "1024", "2048x2048 (2K)": "2048", "4096x4096 (4K)": "4096"}
-        resolution = resolution_map[self.resolution_combo.currentText()]
+        resolution = self.selected_resolution()
         negative_prompt = self.negative_prompt_text.toPlainText().strip() or None
         
         # Получаем соотношение сторон
@@ -364,7 +422,7 @@ class CombineTab(QWidget):
         self.progress_bar.setRange(0, 0)
         
         # Запускаем комбинирование в отдельном потоке
-        self.worker = CombineWorker(self.api_client, request, crop_to_aspect)
+        self.worker = CombineWorker(self.api_client, request, crop_to_aspect, self.result_cache)
         self.worker.progress.connect(self.on_combine_progress)
         self.worker.finished.connect(self.on_combine_finished)
         self.worker.start()
@@ -389,7 +447,8 @@ class CombineTab(QWidget):
                     model="pro",
                     image_path=image_path,
                     resolution=resolution,
-                    negative_prompt=self.negative_prompt_text.toPlainText().strip() or None
+                    negative_prompt=self.negative_prompt_text.toPlainText().strip() or None,
+                    derivatives=find_derivatives(image_path)
                 )
             
             QMessageBox.information(self, "Успех", message)
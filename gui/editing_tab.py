@@ -10,10 +10,13 @@ from PyQt5.QtCore import Qt, QThreadPool, QRunnable, pyqtSignal, QObject, QSize
 from PyQt5.QtGui import QPixmap, QIcon, QKeySequence, QImage
 from api.client import NanoBananaAPIClient
 from api.models import EditRequest
-from utils.image_utils import url_to_image, base64_to_image
-from utils.image_uploader import upload_image
+from api.result_cache import ResultCache
+from utils.image_utils import url_to_image, base64_to_image, find_derivatives
+from utils.image_uploader import get_pre_uploader
 from utils.config import Config
+from utils.output_format import get_output_encoding
 from database.db_manager import DatabaseManager
+from gui.pre_upload import PreUploadTracker
 from pathlib import Path
 from datetime import datetime
 
@@ -27,7 +30,8 @@ class EditWorkerSignals(QObject):
 class EditWorker(QRunnable):
     """Воркер для параллельного редактирования изображений"""
     
-    def __init__(self, index: int, client: NanoBananaAPIClient, request: EditRequest, crop_to_aspect=False, prompt: str = None):
+    def __init__(self, index: int, client: NanoBananaAPIClient, request: EditRequest, crop_to_aspect=False, prompt: str = None,
+                 result_cache: ResultCache = None):
         super().__init__()
         self.index = index
         self.client = client
@@ -35,12 +39,42 @@ class EditWorker(QRunnable):
         self.signals = EditWorkerSignals()
         self.crop_to_aspect = crop_to_aspect
         self.prompt = prompt or request.prompt  # Сохраняем промпт для сохранения в БД
+        self.result_cache = result_cache
+        self.encoding = get_output_encoding()  # Формат результата на момент запуска
+    
+    def _restore_cached(self, cache_key: str, prefix: str) -> str:
+        """
+        Скопировать результат такого же запроса из кэша в новый файл
+        
+        Returns:
+            Путь к файлу или пустая строка, если в кэше ничего нет
+        """
+        if not cache_key:
+            return ""
+        config = Config()
+        images_dir = Path(config.ensure_images_dir())
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        image_path = images_dir / f"{prefix}_{timestamp}{self.encoding.extension}"
+        if self.result_cache.restore(cache_key, str(image_path)):
+            return str(image_path)
+        return ""
     
     def run(self):
         """Выполнение редактирования"""
         try:
+            # Такой же запрос уже выполнялся - берем результат из кэша без загрузки и генерации
+            cache_key = None
+            if self.result_cache:
+                cache_key = self.result_cache.key("edit", self.request, crop_to_aspect=self.crop_to_aspect,
+                                                   **self.encoding.cache_params())
+            cached_path = self._restore_cached(cache_key, f"edited_{self.index}")
+            if cached_path:
+                self.signals.finished.emit(self.index, True, "Взято из кэша (такой запрос уже выполнялся)", cached_path, self.prompt)
+                return
+            
+            # Обычно изображение уже загружено в фоне при добавлении во вкладку
             self.signals.progress.emit(self.index, "Загрузка изображения на сервер...")
-            image_url = upload_image(self.request.image_path)
+            image_url = get_pre_uploader().get(self.request.image_path, self.request.resolution)
             
             if not image_url:
                 error_msg = (
@@ -61,7 +95,7 @@ class EditWorker(QRunnable):
                 config = Config()
                 images_dir = Path(config.ensure_images_dir())
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                image_path = images_dir / f"edited_{self.index}_{timestamp}.png"
+                image_path = images_dir / f"edited_{self.index}_{timestamp}{self.encoding.extension}"
                 
                 if response.image_url:
                     success = url_to_image(
@@ -69,7 +103,9 @@ class EditWorker(QRunnable):
                         str(image_path),
                         aspect_ratio=self.request.aspect_ratio,
                         resolution=self.request.resolution,
-                        crop_to_aspect=self.crop_to_aspect
+                        crop_to_aspect=self.crop_to_aspect,
+                        derivatives={},  # Миниатюра и превью для галереи
+                        encoding=self.encoding
                     )
                 elif response.image_base64:
                     success = base64_to_image(
@@ -77,12 +113,16 @@ class EditWorker(QRunnable):
                         str(image_path),
                         aspect_ratio=self.request.aspect_ratio,
                         resolution=self.request.resolution,
-                        crop_to_aspect=self.crop_to_aspect
+                        crop_to_aspect=self.crop_to_aspect,
+                        derivatives={},  # Миниатюра и превью для галереи
+                        encoding=self.encoding
                     )
                 else:
                     success = False
                 
                 if success:
+                    if cache_key:
+                        self.result_cache.put(cache_key, "edit", str(image_path))
                     self.signals.finished.emit(self.index, True, "Успешно отредактировано!", str(image_path), self.prompt)
                 else:
                     self.signals.finished.emit(self.index, False, "Ошибка сохранения изображения", "", self.prompt)
@@ -99,6 +139,7 @@ class EditingTab(QWidget):
         super().__init__()
         self.api_client = api_client
         self.db_manager = db_manager
+        self.result_cache = None
         self.config = Config()
         self.image_paths = []
         self.thread_pool = QThreadPool()
@@ -146,6 +187,8 @@ class EditingTab(QWidget):
         self.images_list.setIconSize(QSize(100, 100))  # Размер иконок
         self.images_list.setViewMode(QListWidget.IconMode)  # Режим иконок
         image_layout.addWidget(self.images_list)
+        # Изображения загружаются на хостинг сразу после добавления
+        self.pre_upload = PreUploadTracker(self.images_list)
         
         image_group.setLayout(image_layout)
         layout.addWidget(image_group)
@@ -285,6 +328,10 @@ class EditingTab(QWidget):
         """Установить менеджер БД"""
         self.db_manager = db_manager
     
+    def set_result_cache(self, result_cache: ResultCache):
+        """Установить кэш результатов (None - кэш выключен)"""
+        self.result_cache = result_cache
+    
     def load_images(self):
         """Загрузка нескольких изображений"""
         file_paths, _ = QFileDialog.getOpenFileNames(
@@ -341,6 +388,16 @@ class EditingTab(QWidget):
         # Обновляем счетчики и кнопку
         self.update_image_count()
         self.edit_btn.setEnabled(len(self.image_paths) > 0)
+        
+        # Загружаем на хостинг, пока пользователь пишет промпт
+        self.pre_upload.start(file_path, self.selected_resolution())
+    
+    def selected_resolution(self) -> str:
+        """Выбранное разрешение (None - по исходному изображению)"""
+        if self.resolution_combo.currentIndex() == 0:
+            return None
+        resolution_map = {"1024x1024 (1K)": "1024", "2048x2048 (2K)": "2048", "4096x4096 (4K)": "4096"}
+        return resolution_map[self.resolution_combo.currentText()]
     
     def paste_image_from_clipboard(self):
         """Вставка изображения из буфера обмена"""
@@ -442,10 +499,7 @@ class EditingTab(QWidget):
         
         # Получаем параметры
         model = "pro" if self.model_combo.currentIndex() == 1 else "flash"
-        resolution = None
-        if self.resolution_combo.currentIndex() > 0:
-            resolution_map = {"1024x1024 (1K)": "1024", "2048x2048 (2K)": "2048", "4096x4096 (4K)": "4096"}
-            resolution = resolution_map[self.resolution_combo.currentText()]
+        resolution = self.selected_resolution()
         
         # Получаем соотношение сторон
         aspect_text = self.aspect_combo.currentText()
@@ -544,7 +598,7 @@ class EditingTab(QWidget):
             crop_to_aspect = self.crop_to_aspect_checkbox.isChecked()
             
             # Создаем и запускаем воркер (передаем промпт для сохранения в БД)
-            worker = EditWorker(idx, self.api_client, request, crop_to_aspect, prompt)
+            worker = EditWorker(idx, self.api_client, request, crop_to_aspect, prompt, self.result_cache)
             worker.signals.progress.connect(lambda idx, msg, i=idx: self.on_worker_progress(i, msg))
             # Используем замыкание для сохранения промпта
             worker.signals.finished.connect(lambda idx, success, msg, path, p, i=idx, prompt_val=prompt: self.on_worker_finished(i, success, msg, path, prompt_val))
@@ -591,7 +645,8 @@ class EditingTab(QWidget):
                 model=model,
                 image_path=image_path,
                 resolution=resolution,
-                negative_prompt=self.negative_prompt_text.toPlainText().strip() or None
+                negative_prompt=self.negative_prompt_text.toPlainText().strip() or None,
+                derivatives=find_derivatives(image_path)
             )
         
         # Обновляем общий прогресс
@@ -8,6 +8,7 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
 from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QPixmap
 from database.db_manager import DatabaseManager
+from utils.image_utils import make_derivatives, remove_derivatives
 from gui.image_viewer import ImageViewer
 from pathlib import Path
 import shutil
@@ -182,7 +183,7 @@ class GalleryTab(QWidget):
         # Миниатюра изображения
         image_label = QLabel()
         if image_path:
-            pixmap = QPixmap(image_path)
+            pixmap = QPixmap(self.get_thumbnail_path(gen))
             if not pixmap.isNull():
                 scaled_pixmap = pixmap.scaled(180, 150, Qt.KeepAspectRatio, Qt.SmoothTransformation)
                 image_label.setPixmap(scaled_pixmap)
@@ -241,6 +242,27 @@ class GalleryTab(QWidget):
         
         return frame
     
+    def get_thumbnail_path(self, gen: dict) -> str:
+        """
+        Путь к миниатюре генерации
+        
+        Для записей, созданных до появления миниатюр, миниатюра и превью
+        создаются один раз и сохраняются в БД; при ошибке используется оригинал.
+        """
+        image_path = gen.get("image_path")
+        thumbnail_path = gen.get("thumbnail_path")
+        if thumbnail_path and Path(thumbnail_path).exists():
+            return thumbnail_path
+        
+        try:
+            derivatives = make_derivatives(image_path, image_path)
+        except Exception as e:
+            print(f"Ошибка создания миниатюры {image_path}: {e}")
+            return image_path
+        if self.db_manager and gen.get("id"):
+            self.db_manager.set_generation_derivatives(gen["id"], derivatives)
+        return derivatives["thumbnail"]["path"]
+    
     def view_prompt(self, gen: dict):
         """Просмотр полного промпта и информации о генерации"""
         dialog = QDialog(self)
@@ -342,7 +364,7 @@ class GalleryTab(QWidget):
             self,
             "Сохранить изображение",
             Path(image_path).name,
-            "Изображения (*.png *.jpg *.jpeg)"
+            "Изображения (*.png *.jpg *.jpeg *.webp *.avif)"
         )
         
         if save_path:
@@ -483,6 +505,7 @@ class GalleryTab(QWidget):
                     self, "Ошибка",
                     f"Не удалось удалить файл:\n{str(e)}"
                 )
+        remove_derivatives(image_path)
         
         # Удаляем из выбранных
         self.selected_images.discard(image_path)
@@ -552,6 +575,7 @@ class GalleryTab(QWidget):
                     file_deleted = True
                 except Exception as e:
                     print(f"Ошибка при удалении файла {image_path}: {e}")
+            remove_derivatives(image_path)
             
             if deleted_from_db or file_deleted:
                 deleted_count += 1
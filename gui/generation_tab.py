@@ -9,12 +9,16 @@ from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize
 from PyQt5.QtGui import QPixmap, QIcon
 from api.client import NanoBananaAPIClient
 from api.models import GenerationRequest
-from utils.image_utils import url_to_image, base64_to_image
-from utils.image_uploader import upload_image
+from api.handles import as_completed
+from api.result_cache import ResultCache
+from utils.image_utils import url_to_image, base64_to_image, find_derivatives
+from utils.image_uploader import upload_images
 from utils.config import Config
+from utils.output_format import get_output_encoding
 from database.db_manager import DatabaseManager
 from pathlib import Path
 from datetime import datetime
+from dataclasses import replace
 
 
 class GenerationWorker(QThread):
@@ -23,7 +27,7 @@ class GenerationWorker(QThread):
     progress = pyqtSignal(int, int, str)  # current, total, prompt
     image_saved = pyqtSignal(str, str, str, str, str)  # image_path, prompt, model, resolution, negative_prompt
     
-    def __init__(self, client: NanoBananaAPIClient, request: GenerationRequest, batch_mode=False, prompts_list=None, reference_urls=None, crop_to_aspect=False):
+    def __init__(self, client: NanoBananaAPIClient, request: GenerationRequest, batch_mode=False, prompts_list=None, reference_urls=None, crop_to_aspect=False, result_cache: ResultCache = None):
         super().__init__()
         self.client = client
         self.request = request
@@ -34,54 +38,112 @@ class GenerationWorker(QThread):
         self.resolution = request.resolution
         self.negative_prompt = request.negative_prompt
         self.crop_to_aspect = crop_to_aspect
+        self.result_cache = result_cache
+        self.encoding = get_output_encoding()  # Формат результата на момент запуска
+    
+    def _cache_key(self, request: GenerationRequest, crop_to_aspect: bool):
+        """Ключ кэша результатов (None если кэш выключен)"""
+        if not self.result_cache:
+            return None
+        return self.result_cache.key("generate", request, crop_to_aspect=crop_to_aspect,
+                                      **self.encoding.cache_params())
+    
+    def _restore_cached(self, cache_key: str, prefix: str) -> str:
+        """
+        Скопировать результат такого же запроса из кэша в новый файл
+        
+        Returns:
+            Путь к файлу или пустая строка, если в кэше ничего нет
+        """
+        if not cache_key:
+            return ""
+        config = Config()
+        images_dir = Path(config.ensure_images_dir())
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        image_path = images_dir / f"{prefix}_{timestamp}{self.encoding.extension}"
+        if self.result_cache.restore(cache_key, str(image_path)):
+            return str(image_path)
+        return ""
     
     def run(self):
         """Выполнение генерации"""
         if self.batch_mode and self.prompts_list:
-            # Пакетная генерация
+            # Пакетная генерация: создаем все задачи сразу,
+            # а результаты сохраняем по мере готовности
             total = len(self.prompts_list)
             success_count = 0
+            completed = 0
             
+            handles = {}
             for idx, prompt in enumerate(self.prompts_list, 1):
-                self.progress.emit(idx, total, prompt)
-                
-                # Обновляем промпт в запросе
-                self.request.prompt = prompt.strip()
+                request = replace(self.request, prompt=prompt.strip())
+                try:
+                    # Такой же запрос уже выполнялся - берем результат из кэша
+                    cache_key = self._cache_key(request, False)
+                    cached_path = self._restore_cached(cache_key, f"generated_batch_{idx}")
+                    if cached_path:
+                        completed += 1
+                        success_count += 1
+                        self.progress.emit(completed, total, request.prompt)
+                        self.image_saved.emit(
+                            cached_path,
+                            request.prompt,
+                            self.model,
+                            self.resolution,
+                            self.negative_prompt or ""
+                        )
+                        continue
+                    
+                    handle = self.client.submit_generate(request, self.reference_urls if self.reference_urls else None)
+                    handles[handle] = (idx, request, cache_key)
+                except Exception as e:
+                    pass  # Продолжаем с следующим промптом
+            
+            for handle in as_completed(handles):
+                idx, request, cache_key = handles[handle]
+                completed += 1
+                self.progress.emit(completed, total, request.prompt)
                 
                 try:
-                    response = self.client.generate_image(self.request, self.reference_urls if self.reference_urls else None)
+                    response = handle.result()
                     if response.success:
                         # Сохраняем изображение
                         config = Config()
                         images_dir = Path(config.ensure_images_dir())
                         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        image_path = images_dir / f"generated_batch_{idx}_{timestamp}.png"
+                        image_path = images_dir / f"generated_batch_{idx}_{timestamp}{self.encoding.extension}"
                         
                         if response.image_url:
                             success = url_to_image(
                                 response.image_url, 
                                 str(image_path),
-                                aspect_ratio=self.request.aspect_ratio,
-                                resolution=self.request.resolution,
-                                crop_to_aspect=False  # Не обрезаем автоматически
+                                aspect_ratio=request.aspect_ratio,
+                                resolution=request.resolution,
+                                crop_to_aspect=False,  # Не обрезаем автоматически
+                                derivatives={},  # Миниатюра и превью для галереи
+                                encoding=self.encoding
                             )
                         elif response.image_base64:
                             success = base64_to_image(
                                 response.image_base64, 
                                 str(image_path),
-                                aspect_ratio=self.request.aspect_ratio,
-                                resolution=self.request.resolution,
-                                crop_to_aspect=False  # Не обрезаем автоматически
+                                aspect_ratio=request.aspect_ratio,
+                                resolution=request.resolution,
+                                crop_to_aspect=False,  # Не обрезаем автоматически
+                                derivatives={},  # Миниатюра и превью для галереи
+                                encoding=self.encoding
                             )
                         else:
                             success = False
                         
                         if success:
                             success_count += 1
+                            if cache_key:
+                                self.result_cache.put(cache_key, "generate", str(image_path))
                             # Отправляем сигнал для сохранения в БД
                             self.image_saved.emit(
                                 str(image_path),
-                                prompt.strip(),
+                                request.prompt,
                                 self.model,
                                 self.resolution,
                                 self.negative_prompt or ""
@@ -94,13 +156,19 @@ class GenerationWorker(QThread):
         else:
             # Одиночная генерация
             try:
+                cache_key = self._cache_key(self.request, self.crop_to_aspect)
+                cached_path = self._restore_cached(cache_key, "generated")
+                if cached_path:
+                    self.finished.emit(True, "Изображение взято из кэша (такой запрос уже выполнялся)", cached_path)
+                    return
+                
                 response = self.client.generate_image(self.request, self.reference_urls if self.reference_urls else None)
                 if response.success:
                     # Сохраняем изображение
                     config = Config()
                     images_dir = Path(config.ensure_images_dir())
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    image_path = images_dir / f"generated_{timestamp}.png"
+                    image_path = images_dir / f"generated_{timestamp}{self.encoding.extension}"
                     
                     if response.image_url:
                         success = url_to_image(
@@ -108,7 +176,9 @@ class GenerationWorker(QThread):
                             str(image_path),
                             aspect_ratio=self.request.aspect_ratio,
                             resolution=self.request.resolution,
-                            crop_to_aspect=self.crop_to_aspect
+                            crop_to_aspect=self.crop_to_aspect,
+                            derivatives={},  # Миниатюра и превью для галереи
+                            encoding=self.encoding
                         )
                     elif response.image_base64:
                         success = base64_to_image(
@@ -116,12 +186,16 @@ class GenerationWorker(QThread):
                             str(image_path),
                             aspect_ratio=self.request.aspect_ratio,
                             resolution=self.request.resolution,
-                            crop_to_aspect=self.crop_to_aspect
+                            crop_to_aspect=self.crop_to_aspect,
+                            derivatives={},  # Миниатюра и превью для галереи
+                            encoding=self.encoding
                         )
                     else:
                         success = False
                     
                     if success:
+                        if cache_key:
+                            self.result_cache.put(cache_key, "generate", str(image_path))
                         self.finished.emit(True, "Изображение успешно сгенерировано!", str(image_path))
                     else:
                         self.finished.emit(False, "Ошибка сохранения изображения", "")
@@ -138,6 +212,7 @@ class GenerationTab(QWidget):
         super().__init__()
         self.api_client = api_client
         self.db_manager = db_manager
+        self.result_cache = None
         self.config = Config()
         self.worker = None
         self.reference_images = []  # Список путей к референсным изображениям
@@ -329,6 +404,10 @@ class GenerationTab(QWidget):
         """Установить менеджер БД"""
         self.db_manager = db_manager
     
+    def set_result_cache(self, result_cache: ResultCache):
+        """Установить кэш результатов (None - кэш выключен)"""
+        self.result_cache = result_cache
+    
     def generate_image(self):
         """Генерация изображения"""
         if not self.api_client:
@@ -438,19 +517,18 @@ class GenerationTab(QWidget):
         reference_urls = []
         if reference_images:
             self.batch_status_label.setVisible(True)
-            self.batch_status_label.setText("Загрузка референсных изображений...")
+            self.batch_status_label.setText(f"Загрузка референсов ({len(reference_images)})...")
             
-            for idx, ref_path in enumerate(reference_images, 1):
-                self.batch_status_label.setText(f"Загрузка референса {idx}/{len(reference_images)}...")
-                ref_url = upload_image(ref_path)
-                if ref_url:
-                    reference_urls.append(ref_url)
-                else:
-                    QMessageBox.warning(
-                        self, "Ошибка",
-                        f"Не удалось загрузить референсное изображение: {Path(ref_path).name}\n"
-                        "Генерация продолжится без этого референса."
-                    )
+            # Все референсы загружаются одновременно
+            ref_urls = upload_images(reference_images, resolution=resolution)
+            reference_urls = [url for url in ref_urls if url]
+            failed = [Path(ref_path).name for ref_path, url in zip(reference_images, ref_urls) if not url]
+            if failed and reference_urls:
+                QMessageBox.warning(
+                    self, "Ошибка",
+                    f"Не удалось загрузить референсные изображения: {', '.join(failed)}\n"
+                    "Генерация продолжится без них."
+                )
             
             if not reference_urls and reference_images:
                 QMessageBox.warning(
@@ -469,7 +547,8 @@ class GenerationTab(QWidget):
             batch_mode, 
             prompts_list if batch_mode else None,
             reference_urls if reference_urls else None,
-            crop_to_aspect
+            crop_to_aspect,
+            self.result_cache
         )
         if batch_mode:
             self.worker.progress.connect(self.on_batch_progress)
@@ -566,7 +645,8 @@ class GenerationTab(QWidget):
                 model=model,
                 image_path=image_path,
                 resolution=resolution,
-                negative_prompt=negative_prompt if negative_prompt else None
+                negative_prompt=negative_prompt if negative_prompt else None,
+                derivatives=find_derivatives(image_path)
             )
     
     def on_generation_finished(self, success: bool, message: str, image_path: str):
@@ -586,7 +666,8 @@ class GenerationTab(QWidget):
                     model=model,
                     image_path=image_path,
                     resolution=resolution,
-                    negative_prompt=self.negative_prompt_text.toPlainText().strip() or None
+                    negative_prompt=self.negative_prompt_text.toPlainText().strip() or None,
+                    derivatives=find_derivatives(image_path)
                 )
             
             QMessageBox.information(self, "Успех", message)
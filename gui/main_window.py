@@ -6,12 +6,16 @@ from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QMessageBox, QGroupBox)
 from PyQt5.QtCore import Qt
 from api.client import NanoBananaAPIClient
+from api.result_cache import ResultCache
 from database.db_manager import DatabaseManager
 from gui.generation_tab import GenerationTab
 from gui.editing_tab import EditingTab
 from gui.combine_tab import CombineTab
 from gui.gallery_tab import GalleryTab
 from utils.config import Config
+from utils.upload_prep import configure_upload_prep
+from utils.output_format import configure_output_encoding
+from utils.image_pool import configure_image_pool, get_image_pool
 
 
 class MainWindow(QMainWindow):
@@ -22,6 +26,30 @@ class MainWindow(QMainWindow):
         self.config = Config()
         self.api_client = None
         self.db_manager = DatabaseManager()
+        # Кэш результатов одинаковых запросов (настройка result_cache)
+        self.result_cache = None
+        if self.config.get("result_cache"):
+            self.result_cache = ResultCache(
+                self.db_manager,
+                ttl=self.config.get("result_cache_ttl_hours", 168) * 3600
+            )
+        # Уменьшение и пережатие изображений перед загрузкой на хостинг
+        configure_upload_prep(
+            enabled=self.config.get("optimize_uploads", False),
+            max_bytes=int(self.config.get("upload_max_mb", 3) * 1024 * 1024)
+        )
+        # Формат, в котором сохраняются результаты
+        configure_output_encoding(
+            format=self.config.get("output_format", "png"),
+            quality=self.config.get("output_quality", 90),
+            effort=self.config.get("output_effort", 6),
+            archive=self.config.get("output_archive", False)
+        )
+        # Пул процессов для декодирования, обрезки и кодирования результатов
+        configure_image_pool(
+            workers=self.config.get("image_workers"),
+            queue_size=self.config.get("image_queue_size", 8)
+        )
         self.init_ui()
         self.load_api_key()
     
@@ -64,16 +92,19 @@ class MainWindow(QMainWindow):
         # Вкладка генерации
         self.generation_tab = GenerationTab()
         self.generation_tab.set_db_manager(self.db_manager)
+        self.generation_tab.set_result_cache(self.result_cache)
         self.tabs.addTab(self.generation_tab, "Генерация")
         
         # Вкладка редактирования
         self.editing_tab = EditingTab()
         self.editing_tab.set_db_manager(self.db_manager)
+        self.editing_tab.set_result_cache(self.result_cache)
         self.tabs.addTab(self.editing_tab, "Редактирование")
         
         # Вкладка комбинирования
         self.combine_tab = CombineTab()
         self.combine_tab.set_db_manager(self.db_manager)
+        self.combine_tab.set_result_cache(self.result_cache)
         self.tabs.addTab(self.combine_tab, "Комбинирование")
         
         # Вкладка галереи
@@ -152,4 +183,8 @@ class MainWindow(QMainWindow):
         # Обновляем галерею при переходе на вкладку галереи
         if index == 3:  # Индекс вкладки галереи
             self.gallery_tab.load_gallery()
-
+    
+    def closeEvent(self, event):
+        """Остановить процессы обработки изображений при закрытии окна"""
+        get_image_pool().shutdown()
+        super().closeEvent(event)
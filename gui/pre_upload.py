@@ -0,0 +1,48 @@
+"""
+Фоновая загрузка изображений, добавленных во вкладку
+"""
+from PyQt5.QtWidgets import QListWidget
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
+from utils.image_uploader import get_pre_uploader
+
+# Роль данных элемента списка с публичным URL загруженного изображения
+PRE_UPLOAD_URL_ROLE = Qt.UserRole + 1
+
+
+class PreUploadTracker(QObject):
+    """Загружает изображения списка заранее и отмечает загруженные элементы"""
+    uploaded = pyqtSignal(str, str)  # file_path, url (пустая строка при ошибке)
+    
+    def __init__(self, list_widget: QListWidget):
+        super().__init__(list_widget)
+        self.list_widget = list_widget
+        self.uploaded.connect(self.on_uploaded)
+    
+    def start(self, file_path: str, resolution: str = None):
+        """Начать загрузку изображения в фоне"""
+        try:
+            future = get_pre_uploader().start(file_path, resolution)
+        except Exception as e:
+            print(f"Ошибка фоновой загрузки {file_path}: {e}")
+            return
+        future.add_done_callback(lambda f: self._emit(file_path, f))
+    
+    def _emit(self, file_path: str, future):
+        # Вызывается из потока загрузки: сигнал доставит результат в поток интерфейса
+        try:
+            url = future.result() if future.exception() is None else None
+            self.uploaded.emit(file_path, url or "")
+        except RuntimeError:
+            pass  # Вкладка уже закрыта
+    
+    def on_uploaded(self, file_path: str, url: str):
+        """Сохранить URL в элементе списка"""
+        for row in range(self.list_widget.count()):
+            item = self.list_widget.item(row)
+            if item.data(Qt.UserRole) != file_path:
+                continue
+            item.setData(PRE_UPLOAD_URL_ROLE, url or None)
+            if url:
+                item.setToolTip(f"{file_path}\nЗагружено: {url}")
+            else:
+                item.setToolTip(f"{file_path}\nНе удалось загрузить заранее, повтор при запуске")
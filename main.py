@@ -1,6 +1,7 @@
 """
 Точка входа в приложение NanoBanana Pro
 """
+import multiprocessing
 import sys
 from PyQt5.QtWidgets import QApplication
 from gui.main_window import MainWindow
@@ -23,6 +24,8 @@ def main():
 
 
 if __name__ == "__main__":
+    # Нужно для пула процессов обработки изображений в собранном exe
+    multiprocessing.freeze_support()
     main()
 
 
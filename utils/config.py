@@ -25,7 +25,17 @@ class Config:
             "default_resolution": "2048",  # 1024, 2048, 4096
             "save_images": True,
             "images_dir": default_images_dir,
-            "theme": "dark"
+            "theme": "dark",
+            "result_cache": False,  # Не генерировать повторно одинаковые запросы
+            "result_cache_ttl_hours": 168,
+            "optimize_uploads": False,  # Уменьшать и пережимать изображения перед загрузкой
+            "upload_max_mb": 3,
+            "output_format": "png",  # Формат результатов: png, webp, jpeg, avif
+            "output_quality": 90,  # Качество для форматов с потерями (100 для WebP - без потерь)
+            "output_effort": 6,  # Сжатие 0-9: больше - меньше файл, дольше сохранение
+            "output_archive": False,  # Сохранять исходный файл API, если результат пережат с потерями
+            "image_workers": None,  # Процессов обработки изображений (None - по числу ядер, до 4; 0 - без пула)
+            "image_queue_size": 8  # Задач, ожидающих свободного процесса
         }
         
         self.load()
@@ -0,0 +1,82 @@
+"""
+Общие HTTP сессии с пулом соединений и повторами запросов
+
+Одна сессия на хост: keep-alive соединения переиспользуются между
+запросами и между клиентами, поэтому опрос статуса задачи не платит
+за новое TCP+TLS рукопожатие на каждой итерации.
+"""
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Размер пула соединений на хост (должен покрывать число параллельных задач)
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 32
+
+# Повторы только для идемпотентных запросов
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5
+# Без 429: ответ о превышении лимита обрабатывает ограничитель частоты
+# (api/rate_limiter.py), а не повтор с ожиданием Retry-After внутри запроса.
+# Поэтому Retry-After адаптер тоже не учитывает: иначе urllib3 повторяет
+# ответы 429 с этим заголовком независимо от списка статусов
+RETRY_STATUS_FORCELIST = (500, 502, 503, 504)
+RETRY_ALLOWED_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+_sessions = {}  # {host: requests.Session}
+_sessions_lock = threading.Lock()
+
+
+def _create_session() -> requests.Session:
+    """Создать сессию с настроенным адаптером"""
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_FORCELIST,
+        allowed_methods=RETRY_ALLOWED_METHODS,
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Получить общую сессию для хоста
+    
+    Args:
+        url: URL или базовый адрес сервиса
+        
+    Returns:
+        requests.Session, общий для всех обращений к этому хосту
+    """
+    host = urlparse(url).netloc or url
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _create_session()
+                _sessions[host] = session
+    return session
+
+
+def close_sessions():
+    """Закрыть все открытые сессии"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,179 @@
+"""
+Пул процессов для обработки изображений
+
+Декодирование, обрезка, масштабирование LANCZOS и кодирование 4K
+изображений держат GIL, поэтому в потоках параллельные задачи выполняются
+по очереди. Пул запускает их в отдельных процессах. Очередь ограничена:
+если все места заняты, submit ждет, пока освободится место, и не копит
+в памяти байты изображений.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict
+
+
+# Задач в очереди сверх числа процессов
+DEFAULT_QUEUE_SIZE = 8
+
+
+def default_workers() -> int:
+    """Число процессов по умолчанию: по одному на ядро, но не больше 4"""
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+class ImagePool:
+    """Ограниченная очередь задач обработки изображений в пуле процессов"""
+    
+    def __init__(self, workers: int = None, queue_size: int = DEFAULT_QUEUE_SIZE):
+        """
+        Args:
+            workers: Число процессов (0 - выполнять в вызывающем потоке)
+            queue_size: Сколько задач может ждать свободного процесса
+        """
+        self.workers = default_workers() if workers is None else max(0, workers)
+        self.queue_size = max(0, queue_size)
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size) if self.workers else None
+        self._executor = None
+        self._lock = threading.Lock()
+        
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.inline = 0  # Выполнено в вызывающем потоке
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.wait_seconds = 0.0  # Суммарное ожидание места в очереди
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Пул создается при первой задаче: в gunicorn - уже в процессе воркера.
+        # spawn, а не fork: fork процесса с потоками (Qt, воркеры задач) небезопасен
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+    
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Поставить задачу в очередь
+        
+        Функция и аргументы должны сериализоваться pickle (функция - на
+        уровне модуля). Если очередь заполнена, ждет свободного места.
+        
+        Returns:
+            Future с результатом fn(*args, **kwargs)
+        """
+        if not self.workers:
+            return self._run_inline(fn, *args, **kwargs)
+        
+        started_at = time.monotonic()
+        self._slots.acquire()
+        with self._lock:
+            self.wait_seconds += time.monotonic() - started_at
+            self.submitted += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except (BrokenProcessPool, RuntimeError) as e:
+            # Процесс пула упал или пул закрыт - пересоздаем его для следующих задач
+            print(f"Пул обработки изображений недоступен, задача выполняется в потоке: {e}")
+            self._release(None)
+            with self._lock:
+                self._executor = None
+            return self._run_inline(fn, *args, **kwargs)
+        future.add_done_callback(self._release)
+        return future
+    
+    def run(self, fn, *args, **kwargs):
+        """Выполнить задачу в пуле и дождаться результата"""
+        try:
+            return self.submit(fn, *args, **kwargs).result()
+        except BrokenProcessPool as e:
+            # Процесс пула завершился аварийно - повторяем задачу в этом потоке
+            print(f"Процесс обработки изображений завершился аварийно, повтор в потоке: {e}")
+            with self._lock:
+                self._executor = None
+            return self._run_inline(fn, *args, **kwargs).result()
+    
+    def _run_inline(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        with self._lock:
+            self.inline += 1
+        return future
+    
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            if future is not None:
+                if future.cancelled() or future.exception() is not None:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+        self._slots.release()
+    
+    def shutdown(self):
+        """Остановить процессы пула (дождавшись начатых задач)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+    
+    def get_stats(self) -> Dict:
+        """
+        Статистика пула
+        
+        Returns:
+            Словарь с числом процессов, размером очереди и счетчиками задач
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "inline": self.inline,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "avg_queue_wait_ms": round(self.wait_seconds / self.submitted * 1000, 1) if self.submitted else 0
+            }
+
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+
+def configure_image_pool(workers: int = None, queue_size: int = DEFAULT_QUEUE_SIZE) -> ImagePool:
+    """
+    Задать размер пула (до первой задачи; прежний пул останавливается)
+    
+    Args:
+        workers: Число процессов (None - default_workers(), 0 - без пула)
+        queue_size: Сколько задач может ждать свободного процесса
+    """
+    global _image_pool
+    with _image_pool_lock:
+        previous, _image_pool = _image_pool, ImagePool(workers, queue_size)
+    if previous is not None:
+        previous.shutdown()
+    return _image_pool
+
+
+def get_image_pool() -> ImagePool:
+    """Общий пул обработки изображений"""
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None:
+            _image_pool = ImagePool()
+        return _image_pool
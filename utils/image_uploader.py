@@ -2,12 +2,107 @@
 Утилита для загрузки изображений на публичные URL
 Необходимо для работы с NanoBanana API (редактирование и комбинирование)
 """
+import mimetypes
 import requests
-import subprocess
-import tempfile
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from pathlib import Path
-from typing import Optional
+from typing import Callable, List, Optional
+from utils.http_session import get_session
+from utils.upload_cache import get_upload_cache, file_digest
+from utils.upload_health import get_upload_health
+from utils.upload_prep import get_upload_preparer, max_side_for
+
+
+# Размер блока, которым файл читается с диска при отправке
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class UploadCancelled(Exception):
+    """Загрузка прервана: другой хостинг уже вернул URL"""
+
+
+class MultipartFileStream:
+    """
+    Тело запроса multipart/form-data с одним файлом
+    
+    Файл читается с диска блоками по мере отправки и не загружается в
+    память целиком. Длина тела известна заранее, поэтому запрос уходит с
+    Content-Length, а не с chunked-кодированием (его принимают не все
+    хостинги). Каждый проход по объекту заново открывает файл, так что
+    повтор запроса после ошибки соединения отправляет тело полностью.
+    """
+    
+    def __init__(self, file_path: str, field: str = "file", fields: dict = None,
+                 cancel_event: threading.Event = None):
+        """
+        Args:
+            file_path: Путь к файлу
+            field: Имя поля формы с файлом
+            fields: Дополнительные текстовые поля формы
+            cancel_event: Если событие установлено, отправка прерывается
+                          исключением UploadCancelled
+        """
+        self.file_path = file_path
+        self.cancel_event = cancel_event
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        
+        filename = Path(file_path).name.replace('"', "%22")
+        mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        head = "".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in (fields or {}).items()
+        )
+        head += (f'--{self.boundary}\r\n'
+                 f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                 f'Content-Type: {mime_type}\r\n\r\n')
+        self._head = head.encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._file_size = os.path.getsize(file_path)
+    
+    def __len__(self):
+        return len(self._head) + self._file_size + len(self._tail)
+    
+    def __iter__(self):
+        yield self._head
+        with open(self.file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    raise UploadCancelled(self.file_path)
+                yield chunk
+        yield self._tail
+
+
+def post_file(url: str, file_path: str, field: str = "file", headers: dict = None,
+              fields: dict = None, timeout: float = 60,
+              cancel_event: threading.Event = None) -> requests.Response:
+    """
+    Отправить файл POST запросом multipart/form-data потоком с диска
+    
+    Запрос идет через общую сессию хоста (keep-alive соединения
+    переиспользуются между загрузками).
+    
+    Args:
+        url: Адрес загрузки
+        file_path: Путь к файлу
+        field: Имя поля формы с файлом
+        headers: Дополнительные заголовки
+        fields: Дополнительные текстовые поля формы
+        timeout: Таймаут соединения и ожидания ответа, секунд
+        cancel_event: Событие отмены (см. MultipartFileStream)
+    
+    Returns:
+        Ответ сервера
+    """
+    body = MultipartFileStream(file_path, field, fields, cancel_event)
+    request_headers = dict(headers or {})
+    request_headers["Content-Type"] = body.content_type
+    request_headers["Content-Length"] = str(len(body))
+    return get_session(url).post(url, data=body, headers=request_headers, timeout=timeout)
 
 
 def upload_to_imgur(image_path: str, client_id: str = None) -> Optional[str]:
@@ -17,7 +112,7 @@ def upload_to_imgur(image_path: str, client_id: str = None) -> Optional[str]:
     Args:
         image_path: Путь к изображению
         client_id: Imgur Client ID (опционально, можно получить бесплатно)
-        
+    
     Returns:
         URL изображения или None
     """
@@ -28,32 +123,32 @@ def upload_to_imgur(image_path: str, client_id: str = None) -> Optional[str]:
     
     try:
         headers = {"Authorization": f"Client-ID {client_id}"}
-        with open(image_path, 'rb') as f:
-            files = {'image': f}
-            response = requests.post(
-                "https://api.imgur.com/3/image",
-                headers=headers,
-                files=files,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("success"):
-                    return result.get("data", {}).get("link")
+        response = post_file(
+            "https://api.imgur.com/3/image",
+            image_path,
+            field='image',
+            headers=headers,
+            timeout=30
+        )
+        
+        if response.status_code == 200:
+            result = response.json()
+            if result.get("success"):
+                return result.get("data", {}).get("link")
     except Exception as e:
         print(f"Ошибка загрузки на Imgur: {e}")
     
     return None
 
 
-def upload_to_tmpfiles(image_path: str) -> Optional[str]:
+def upload_to_tmpfiles(image_path: str, cancel_event: threading.Event = None) -> Optional[str]:
     """
     Загрузить изображение на tmpfiles.org (временный хостинг)
     
     Args:
         image_path: Путь к изображению
-        
+        cancel_event: Событие отмены загрузки
+    
     Returns:
         URL изображения или None
     """
@@ -62,137 +157,99 @@ def upload_to_tmpfiles(image_path: str) -> Optional[str]:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        with open(image_path, 'rb') as f:
-            file_data = f.read()
-            files = {'file': (Path(image_path).name, file_data, 'image/png')}
-            
-            # Пробуем новый API формат
-            response = requests.post(
-                "https://tmpfiles.org/api/v1/upload",
-                files=files,
-                headers=headers,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                # Пробуем распарсить как JSON
-                try:
-                    result = response.json()
-                    # Проверяем разные форматы ответа
-                    if result.get("status") == "success":
-                        data = result.get("data", {})
-                        file_url = data.get("url") or data.get("link")
-                        if file_url:
-                            # Преобразуем URL в прямой доступ
-                            if file_url.startswith("/dl/"):
-                                return f"https://tmpfiles.org{file_url}"
-                            elif file_url.startswith("http"):
-                                return file_url
-                            else:
-                                return f"https://tmpfiles.org/dl/{file_url}"
-                    # Альтернативный формат ответа
-                    elif "url" in result:
-                        url = result["url"]
-                        if url.startswith("/dl/"):
-                            return f"https://tmpfiles.org{url}"
-                        return url
-                except ValueError:
-                    # Если не JSON, пробуем как текст
-                    text = response.text.strip()
-                    if text and text.startswith("http"):
-                        return text
+        # Пробуем новый API формат
+        response = post_file(
+            "https://tmpfiles.org/api/v1/upload",
+            image_path,
+            headers=headers,
+            timeout=30,
+            cancel_event=cancel_event
+        )
+        
+        if response.status_code == 200:
+            # Пробуем распарсить как JSON
+            try:
+                result = response.json()
+                # Проверяем разные форматы ответа
+                if result.get("status") == "success":
+                    data = result.get("data", {})
+                    file_url = data.get("url") or data.get("link")
+                    if file_url:
+                        # Преобразуем URL в прямой доступ
+                        if file_url.startswith("/dl/"):
+                            return f"https://tmpfiles.org{file_url}"
+                        elif file_url.startswith("http"):
+                            return file_url
+                        else:
+                            return f"https://tmpfiles.org/dl/{file_url}"
+                # Альтернативный формат ответа
+                elif "url" in result:
+                    url = result["url"]
+                    if url.startswith("/dl/"):
+                        return f"https://tmpfiles.org{url}"
+                    return url
+            except ValueError:
+                # Если не JSON, пробуем как текст
+                text = response.text.strip()
+                if text and text.startswith("http"):
+                    return text
+    except UploadCancelled:
+        pass
     except Exception as e:
         print(f"Ошибка загрузки на tmpfiles: {e}")
     
     return None
 
 
-def upload_to_0x0(image_path: str) -> Optional[str]:
+def upload_to_0x0(image_path: str, cancel_event: threading.Event = None) -> Optional[str]:
     """
     Загрузить изображение на 0x0.st (основной хостинг)
-    Использует curl через subprocess для обхода ограничений User-Agent
     
     Args:
         image_path: Путь к изображению
-        
+        cancel_event: Событие отмены загрузки
+    
     Returns:
         URL изображения или None
     """
-    # Сначала пробуем через curl (как в примере C#)
     try:
-        # Создаем временный файл для результата
-        with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.txt') as temp_file:
-            temp_result = temp_file.name
-        
-        # Команда curl (как в примере C#)
-        # Используем абсолютный путь к файлу
-        abs_path = os.path.abspath(image_path)
-        cmd = f'curl -F "file=@{abs_path}" https://0x0.st'
+        # 0x0.st отклоняет браузерные User-Agent, поэтому представляемся curl
+        headers = {
+            'User-Agent': 'curl/7.68.0'
+        }
         
-        # Запускаем curl через subprocess
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=60
+        response = post_file(
+            "https://0x0.st",
+            image_path,
+            headers=headers,
+            timeout=60,
+            cancel_event=cancel_event
         )
         
-        if result.returncode == 0:
-            url = result.stdout.strip()
-            # Убираем возможные пробелы и переносы строк
+        # 0x0.st возвращает просто текстовый URL, а не JSON
+        if response.status_code == 200:
+            url = response.text.strip()
             url = url.replace('\n', '').replace('\r', '').strip()
             if url and (url.startswith("http://") or url.startswith("https://")):
-                # Удаляем временный файл
-                try:
-                    os.unlink(temp_result)
-                except:
-                    pass
                 return url
-        
-        # Если curl не сработал, пробуем через requests с минимальным User-Agent
-        print(f"curl не сработал, пробуем через requests...")
+        else:
+            print(f"0x0.st вернул статус {response.status_code}: {response.text[:200]}")
+    except UploadCancelled:
+        pass
     except Exception as e:
-        print(f"Ошибка при использовании curl: {e}")
-    
-    # Резервный метод через requests с минимальным User-Agent
-    try:
-        # Пробуем с curl User-Agent или вообще без него
-        headers = {
-            'User-Agent': 'curl/7.68.0'  # User-Agent от curl
-        }
-        
-        with open(image_path, 'rb') as f:
-            # 0x0.st принимает файл через multipart/form-data
-            files = {'file': (Path(image_path).name, f, 'application/octet-stream')}
-            response = requests.post(
-                "https://0x0.st",
-                files=files,
-                headers=headers,
-                timeout=60
-            )
-            
-            # 0x0.st возвращает просто текстовый URL, а не JSON
-            if response.status_code == 200:
-                url = response.text.strip()
-                url = url.replace('\n', '').replace('\r', '').strip()
-                if url and (url.startswith("http://") or url.startswith("https://")):
-                    return url
-            else:
-                print(f"0x0.st вернул статус {response.status_code}: {response.text[:200]}")
-    except Exception as e:
-        print(f"Ошибка загрузки на 0x0.st через requests: {e}")
+        print(f"Ошибка загрузки на 0x0.st: {e}")
     
     return None
 
 
-def upload_to_fileio(image_path: str) -> Optional[str]:
+def upload_to_fileio(image_path: str, cancel_event: threading.Event = None) -> Optional[str]:
     """
     Загрузить изображение на file.io (временный хостинг)
     
     Args:
         image_path: Путь к изображению
-        
+        cancel_event: Событие отмены загрузки
+    
     Returns:
         URL изображения или None
     """
@@ -201,68 +258,320 @@ def upload_to_fileio(image_path: str) -> Optional[str]:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        with open(image_path, 'rb') as f:
-            files = {'file': (Path(image_path).name, f, 'image/png')}
-            response = requests.post(
-                "https://file.io",
-                files=files,
-                headers=headers,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                # Пробуем распарсить как JSON
-                try:
-                    result = response.json()
-                    if result.get("success"):
-                        return result.get("link")
-                except ValueError:
-                    # Если не JSON, пробуем как текст
-                    text = response.text.strip()
-                    if text and text.startswith("http"):
-                        return text
+        response = post_file(
+            "https://file.io",
+            image_path,
+            headers=headers,
+            timeout=30,
+            cancel_event=cancel_event
+        )
+        
+        if response.status_code == 200:
+            # Пробуем распарсить как JSON
+            try:
+                result = response.json()
+                if result.get("success"):
+                    return result.get("link")
+            except ValueError:
+                # Если не JSON, пробуем как текст
+                text = response.text.strip()
+                if text and text.startswith("http"):
+                    return text
+    except UploadCancelled:
+        pass
     except Exception as e:
         print(f"Ошибка загрузки на file.io: {e}")
     
     return None
 
 
-def upload_image(image_path: str, method: str = "auto") -> Optional[str]:
+# Загрузчики для режима auto
+UPLOADERS = {
+    "0x0": upload_to_0x0,
+    "tmpfiles": upload_to_tmpfiles,
+    "fileio": upload_to_fileio,
+}
+
+# Порядок хостингов для method="auto", пока нет статистики (см. UploadHealth)
+UPLOAD_ORDER = ("0x0", "tmpfiles", "fileio")
+
+# Через сколько секунд без ответа запускать загрузку на следующий хостинг
+HEDGE_DELAY = 3.0
+
+# Максимальное общее время загрузки в режиме auto
+UPLOAD_DEADLINE = 120
+
+# Сколько изображений одного запроса загружается одновременно (в комбинировании до 8)
+MAX_PARALLEL_UPLOADS = 8
+
+# Потоки загрузок (опоздавшие загрузки дорабатывают в фоне и не держат вызывающего)
+_upload_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="upload")
+
+
+def _run_uploader(host: str, image_path: str, cancel_event: threading.Event = None) -> Optional[str]:
+    """Загрузить изображение на хостинг и учесть результат в его статистике"""
+    started_at = time.monotonic()
+    url = UPLOADERS[host](image_path, cancel_event)
+    if not url and cancel_event is not None and cancel_event.is_set():
+        # Загрузку прервали ради другого хостинга - это не ошибка хостинга
+        return None
+    success = bool(url) and url.startswith(("http://", "https://"))
+    get_upload_health().record(host, success, time.monotonic() - started_at)
+    return url
+
+
+def upload_hedged(image_path: str, order=None, hedge_delay: float = HEDGE_DELAY,
+                  deadline: float = UPLOAD_DEADLINE) -> Optional[str]:
+    """
+    Загрузить изображение с подстраховкой несколькими хостингами
+    
+    Загрузка начинается на первом хостинге из order. Если он не ответил за
+    hedge_delay секунд или вернул ошибку, параллельно запускается следующий.
+    Возвращается первый полученный URL, остальные загрузки отменяются:
+    еще не начатые не запускаются, идущие прерывают отправку файла.
+    
+    Args:
+        image_path: Путь к изображению
+        order: Хостинги в порядке предпочтения (ключи UPLOADERS); по умолчанию
+               UPLOAD_ORDER, упорядоченный по статистике хостингов: первым
+               идет самый быстрый работающий, временно исключенные пропускаются
+        hedge_delay: Задержка перед запуском резервного хостинга, секунд
+        deadline: Максимальное общее время ожидания, секунд
+        
+    Returns:
+        URL изображения или None
+    """
+    queue = list(order) if order is not None else get_upload_health().rank(UPLOAD_ORDER)
+    pending = {}  # {future: хостинг}
+    started_at = time.monotonic()
+    # Прерывает отправку проигравших загрузок, чтобы не тратить канал
+    cancel_event = threading.Event()
+    
+    def launch():
+        host = queue.pop(0)
+        pending[_upload_executor.submit(_run_uploader, host, image_path, cancel_event)] = host
+    
+    launch()
+    while pending:
+        remaining = deadline - (time.monotonic() - started_at)
+        if remaining <= 0:
+            break
+        timeout = min(hedge_delay, remaining) if queue else remaining
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        
+        if not done:
+            # Текущие загрузки медлят - подключаем следующий хостинг
+            if queue:
+                launch()
+            continue
+        
+        for future in done:
+            host = pending.pop(future)
+            try:
+                url = future.result()
+            except Exception as e:
+                print(f"Ошибка загрузки на {host}: {e}")
+                url = None
+            if url and url.startswith(("http://", "https://")):
+                cancel_event.set()
+                for other in pending:
+                    other.cancel()
+                return url
+            # Хостинг вернул ошибку - сразу пробуем следующий
+            if queue:
+                launch()
+    
+    cancel_event.set()
+    for other in pending:
+        other.cancel()
+    return None
+
+
+def upload_image(image_path: str, method: str = "auto", use_cache: bool = True,
+                 resolution: str = None) -> Optional[str]:
     """
     Загрузить изображение на публичный URL
     
+    Если включена подготовка изображений (configure_upload_prep), на хостинг
+    уходит уменьшенная до resolution и пережатая копия. Если этот файл (по
+    содержимому) уже загружался и ссылка еще действует, возвращается
+    сохраненная ссылка без повторной загрузки.
+    
     Args:
         image_path: Путь к изображению
         method: Метод загрузки ("auto", "0x0", "tmpfiles", "fileio", "imgur")
-                "auto" - пробует методы по очереди, начиная с 0x0.st
+                "auto" - начинает с самого быстрого работающего хостинга
+                и подстраховывается остальными (см. upload_hedged)
+        use_cache: Использовать кэш ссылок (см. UploadCache)
+        resolution: Разрешение запроса, для которого загружается изображение
         
     Returns:
         URL изображения или None
     """
-    if method == "imgur":
-        # Требует API ключ, пока не реализовано
-        return None
-    elif method == "0x0":
-        return upload_to_0x0(image_path)
-    elif method == "fileio":
-        return upload_to_fileio(image_path)
-    elif method == "tmpfiles":
-        return upload_to_tmpfiles(image_path)
-    else:  # auto - пробуем методы по очереди, начиная с 0x0.st
-        # Пробуем 0x0.st (основной, самый надежный)
-        url = upload_to_0x0(image_path)
-        if url:
-            return url
+    preparer = get_upload_preparer()
+    if preparer is not None:
+        image_path = preparer.prepare(image_path, resolution)
+    
+    cache = None
+    digest = None
+    if use_cache:
+        try:
+            cache = get_upload_cache()
+            digest = file_digest(image_path)
+            url = cache.get(digest, None if method == "auto" else method)
+            if url:
+                return url
+        except Exception as e:
+            print(f"Ошибка кэша загрузок: {e}")
+            cache = None
+    
+    url = _upload(image_path, method)
+    if url and cache is not None:
+        try:
+            cache.put(digest, url, os.path.getsize(image_path))
+        except Exception as e:
+            print(f"Ошибка кэша загрузок: {e}")
+    return url
+
+
+def upload_images(image_paths: List[str], resolution: str = None,
+                  max_workers: int = MAX_PARALLEL_UPLOADS,
+                  uploader: Callable = None,
+                  on_done: Callable[[int, Optional[str]], None] = None) -> List[Optional[str]]:
+    """
+    Загрузить несколько изображений параллельно
+    
+    Изображения комбинирования и референсы загружаются одновременно (не
+    больше max_workers сразу), поэтому запрос с 8 изображениями ждет
+    примерно одну загрузку, а не восемь.
+    
+    Args:
+        image_paths: Пути к изображениям
+        resolution: Разрешение запроса (см. upload_image)
+        max_workers: Максимум одновременных загрузок
+        uploader: Функция (путь, resolution=...) -> URL; по умолчанию upload_image
+        on_done: Вызывается из потока загрузки как on_done(индекс, URL или None)
+                 по мере завершения каждой загрузки
         
-        # Пробуем tmpfiles как резервный
-        url = upload_to_tmpfiles(image_path)
-        if url:
-            return url
+    Returns:
+        URL в порядке image_paths; None для изображений, которые не удалось загрузить
+    """
+    uploader = uploader or upload_image
+    urls = [None] * len(image_paths)
+    if not image_paths:
+        return urls
+    
+    # Отдельный пул: загрузки внутри используют _upload_executor и не должны ждать сами себя
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(image_paths))),
+                            thread_name_prefix="upload-batch") as executor:
+        futures = {
+            executor.submit(uploader, image_path, resolution=resolution): index
+            for index, image_path in enumerate(image_paths)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                urls[index] = future.result()
+            except Exception as e:
+                print(f"Ошибка загрузки {Path(image_paths[index]).name}: {e}")
+            if on_done:
+                on_done(index, urls[index])
+    return urls
+
+
+class PreUploader:
+    """
+    Загрузка изображений заранее, как только пользователь их выбрал
+    
+    Пока пользователь пишет промпт, изображение уже загружается на хостинг.
+    Повторный запрос того же файла во время загрузки не запускает вторую,
+    а ждет начатую. Завершенные загрузки не хранятся: повторный запрос
+    проходит через upload_image, и UploadCache проверяет, что ссылка еще
+    действует (срок хранения хостинга, file.io - одно скачивание).
+    """
+    
+    def __init__(self, max_workers: int = MAX_PARALLEL_UPLOADS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pre-upload")
+        self._futures = {}  # {ключ файла: Future} - только идущие загрузки
+        self._lock = threading.Lock()
+    
+    def _key(self, image_path: str, resolution: str):
+        # Разрешение влияет на загружаемый файл, только если включена подготовка,
+        # и только через размер подготовленной копии: загрузка без разрешения
+        # и с разрешением по умолчанию - один и тот же файл
+        stat = os.stat(image_path)
+        max_side = max_side_for(resolution) if get_upload_preparer() is not None else None
+        return os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns, max_side
+    
+    def start(self, image_path: str, resolution: str = None) -> Future:
+        """
+        Начать загрузку в фоне (если файл еще не загружается)
         
-        # Пробуем file.io как последний вариант
-        url = upload_to_fileio(image_path)
-        if url:
-            return url
+        Args:
+            image_path: Путь к изображению
+            resolution: Разрешение запроса (см. upload_image)
+            
+        Returns:
+            Future с URL или None
+        """
+        key = self._key(image_path, resolution)
+        with self._lock:
+            future = self._futures.get(key)
+            started = future is None
+            if started:
+                future = self._executor.submit(upload_image, image_path, resolution=resolution)
+                self._futures[key] = future
+        if started:
+            # Вне блокировки: у завершенной Future callback вызывается сразу
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+    
+    def _forget(self, key, future: Future):
+        """Убрать завершенную загрузку (дальше ссылку выдает UploadCache)"""
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+    
+    def get(self, image_path: str, resolution: str = None, timeout: float = None) -> Optional[str]:
+        """
+        URL изображения: готовый, после завершения начатой загрузки или
+        после новой загрузки
         
+        Args:
+            image_path: Путь к изображению
+            resolution: Разрешение запроса (см. upload_image)
+            timeout: Максимальное время ожидания, секунд
+            
+        Returns:
+            URL изображения или None
+        """
+        try:
+            return self.start(image_path, resolution).result(timeout)
+        except Exception as e:
+            print(f"Ошибка загрузки {Path(image_path).name}: {e}")
+            return None
+
+
+_pre_uploader = None
+_pre_uploader_lock = threading.Lock()
+
+
+def get_pre_uploader() -> PreUploader:
+    """Общий загрузчик заранее выбранных изображений"""
+    global _pre_uploader
+    with _pre_uploader_lock:
+        if _pre_uploader is None:
+            _pre_uploader = PreUploader()
+        return _pre_uploader
+
+
+def _upload(image_path: str, method: str) -> Optional[str]:
+    """Загрузить изображение выбранным методом (без кэша)"""
+    if method == "imgur":
+        # Требует API ключ, пока не реализовано
         return None
+    elif method in UPLOADERS:
+        return _run_uploader(method, image_path)
+    else:  # auto - самый быстрый работающий хостинг, с подстраховкой остальными
+        return upload_hedged(image_path)
 
@@ -2,9 +2,16 @@
 Утилиты для работы с изображениями
 """
 import base64
+import os
+import threading
+import time
 from io import BytesIO
 from pathlib import Path
-from PIL import Image
+from uuid import uuid4
+from PIL import Image, features
+from utils.http_session import get_session
+from utils.image_pool import get_image_pool
+from utils.output_format import ARCHIVE_DIR, OutputEncoding, archive_path
 
 
 def image_to_base64(image_path: str) -> str:
@@ -26,94 +33,364 @@ def image_to_base64(image_path: str) -> str:
         return ""
 
 
+def _target_size(aspect_w: float, aspect_h: float, resolution: str):
+    """Итоговый размер по соотношению сторон: длинная сторона равна resolution"""
+    target_size = int(resolution)
+    if aspect_w >= aspect_h:
+        return target_size, int(target_size * aspect_h / aspect_w)
+    return int(target_size * aspect_w / aspect_h), target_size
+
+
+def fit_to_aspect_ratio(img: Image.Image, aspect_ratio: str, resolution: str = None) -> Image.Image:
+    """
+    Обрезать изображение в памяти до точного соотношения сторон
+    
+    Args:
+        img: Изображение
+        aspect_ratio: Соотношение сторон (например, "4:3", "16:9")
+        resolution: Разрешение (например, "2048") - опционально, для масштабирования
+    
+    Returns:
+        Новое изображение или то же самое, если менять нечего
+    """
+    # Парсим соотношение сторон
+    parts = aspect_ratio.split(':')
+    if len(parts) != 2:
+        raise ValueError(f"Неверное соотношение сторон: {aspect_ratio}")
+    
+    target_w = float(parts[0])
+    target_h = float(parts[1])
+    target_ratio = target_w / target_h
+    
+    current_w, current_h = img.size
+    current_ratio = current_w / current_h
+    
+    # Если соотношение уже правильное (с небольшой погрешностью), проверяем разрешение
+    if abs(current_ratio - target_ratio) >= 0.01:
+        # Нужно обрезать до нужного соотношения
+        # Вычисляем размеры обрезки (центрированная обрезка)
+        if current_ratio > target_ratio:
+            # Текущее изображение шире, обрезаем по ширине
+            new_w = int(current_h * target_ratio)
+            left = (current_w - new_w) // 2
+            img = img.crop((left, 0, left + new_w, current_h))
+        else:
+            # Текущее изображение выше, обрезаем по высоте
+            new_h = int(current_w / target_ratio)
+            top = (current_h - new_h) // 2
+            img = img.crop((0, top, current_w, top + new_h))
+    
+    # Если указано разрешение, масштабируем
+    if resolution:
+        final_size = _target_size(target_w, target_h, resolution)
+        if img.size != final_size:
+            img = img.resize(final_size, Image.Resampling.LANCZOS)
+    
+    return img
+
+
 def crop_to_aspect_ratio(image_path: str, aspect_ratio: str, resolution: str = None) -> bool:
     """
-    Обрезать изображение до точного соотношения сторон
+    Обрезать изображение на диске до точного соотношения сторон
     
     Args:
         image_path: Путь к изображению
         aspect_ratio: Соотношение сторон (например, "4:3", "16:9")
         resolution: Разрешение (например, "2048") - опционально, для масштабирования
-        
+    
     Returns:
         True если успешно, False иначе
     """
     try:
-        # Парсим соотношение сторон
-        parts = aspect_ratio.split(':')
-        if len(parts) != 2:
-            return False
-        
-        target_w = float(parts[0])
-        target_h = float(parts[1])
-        target_ratio = target_w / target_h
-        
-        # Открываем изображение
-        with Image.open(image_path) as img:
-            current_w, current_h = img.size
-            current_ratio = current_w / current_h
-            
-            # Если соотношение уже правильное (с небольшой погрешностью), проверяем разрешение
-            if abs(current_ratio - target_ratio) < 0.01:
-                # Соотношение правильное, но может нужно изменить размер
-                if resolution:
-                    target_size = int(resolution)
-                    # Вычисляем размеры на основе соотношения сторон
-                    if target_w >= target_h:
-                        new_w = target_size
-                        new_h = int(target_size * target_h / target_w)
-                    else:
-                        new_h = target_size
-                        new_w = int(target_size * target_w / target_h)
-                    
-                    if current_w != new_w or current_h != new_h:
-                        img_resized = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                        img_resized.save(image_path)
-                return True
-            
-            # Нужно обрезать до нужного соотношения
-            # Вычисляем размеры обрезки (центрированная обрезка)
-            if current_ratio > target_ratio:
-                # Текущее изображение шире, обрезаем по ширине
-                new_w = int(current_h * target_ratio)
-                new_h = current_h
-                left = (current_w - new_w) // 2
-                top = 0
-                right = left + new_w
-                bottom = current_h
-            else:
-                # Текущее изображение выше, обрезаем по высоте
-                new_w = current_w
-                new_h = int(current_w / target_ratio)
-                left = 0
-                top = (current_h - new_h) // 2
-                right = current_w
-                bottom = top + new_h
-            
-            # Обрезаем изображение
-            img_cropped = img.crop((left, top, right, bottom))
-            
-            # Если указано разрешение, масштабируем
-            if resolution:
-                target_size = int(resolution)
-                if target_w >= target_h:
-                    final_w = target_size
-                    final_h = int(target_size * target_h / target_w)
-                else:
-                    final_h = target_size
-                    final_w = int(target_size * target_w / target_h)
-                img_cropped = img_cropped.resize((final_w, final_h), Image.Resampling.LANCZOS)
-            
-            # Сохраняем обрезанное изображение
-            img_cropped.save(image_path)
-            return True
-            
+        get_image_pool().run(_crop_file, image_path, aspect_ratio, resolution)
+        return True
     except Exception as e:
         print(f"Ошибка обрезки изображения: {e}")
         return False
 
 
-def base64_to_image(base64_string: str, output_path: str, aspect_ratio: str = None, resolution: str = None, crop_to_aspect: bool = False):
+def _crop_file(image_path: str, aspect_ratio: str, resolution: str = None):
+    """Обрезка файла на диске (выполняется в пуле процессов)"""
+    with Image.open(image_path) as img:
+        result = fit_to_aspect_ratio(img, aspect_ratio, resolution)
+        if result is not img:
+            result.save(image_path)
+
+
+# Этапы обработки скачанного изображения
+PIPELINE_STAGES = ("download", "decode", "transform", "encode", "derivatives")
+
+_pipeline_stats = {stage: [0, 0.0] for stage in PIPELINE_STAGES}  # {этап: [число, секунд]}
+_pipeline_stats_lock = threading.Lock()
+
+
+def _record_stages(timings: dict):
+    with _pipeline_stats_lock:
+        for stage, seconds in timings.items():
+            stats = _pipeline_stats.setdefault(stage, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+
+
+def get_pipeline_stats() -> dict:
+    """
+    Время этапов сохранения результатов (скачивание, декодирование,
+    обрезка и масштабирование, кодирование) в этом процессе
+    
+    Returns:
+        Словарь {этап: {"count", "total_seconds", "avg_ms"}}
+    """
+    with _pipeline_stats_lock:
+        return {
+            stage: {
+                "count": count,
+                "total_seconds": round(total, 3),
+                "avg_ms": round(total / count * 1000, 1) if count else 0
+            }
+            for stage, (count, total) in _pipeline_stats.items()
+        }
+
+
+# Размер блока при скачивании результата
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _part_path(output_path: Path) -> Path:
+    """Временный файл рядом с output_path (переименовывается атомарно), свой у каждого писателя"""
+    return output_path.with_name(f".{output_path.name}.{os.getpid()}.{uuid4().hex}.part")
+
+
+def _remove_quietly(path: Path):
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+# Производные изображения для галереи: {вид: максимальная сторона}, от большего к меньшему
+DERIVATIVE_SIZES = {"preview": 1280, "thumbnail": 512}
+DERIVATIVES_DIR = "thumbs"  # Подпапка рядом с оригиналом
+DERIVATIVE_QUALITY = 80
+
+# WebP заметно меньше JPEG при том же качестве и поддерживает прозрачность
+DERIVATIVE_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+DERIVATIVE_EXTENSION = ".webp" if DERIVATIVE_FORMAT == "WEBP" else ".jpg"
+
+
+def derivative_path(image_path: str, kind: str) -> Path:
+    """Путь к производному изображению ("thumbnail" или "preview") для image_path"""
+    image_path = Path(image_path)
+    return image_path.parent / DERIVATIVES_DIR / f"{image_path.stem}.{kind}{DERIVATIVE_EXTENSION}"
+
+
+def make_derivatives(source, image_path: str) -> dict:
+    """
+    Создать миниатюру и превью изображения
+    
+    Уменьшение идет каскадом: превью строится из оригинала, миниатюра - из
+    превью, поэтому полноразмерное изображение обрабатывается один раз.
+    
+    Args:
+        source: Уже декодированное изображение или путь к файлу
+        image_path: Путь к оригиналу (рядом с ним создается папка thumbs)
+    
+    Returns:
+        Словарь {вид: {"path", "width", "height"}}
+    """
+    if isinstance(source, Image.Image):
+        image = source
+    else:
+        image = Image.open(source)
+        # Для JPEG декодер сразу уменьшает изображение кратно 2 (пиксели не нужны в полном размере)
+        image.draft("RGB", (max(DERIVATIVE_SIZES.values()),) * 2)
+        image.load()
+    
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    mode = "RGBA" if has_alpha and DERIVATIVE_FORMAT == "WEBP" else "RGB"
+    if image.mode != mode:
+        image = image.convert(mode)
+    
+    result = {}
+    for kind, max_side in DERIVATIVE_SIZES.items():
+        scale = max_side / max(image.size)
+        if scale < 1:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        
+        path = derivative_path(image_path, kind)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = _part_path(path)
+        try:
+            image.save(temp_path, format=DERIVATIVE_FORMAT, quality=DERIVATIVE_QUALITY)
+            os.replace(temp_path, path)
+        except Exception:
+            _remove_quietly(temp_path)
+            raise
+        result[kind] = {"path": str(path), "width": image.width, "height": image.height}
+    return result
+
+
+def find_derivatives(image_path: str) -> dict:
+    """
+    Уже созданные миниатюра и превью изображения
+    
+    Returns:
+        Словарь {вид: {"path", "width", "height"}} (только существующие файлы)
+    """
+    result = {}
+    for kind in DERIVATIVE_SIZES:
+        path = derivative_path(image_path, kind)
+        try:
+            # Читается только заголовок файла
+            with Image.open(path) as image:
+                result[kind] = {"path": str(path), "width": image.width, "height": image.height}
+        except (OSError, ValueError):
+            pass
+    return result
+
+
+def remove_derivatives(image_path: str):
+    """Удалить миниатюру, превью и архивный исходник изображения (при удалении оригинала)"""
+    for kind in DERIVATIVE_SIZES:
+        _remove_quietly(derivative_path(image_path, kind))
+    image_path = Path(image_path)
+    for archived in (image_path.parent / ARCHIVE_DIR).glob(f"{image_path.stem}.*"):
+        _remove_quietly(archived)
+
+
+def _add_derivatives(source, output_path, derivatives: dict, timings: dict):
+    """
+    Создать производные изображения; ошибка не мешает сохранению оригинала
+    
+    Из уже декодированного изображения - в текущем процессе (он сам
+    выполняется в пуле), из файла - задачей в пуле процессов.
+    """
+    started_at = time.perf_counter()
+    try:
+        if isinstance(source, Image.Image):
+            derivatives.update(make_derivatives(source, output_path))
+        else:
+            derivatives.update(get_image_pool().run(make_derivatives, source, str(output_path)))
+    except Exception as e:
+        print(f"Ошибка создания миниатюры: {e}")
+    timings["derivatives"] = time.perf_counter() - started_at
+
+
+def _archive_source(source, output_path: Path, source_format: str, encoding: OutputEncoding):
+    """
+    Сохранить исходный файл API в папку archive, если результат пережат с потерями
+    
+    Args:
+        source: Байты или путь к временному файлу (файл перемещается)
+    """
+    if not (encoding and encoding.archive) or encoding.lossless:
+        return
+    try:
+        path = archive_path(output_path, source_format)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(source, bytes):
+            path.write_bytes(source)
+        else:
+            os.replace(source, path)
+    except Exception as e:
+        print(f"Ошибка сохранения исходного файла в архив: {e}")
+
+
+def _write_image(source, output_path: str, aspect_ratio: str = None, resolution: str = None,
+                 crop_to_aspect: bool = False, timings: dict = None, derivatives: dict = None,
+                 encoding: OutputEncoding = None) -> str:
+    """
+    Декодировать изображение, при необходимости обрезать и сохранить
+    
+    Работа выполняется в пуле процессов (см. utils/image_pool.py): так
+    обработка параллельных задач не упирается в GIL. Время этапов и
+    производные изображения возвращаются из процесса пула и добавляются
+    в timings и derivatives здесь.
+    
+    Args:
+        source: Байты изображения или путь к файлу
+        output_path: Путь для сохранения
+        aspect_ratio, resolution, crop_to_aspect: См. url_to_image
+        timings: Словарь, в который добавляется время этапов, секунд
+        derivatives: Если передан, в него добавляются миниатюра и превью,
+                     построенные из уже декодированного изображения
+        encoding: Формат и сжатие результата (по умолчанию - по расширению
+                  output_path с настройками Pillow)
+    
+    Returns:
+        Формат исходного изображения
+    """
+    source_format, stage_timings, made = get_image_pool().run(
+        _encode_image, source, str(output_path), aspect_ratio, resolution, crop_to_aspect,
+        derivatives is not None, encoding
+    )
+    if timings is not None:
+        # Записываем вместе с этапами вызывающего (download в url_to_image)
+        timings.update(stage_timings)
+        stage_timings = timings
+    if derivatives is not None:
+        derivatives.update(made)
+    _record_stages(stage_timings)
+    return source_format
+
+
+def _encode_image(source, output_path: str, aspect_ratio: str, resolution: str, crop_to_aspect: bool,
+                  with_derivatives: bool, encoding: OutputEncoding):
+    """
+    Декодирование, обрезка, кодирование и производные (в процессе пула)
+    
+    Изображение декодируется и кодируется ровно по одному разу: обрезка и
+    масштабирование выполняются в памяти, без повторного чтения файла.
+    Файл записывается во временный и атомарно переименовывается.
+    
+    Returns:
+        (формат исходного изображения, время этапов, производные изображения)
+    """
+    timings = {}
+    derivatives = {}
+    
+    started_at = time.perf_counter()
+    image = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    image.load()
+    source_format = image.format
+    timings["decode"] = time.perf_counter() - started_at
+    
+    # Если указано соотношение сторон и включена опция обрезки, обрезаем
+    if aspect_ratio and crop_to_aspect:
+        started_at = time.perf_counter()
+        try:
+            image = fit_to_aspect_ratio(image, aspect_ratio, resolution)
+        except Exception as e:
+            print(f"Ошибка обрезки изображения: {e}")
+        timings["transform"] = time.perf_counter() - started_at
+    
+    # Создаем папку если её нет
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    started_at = time.perf_counter()
+    # Формат по расширению output_path (у временного файла расширение .part)
+    image_format = Image.registered_extensions().get(output_path.suffix.lower(), image.format)
+    temp_path = _part_path(output_path)
+    try:
+        if encoding is not None:
+            encoding.save(image, temp_path)
+        else:
+            image.save(temp_path, format=image_format)
+        os.replace(temp_path, output_path)
+    except Exception:
+        _remove_quietly(temp_path)
+        raise
+    timings["encode"] = time.perf_counter() - started_at
+    
+    if with_derivatives:
+        _add_derivatives(image, output_path, derivatives, timings)
+    
+    return source_format, timings, derivatives
+
+
+def base64_to_image(base64_string: str, output_path: str, aspect_ratio: str = None, resolution: str = None, crop_to_aspect: bool = False,
+                    derivatives: dict = None, encoding: OutputEncoding = None):
     """
     Сохранить base64 строку как изображение
     
@@ -123,60 +400,85 @@ def base64_to_image(base64_string: str, output_path: str, aspect_ratio: str = No
         aspect_ratio: Соотношение сторон для обрезки (опционально)
         resolution: Разрешение для масштабирования (опционально)
         crop_to_aspect: Если True, обрезать до точного соотношения сторон (по умолчанию False)
+        derivatives: Словарь, в который добавляются миниатюра и превью (опционально)
+        encoding: Формат и сжатие результата (опционально, см. url_to_image)
     """
     try:
         image_data = base64.b64decode(base64_string)
-        image = Image.open(BytesIO(image_data))
-        
-        # Создаем папку если её нет
-        output_path = Path(output_path)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Сохраняем изображение
-        image.save(output_path)
-        
-        # Если указано соотношение сторон и включена опция обрезки, обрезаем
-        if aspect_ratio and crop_to_aspect:
-            crop_to_aspect_ratio(str(output_path), aspect_ratio, resolution)
-        
+        source_format = _write_image(image_data, output_path, aspect_ratio, resolution, crop_to_aspect,
+                                     derivatives=derivatives, encoding=encoding)
+        _archive_source(image_data, Path(output_path), source_format, encoding)
         return True
     except Exception as e:
         print(f"Ошибка сохранения изображения: {e}")
         return False
 
 
-def url_to_image(url: str, output_path: str, aspect_ratio: str = None, resolution: str = None, crop_to_aspect: bool = False) -> bool:
+def url_to_image(url: str, output_path: str, aspect_ratio: str = None, resolution: str = None, crop_to_aspect: bool = False,
+                 timings: dict = None, derivatives: dict = None, encoding: OutputEncoding = None) -> bool:
     """
     Скачать изображение по URL и сохранить
     
+    Ответ пишется на диск блоками во временный файл, без загрузки в память
+    целиком. Если обрезка не нужна и формат изображения совпадает с
+    расширением output_path, файл просто переименовывается: изображение
+    не декодируется и не кодируется заново (проверяется только заголовок).
+    Иначе изображение кодируется в формат encoding; при encoding.archive
+    исходный файл API перемещается в папку archive рядом с результатом.
+    
     Args:
         url: URL изображения
         output_path: Путь для сохранения
         aspect_ratio: Соотношение сторон для обрезки (опционально)
         resolution: Разрешение для масштабирования (опционально)
         crop_to_aspect: Если True, обрезать до точного соотношения сторон (по умолчанию False)
-        
+        timings: Словарь, в который добавляется время этапов (download,
+                 decode, transform, encode, derivatives), секунд
+        derivatives: Если передан, в него добавляются миниатюра и превью
+                     {"thumbnail"|"preview": {"path", "width", "height"}}
+        encoding: Формат и сжатие результата; расширение output_path должно
+                  совпадать с encoding.extension
+    
     Returns:
         True если успешно, False иначе
     """
+    output_path = Path(output_path)
+    download_path = output_path.with_name(f".{output_path.name}.download")
     try:
-        import requests
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        image = Image.open(BytesIO(response.content))
-        output_path = Path(output_path)
+        timings = timings if timings is not None else {}
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        image.save(output_path)
         
-        # Если указано соотношение сторон и включена опция обрезки, обрезаем
-        if aspect_ratio and crop_to_aspect:
-            crop_to_aspect_ratio(str(output_path), aspect_ratio, resolution)
+        started_at = time.perf_counter()
+        with get_session(url).get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            with open(download_path, 'wb') as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        timings["download"] = time.perf_counter() - started_at
+        
+        # Проверяем только заголовок: Image.open не декодирует пиксели
+        with Image.open(download_path) as image:
+            source_format = image.format
         
+        if encoding is not None:
+            keeps_source = encoding.keeps_source(source_format)
+        else:
+            keeps_source = source_format == Image.registered_extensions().get(output_path.suffix.lower())
+        if not (aspect_ratio and crop_to_aspect) and keeps_source:
+            os.replace(download_path, output_path)
+            if derivatives is not None:
+                _add_derivatives(str(output_path), output_path, derivatives, timings)
+            _record_stages(timings)
+        else:
+            _write_image(str(download_path), output_path, aspect_ratio, resolution, crop_to_aspect, timings,
+                         derivatives, encoding)
+            _archive_source(str(download_path), output_path, source_format, encoding)
         return True
     except Exception as e:
         print(f"Ошибка загрузки изображения: {e}")
         return False
+    finally:
+        _remove_quietly(download_path)
 
 
 def get_image_info(image_path: str) -> dict:
@@ -0,0 +1,169 @@
+"""
+Формат, в котором сохраняются результаты генерации
+
+По умолчанию результаты сохраняются в PNG, как их отдает API. 4K PNG
+занимает несколько мегабайт, поэтому формат, качество и затраты CPU на
+сжатие настраиваются (см. OutputEncoding). Если результат пережимается
+с потерями, исходный файл можно сохранить в папку archive рядом с ним.
+"""
+import threading
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from PIL import Image, features
+
+
+# Форматы результата: {имя: (формат Pillow, расширение)}
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png"),
+    "jpeg": ("JPEG", ".jpg"),
+}
+if features.check("webp"):
+    OUTPUT_FORMATS["webp"] = ("WEBP", ".webp")
+# AVIF поддерживается Pillow 11.3+ (собранным с libavif)
+if "avif" in features.modules and features.check_module("avif"):
+    OUTPUT_FORMATS["avif"] = ("AVIF", ".avif")
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+DEFAULT_QUALITY = 90
+# Затраты CPU на сжатие: 0 - быстрее всего, MAX_EFFORT - файл меньше всего.
+# 6 соответствует настройкам Pillow по умолчанию для PNG, WebP и AVIF
+DEFAULT_EFFORT = 6
+MAX_EFFORT = 9
+
+ARCHIVE_DIR = "archive"  # Подпапка для исходных файлов рядом с результатом
+
+
+@dataclass(frozen=True)
+class OutputEncoding:
+    """Формат и параметры сжатия результата"""
+    format: str = "png"
+    quality: int = DEFAULT_QUALITY  # 1-100, для форматов с потерями (100 для WebP - без потерь)
+    effort: int = DEFAULT_EFFORT  # 0-MAX_EFFORT
+    archive: bool = False  # Сохранять исходный файл, если результат пережат с потерями
+    
+    def __post_init__(self):
+        if self.format not in OUTPUT_FORMATS:
+            raise ValueError(f"Неподдерживаемый формат результата: {self.format}. "
+                             f"Доступные: {', '.join(OUTPUT_FORMATS)}")
+        if not 1 <= self.quality <= 100:
+            raise ValueError("Качество должно быть от 1 до 100")
+        if not 0 <= self.effort <= MAX_EFFORT:
+            raise ValueError(f"Сжатие (effort) должно быть от 0 до {MAX_EFFORT}")
+    
+    @property
+    def pil_format(self) -> str:
+        return OUTPUT_FORMATS[self.format][0]
+    
+    @property
+    def extension(self) -> str:
+        return OUTPUT_FORMATS[self.format][1]
+    
+    @property
+    def lossless(self) -> bool:
+        return self.format == "png" or (self.format == "webp" and self.quality == 100)
+    
+    def keeps_source(self, source_format: str) -> bool:
+        """
+        Можно ли сохранить скачанный файл как есть, без перекодирования
+        
+        Файл в том же формате не пережимается повторно (для форматов с
+        потерями это только ухудшит качество). Исключение - PNG с
+        максимальным сжатием: его стоит пережать с optimize.
+        """
+        if source_format != self.pil_format:
+            return False
+        return not (self.format == "png" and self.effort == MAX_EFFORT)
+    
+    def with_overrides(self, format: str = None, quality=None, effort=None) -> "OutputEncoding":
+        """
+        Параметры с переопределениями из запроса
+        
+        Raises:
+            ValueError: Неверное значение параметра
+        """
+        changes = {}
+        if format:
+            format = str(format).lower()
+            changes["format"] = FORMAT_ALIASES.get(format, format)
+        try:
+            if quality not in (None, ""):
+                changes["quality"] = int(quality)
+            if effort not in (None, ""):
+                changes["effort"] = int(effort)
+        except (TypeError, ValueError):
+            raise ValueError("Качество и сжатие должны быть целыми числами")
+        return replace(self, **changes) if changes else self
+    
+    def cache_params(self) -> dict:
+        """Параметры для ключа кэша результатов (влияют на сохраненный файл)"""
+        return {"output_format": self.format, "output_quality": self.quality, "output_effort": self.effort}
+    
+    def save(self, image: Image.Image, path):
+        """
+        Закодировать изображение в path
+        
+        Args:
+            image: Изображение
+            path: Куда записать (файл или поток)
+        """
+        pil_format = self.pil_format
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        if pil_format == "JPEG":
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+        elif pil_format != "PNG" and image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        
+        effort = self.effort
+        if pil_format == "PNG":
+            # compress_level 0-9; optimize дополнительно подбирает фильтры (медленно)
+            image.save(path, pil_format, compress_level=effort, optimize=effort == MAX_EFFORT)
+        elif pil_format == "WEBP":
+            image.save(path, pil_format, quality=self.quality, lossless=self.quality == 100,
+                       method=round(effort * 6 / MAX_EFFORT))
+        elif pil_format == "AVIF":
+            # speed 10-4 (6 - по умолчанию в Pillow): меньшие значения кодируют 4K минутами
+            image.save(path, pil_format, quality=self.quality, speed=round(10 - effort * 2 / 3))
+        else:
+            image.save(path, pil_format, quality=self.quality,
+                       optimize=effort >= 3, progressive=effort >= 6)
+
+
+def archive_path(output_path, source_format: str) -> Path:
+    """Путь исходного файла результата в папке archive"""
+    output_path = Path(output_path)
+    extension = next((ext for pil_format, ext in OUTPUT_FORMATS.values() if pil_format == source_format),
+                     f".{source_format.lower()}")
+    return output_path.parent / ARCHIVE_DIR / f"{output_path.stem}{extension}"
+
+
+_output_encoding = OutputEncoding()
+_output_encoding_lock = threading.Lock()
+
+
+def configure_output_encoding(format: str = "png", quality: int = DEFAULT_QUALITY,
+                              effort: int = DEFAULT_EFFORT, archive: bool = False) -> OutputEncoding:
+    """
+    Задать формат результатов по умолчанию
+    
+    Неподдерживаемый формат (например, AVIF в старом Pillow) заменяется
+    на PNG с сообщением в лог.
+    
+    Returns:
+        Установленные параметры
+    """
+    global _output_encoding
+    try:
+        encoding = OutputEncoding(archive=archive).with_overrides(format, quality, effort)
+    except ValueError as e:
+        print(f"Неверные параметры формата результата, используется PNG: {e}")
+        encoding = OutputEncoding(archive=archive)
+    with _output_encoding_lock:
+        _output_encoding = encoding
+    return encoding
+
+
+def get_output_encoding() -> OutputEncoding:
+    """Формат результатов по умолчанию"""
+    return _output_encoding
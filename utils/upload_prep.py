@@ -0,0 +1,241 @@
+"""
+Подготовка изображений к загрузке на публичный хостинг
+
+Исходники для редактирования и комбинирования часто - многомегабайтные
+PNG, хотя модель использует изображение не больше выбранного разрешения.
+Перед загрузкой изображение уменьшается до этого размера и пережимается
+в JPEG (или WebP, если есть прозрачность) так, чтобы уложиться в лимит
+байт. Результат сохраняется по sha256 исходника и переиспользуется.
+"""
+import os
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional
+from uuid import uuid4
+
+from PIL import Image, ImageOps, features
+
+from utils.image_pool import get_image_pool
+from utils.path_utils import get_data_path
+from utils.upload_cache import file_digest
+
+
+# Максимальная сторона входного изображения для разрешения запроса
+MAX_SIDE_BY_RESOLUTION = {
+    "1024": 1024,
+    "2048": 2048,
+    "4096": 4096
+}
+# Для запросов без разрешения (редактирование)
+DEFAULT_MAX_SIDE = 2048
+
+# Лимит размера загружаемого файла
+DEFAULT_MAX_BYTES = 3 * 1024 * 1024
+
+# Качество, которое пробуется по очереди, пока файл не уложится в лимит
+QUALITY_STEPS = (90, 84, 78, 70, 60)
+# Если не помогло и минимальное качество - уменьшаем изображение
+SCALE_STEP = 0.8
+MIN_SIDE = 512
+
+# Подготовленные файлы старше этого срока удаляются
+MAX_AGE = 7 * 86400  # секунд
+
+
+def max_side_for(resolution: str = None) -> int:
+    """Максимальная сторона подготовленного изображения для разрешения запроса"""
+    return MAX_SIDE_BY_RESOLUTION.get(str(resolution), DEFAULT_MAX_SIDE)
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    """Есть ли в изображении прозрачность"""
+    if img.mode in ("RGBA", "LA"):
+        return img.getextrema()[-1][0] < 255
+    return img.mode == "P" and "transparency" in img.info
+
+
+def _encode(image_path: str, max_side: int, max_bytes: int, size_before: int):
+    """
+    Уменьшить и пережать изображение (выполняется в пуле процессов)
+    
+    Returns:
+        (байты файла, расширение) или (None, None), если исходник уже
+        подходит и пережатие его не уменьшает
+    """
+    with Image.open(image_path) as img:
+        source_format = img.format
+        needs_resize = max(img.size) > max_side
+        if (not needs_resize and size_before <= max_bytes
+                and source_format in ("JPEG", "WEBP")):
+            return None, None
+        
+        img = ImageOps.exif_transpose(img)
+        alpha = _has_alpha(img)
+        if alpha and features.check("webp"):
+            fmt, ext = "WEBP", "webp"
+            img = img.convert("RGBA")
+        elif alpha:
+            fmt, ext = "PNG", "png"
+            img = img.convert("RGBA")
+        else:
+            fmt, ext = "JPEG", "jpg"
+            img = img.convert("RGB")
+        if needs_resize:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        
+        data = None
+        while True:
+            for quality in (QUALITY_STEPS if fmt != "PNG" else (None,)):
+                buffer = BytesIO()
+                if fmt == "PNG":
+                    img.save(buffer, fmt, optimize=True)
+                else:
+                    img.save(buffer, fmt, quality=quality, optimize=fmt == "JPEG")
+                data = buffer.getvalue()
+                if len(data) <= max_bytes:
+                    break
+            if len(data) <= max_bytes or max(img.size) * SCALE_STEP < MIN_SIDE:
+                break
+            img = img.resize((max(1, int(img.width * SCALE_STEP)), max(1, int(img.height * SCALE_STEP))),
+                             Image.Resampling.LANCZOS)
+            needs_resize = True
+    
+    if not needs_resize and size_before <= max_bytes and len(data) >= size_before:
+        return None, None
+    return data, ext
+
+
+class UploadPreparer:
+    """Уменьшение и пережатие изображений перед загрузкой"""
+    
+    def __init__(self, cache_dir: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            cache_dir: Папка подготовленных файлов (по умолчанию data/upload_prep)
+            max_bytes: Лимит размера загружаемого файла
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else get_data_path() / "upload_prep"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.images = 0
+        self.optimized = 0
+        self.cache_hits = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.seconds = 0.0
+    
+    def prepare(self, image_path: str, resolution: str = None) -> str:
+        """
+        Подготовить изображение к загрузке
+        
+        Args:
+            image_path: Путь к исходному изображению
+            resolution: Разрешение запроса ("1024", "2048", "4096" или None)
+        
+        Returns:
+            Путь к файлу для загрузки (исходный, если пережимать нечего
+            или при ошибке)
+        """
+        started_at = time.monotonic()
+        max_side = max_side_for(resolution)
+        try:
+            size_before = os.path.getsize(image_path)
+            stem = f"{file_digest(image_path)}_{max_side}_{self.max_bytes}"
+            for cached in self.cache_dir.glob(f"{stem}.*"):
+                if cached.suffix == ".tmp":
+                    continue
+                os.utime(cached)  # продлеваем срок хранения (см. _cleanup)
+                self._count(size_before, cached.stat().st_size, started_at, cache_hit=True)
+                return str(cached)
+            
+            # Уменьшение и пережатие - в пуле процессов, не в потоке задачи
+            data, ext = get_image_pool().run(_encode, image_path, max_side, self.max_bytes, size_before)
+            if data is None:
+                self._count(size_before, size_before, started_at)
+                return image_path
+            
+            output_path = self.cache_dir / f"{stem}.{ext}"
+            # Свой временный файл у каждого писателя: тот же исходник могут
+            # одновременно готовить несколько загрузок (и воркеров gunicorn)
+            temp_path = output_path.with_name(f"{output_path.name}.{os.getpid()}.{uuid4().hex}.tmp")
+            try:
+                temp_path.write_bytes(data)
+                os.replace(temp_path, output_path)
+            except OSError:
+                temp_path.unlink(missing_ok=True)
+                raise
+            self._cleanup()
+            
+            self._count(size_before, len(data), started_at)
+            print(f"Изображение подготовлено к загрузке: {Path(image_path).name} "
+                  f"{size_before / 1024:.0f} КБ -> {len(data) / 1024:.0f} КБ")
+            return str(output_path)
+        except Exception as e:
+            print(f"Ошибка подготовки изображения к загрузке: {e}")
+            return image_path
+    
+    def _count(self, size_before: int, size_after: int, started_at: float, cache_hit: bool = False):
+        with self._lock:
+            self.images += 1
+            self.bytes_before += size_before
+            self.bytes_after += size_after
+            self.seconds += time.monotonic() - started_at
+            if cache_hit:
+                self.cache_hits += 1
+            elif size_after != size_before:
+                self.optimized += 1
+    
+    def _cleanup(self):
+        """Удалить давно не использованные подготовленные файлы"""
+        expire_before = time.time() - MAX_AGE
+        for path in self.cache_dir.iterdir():
+            try:
+                if path.stat().st_mtime < expire_before:
+                    path.unlink()
+            except OSError:
+                pass
+    
+    def get_stats(self) -> Dict:
+        """
+        Статистика подготовки
+        
+        Returns:
+            Словарь с числом изображений, байтами до и после и затраченным временем
+        """
+        with self._lock:
+            return {
+                "images": self.images,
+                "optimized": self.optimized,
+                "cache_hits": self.cache_hits,
+                "bytes_before": self.bytes_before,
+                "bytes_after": self.bytes_after,
+                "ratio": round(self.bytes_after / self.bytes_before, 3) if self.bytes_before else 1.0,
+                "seconds": round(self.seconds, 3),
+                "max_bytes": self.max_bytes
+            }
+
+
+_upload_preparer = None
+_upload_preparer_lock = threading.Lock()
+
+
+def configure_upload_prep(enabled: bool, max_bytes: int = None, cache_dir: str = None):
+    """
+    Включить или выключить подготовку изображений перед загрузкой
+    
+    Args:
+        enabled: Уменьшать и пережимать изображения перед upload_image
+        max_bytes: Лимит размера загружаемого файла (None - DEFAULT_MAX_BYTES)
+        cache_dir: Папка подготовленных файлов
+    """
+    global _upload_preparer
+    with _upload_preparer_lock:
+        _upload_preparer = UploadPreparer(cache_dir, max_bytes or DEFAULT_MAX_BYTES) if enabled else None
+
+
+def get_upload_preparer() -> Optional[UploadPreparer]:
+    """Текущая подготовка изображений (None - выключена)"""
+    return _upload_preparer